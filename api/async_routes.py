@@ -0,0 +1,104 @@
+from fastapi import APIRouter, BackgroundTasks, Request, status
+from fastapi.responses import JSONResponse
+from typing import Any
+
+from models.experiments import ExperimentCreate, ExperimentResponse, ExperimentAssignmentResponse
+from models.events import EventCreate
+from models.results import ExperimentResultsSummary
+from services import async_assignment, async_results, events
+from services.cache import AsyncCacheClient
+from data.async_database import get_async_session_factory
+from api.depends import CLIENT_AUTH, ASYNC_DB_DEPENDENCY, ASYNC_CACHE_CLIENT
+from api.routing import TimedRoute
+from api.experiment_routes import parse_results_start, results_response
+from api.events_routes import accept_event
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Async versions of the hot routes of experiment_routes and events_routes, registered in
+# front of them when config.async_mode is on. They run on the event loop with the async
+# engine and Valkey client instead of holding a threadpool thread per request.
+# Routes without an async version (e.g. batch assignments) keep being served by the sync routers.
+
+async_experiment_router = APIRouter(
+    prefix="/experiments",
+    tags=["experiments"],
+    dependencies=[CLIENT_AUTH],
+    route_class=TimedRoute,
+)
+
+async_events_router = APIRouter(
+    prefix="/events",
+    tags=["events"],
+    dependencies=[CLIENT_AUTH],
+    route_class=TimedRoute,
+)
+
+
+# POST /experiments
+@async_experiment_router.post("", response_model=ExperimentResponse, status_code=status.HTTP_201_CREATED)
+async def create_experiment_route(
+    experiment_data: ExperimentCreate,
+    db=ASYNC_DB_DEPENDENCY,
+    cache: AsyncCacheClient = ASYNC_CACHE_CLIENT
+):
+    """Create a new experiment with variants and traffic allocation."""
+    return await async_assignment.create_new_experiment(db, cache, experiment_data)
+
+
+# GET /experiments/{experiment_id}/assignment/{user_id}
+@async_experiment_router.get("/{experiment_id}/assignment/{user_id}", response_model=ExperimentAssignmentResponse)
+async def get_user_assignment_route(
+    experiment_id: int,
+    user_id: str,
+    db=ASYNC_DB_DEPENDENCY,
+    cache: AsyncCacheClient = ASYNC_CACHE_CLIENT
+):
+    """Get user's variant assignment. Performs assignment if none exists."""
+    return await async_assignment.get_or_create_assignment(db, cache, experiment_id, user_id)
+
+
+# GET /experiments/{id}/results
+@async_experiment_router.get("/{experiment_id}/results", response_model=ExperimentResultsSummary)
+async def get_experiment_results_route(
+    experiment_id: int,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    db=ASYNC_DB_DEPENDENCY,
+    cache: AsyncCacheClient = ASYNC_CACHE_CLIENT,
+    event_type: str = "purchase",
+    start_date: str | None = None,
+    last_day: int | None = None,
+    raw: bool = False
+):
+    """
+    Retrieve experiment performance summary, only counting events after assignment.
+    Responses carry a strong ETag, a matching If-None-Match is answered with 304.
+    """
+    try:
+        start_datetime = parse_results_start(start_date, last_day)
+    except Exception as e:
+        logger.info("datetime conversion error: %s", str(e))
+        return JSONResponse(content={"status": "failed", "error": str(e)}, status_code=status.HTTP_400_BAD_REQUEST)
+
+    if raw:
+        entry = await async_results.compute_results_entry(db, experiment_id, event_type, start_datetime, use_rollups=False)
+    else:
+        entry = await async_results.get_cached_summary(
+            db, get_async_session_factory(), cache, background_tasks, experiment_id, event_type, start_datetime
+        )
+
+    return results_response(request, entry)
+
+
+# POST /events
+@async_events_router.post("", status_code=status.HTTP_200_OK)
+async def record_event_route(event_data: EventCreate):
+    """
+    Record a conversion event (click, purchase, signup) for a user, see events_routes.
+    No database session is opened, the celery worker does the insert.
+    """
+    task_payload: dict[str, Any] = events.build_task_payload(event_data)
+    return await accept_event(task_payload)
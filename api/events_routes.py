@@ -1,16 +1,20 @@
-from fastapi import APIRouter, status
+from fastapi import APIRouter, Request, status
 from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
 from typing import Any
-from datetime import datetime
 from data.database import Event
 from models.events import EventCreate, EventResponse
-from api.depends import CLIENT_AUTH, DB_DEPENDENCY
+from services import events
+from services.backpressure import IngestionOverloaded, get_ingestion_admission
+from services.event_buffer import get_event_buffer
+from services.event_stream import EVENT_TRANSPORT_STREAM, get_event_stream
+from api.depends import CLIENT_AUTH
+from api.routing import TimedRoute
 from config import config # initialize logging
 
-# Import the Celery task
-from celery_tasks.event_tasks import insert_event_to_db
-import json
+# Import the Celery tasks
+from celery_tasks.event_tasks import insert_event_to_db, insert_events_to_db
+import kombu.exceptions
+import redis
 import logging
 
 logger = logging.getLogger(__name__)
@@ -19,38 +23,188 @@ events_router = APIRouter(
     prefix="/events",
     tags=["events"],
     # You can add common dependencies here if needed for ALL experiment routes
-    dependencies=[CLIENT_AUTH]
+    dependencies=[CLIENT_AUTH],
+    route_class=TimedRoute,
 )
 
 # POST /events (Events remain on the main app as a separate concern)
 @events_router.post("", status_code=status.HTTP_200_OK)
-def record_event_route(
-    event_data: EventCreate,
-    db: Session = DB_DEPENDENCY
-):
+async def record_event_route(event_data: EventCreate):
     """
     Record a conversion event (click, purchase, signup) for a user.
     This will go stright to a celery worker and return immediately with 200 OK
     The celery worker then will insert to events table.
+    No database session is opened. With EVENT_BUFFER=true, or EVENT_TRANSPORT=stream,
+    the event is answered with 202 Accepted before it reaches the broker / stream.
     """
-    
-    # Convert Pydantic properties dict to JSON string for SQLite storage
-    properties_json = json.dumps(event_data.properties) if event_data.properties else None
- 
+
     # Prepare the dictionary payload for the task (must be JSON serializable)
-    task_payload: dict[str, Any] = {
-        'user_id': event_data.user_id,
-        'type': event_data.type,
-        # Celery requires simple serializable types (like string for datetime)
-        'timestamp': event_data.timestamp.isoformat() if isinstance(event_data.timestamp, datetime) else event_data.timestamp,
-        'properties_json': properties_json
-    }
-    
-    # 2. Call the Celery task asynchronously
-    # .delay() is non-blocking and immediately returns a successful response (200 OK)
-    task = insert_event_to_db.delay(task_payload)
+    task_payload: dict[str, Any] = events.build_task_payload(event_data)
+    return await accept_event(task_payload)
+
+
+async def accept_event(task_payload: dict[str, Any]) -> JSONResponse:
+    """Hand one event to the configured transport, shared with the async_mode route."""
+    admission = get_ingestion_admission()
+    try:
+        admission.check()
+    except IngestionOverloaded as e:
+        return overloaded_response(e)
+
+    if config.event_transport == EVENT_TRANSPORT_STREAM:
+        # The XADD round-trip blocks, keep it off the event loop
+        return await admission.run(stream_event_response, task_payload)
+
+    if config.event_buffer:
+        # Published with the other buffered events by the flusher thread
+        if not get_event_buffer().add(task_payload):
+            return overloaded_response(IngestionOverloaded("event_buffer", admission.retry_after))
+        return JSONResponse(content={"status": "accepted"}, status_code=status.HTTP_202_ACCEPTED)
+
+    # .delay() blocks on the broker, keep it off the event loop and off the shared threadpool
+    try:
+        task = await admission.run(insert_event_to_db.delay, task_payload)
+    except kombu.exceptions.OperationalError as e:
+        logger.error("event task publish failed: %s", str(e))
+        return JSONResponse(
+            content={"status": "failed", "error": "event broker unavailable"},
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
     logger.debug(f"insert_event_to_db task result:{task}")
 
-    # 3. Return the task id
+    # Return the task id
     return JSONResponse(content={"status": "success", "task_id": task.id}, status_code=status.HTTP_200_OK)
-    
+
+
+# POST /events/batch
+@events_router.post("/batch", status_code=status.HTTP_200_OK)
+async def record_events_batch_route(request: Request):
+    """
+    Record many events in one request, as a JSON array or an NDJSON stream
+    (Content-Type: application/x-ndjson). Events are validated as the body streams in
+    and enqueued in batches of events.EVENT_TASK_BATCH_SIZE per celery task
+    (or appended to the events stream with EVENT_TRANSPORT=stream, answered with 202).
+    Invalid events are reported in "rejected" with their zero based index.
+    The body is not held back: a malformed (400) or too large (413) body is only noticed
+    as it streams in, the chunks of events enqueued before stay accepted and are reported
+    in "accepted" and "task_ids" of the error response.
+    """
+    use_stream = config.event_transport == EVENT_TRANSPORT_STREAM
+    admission = get_ingestion_admission()
+    try:
+        admission.check()
+    except IngestionOverloaded as e:
+        return overloaded_response(e)
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in events.NDJSON_CONTENT_TYPES:
+        items = events.iter_ndjson(request.stream())
+    else:
+        items = events.iter_json_array(request.stream())
+
+    accepted = 0
+    rejected: list[dict[str, Any]] = []
+    task_ids: list[str] = []
+    pending: list[dict[str, Any]] = []
+
+    async def enqueue(batch: list[dict[str, Any]]):
+        if use_stream:
+            # One pipelined XADD per chunk, no task id: the worker reads the events in blocks
+            await admission.run(get_event_stream().publish, batch)
+            return
+        # .delay() blocks on the broker, keep it off the event loop
+        task = await admission.run(insert_events_to_db.delay, batch)
+        task_ids.append(task.id)
+
+    try:
+        index = -1
+        async for index, item in _enumerate(items):
+            if index >= events.MAX_EVENTS_PER_BATCH:
+                raise events.EventBatchTooLarge(f"A batch holds at most {events.MAX_EVENTS_PER_BATCH} events.")
+
+            event_data, errors = events.validate_event(item)
+            if errors:
+                rejected.append({"index": index, "errors": errors})
+                continue
+
+            pending.append(events.build_task_payload(event_data))
+            accepted += 1
+            if len(pending) >= events.EVENT_TASK_BATCH_SIZE:
+                await enqueue(pending)
+                pending = []
+
+        if pending:
+            await enqueue(pending)
+    except events.EventBatchFormatError as e:
+        # The events not enqueued yet are dropped
+        logger.info("events batch format error after %d events: %s", index + 1, str(e))
+        return JSONResponse(
+            content={"status": "failed", "error": str(e), "accepted": accepted - len(pending), "task_ids": task_ids},
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
+    except events.EventBatchTooLarge as e:
+        return JSONResponse(
+            content={"status": "failed", "error": str(e), "accepted": accepted - len(pending), "task_ids": task_ids},
+            status_code=status.HTTP_413_CONTENT_TOO_LARGE
+        )
+    except redis.RedisError as e:
+        # Only the stream transport gets here, the events published so far are kept
+        accepted -= len(pending)
+        logger.error("event stream publish failed after %d events: %s", accepted, str(e))
+        return JSONResponse(
+            content={"status": "failed", "error": "event stream unavailable", "accepted": accepted, "task_ids": task_ids},
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    except kombu.exceptions.OperationalError as e:
+        # The broker is unreachable, the tasks enqueued so far are kept
+        accepted -= len(pending)
+        logger.error("event task publish failed after %d events: %s", accepted, str(e))
+        return JSONResponse(
+            content={"status": "failed", "error": "event broker unavailable", "accepted": accepted, "task_ids": task_ids},
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+
+    logger.debug("events batch: %d accepted, %d rejected, tasks: %s", accepted, len(rejected), task_ids)
+
+    if not rejected:
+        result_status = "success"
+    else:
+        result_status = "partial" if accepted else "failed"
+
+    if accepted or not rejected:
+        status_code = status.HTTP_202_ACCEPTED if use_stream else status.HTTP_200_OK
+    else:
+        status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    return JSONResponse(
+        content={"status": result_status, "accepted": accepted, "rejected": rejected, "task_ids": task_ids},
+        status_code=status_code
+    )
+
+
+def overloaded_response(overloaded: IngestionOverloaded) -> JSONResponse:
+    """429 telling the client when to retry, the request was not accepted."""
+    logger.warning("ingestion overloaded (%s), shedding request", overloaded.reason)
+    return JSONResponse(
+        content={"status": "failed", "error": f"ingestion overloaded: {overloaded.reason}"},
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={"Retry-After": str(overloaded.retry_after)}
+    )
+
+
+def stream_event_response(task_payload: dict[str, Any]) -> JSONResponse:
+    """Append one event to the events stream: 202 once Valkey has it, 503 when it is unreachable."""
+    try:
+        entry_ids = get_event_stream().publish([task_payload])
+    except redis.RedisError as e:
+        logger.error("event stream publish failed: %s", str(e))
+        return JSONResponse(
+            content={"status": "failed", "error": "event stream unavailable"},
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    return JSONResponse(content={"status": "accepted", "entry_id": entry_ids[0]}, status_code=status.HTTP_202_ACCEPTED)
+
+
+async def _enumerate(items):
+    index = 0
+    async for item in items:
+        yield index, item
+        index += 1
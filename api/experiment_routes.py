@@ -1,14 +1,15 @@
-from fastapi import APIRouter, status
+from fastapi import APIRouter, BackgroundTasks, Request, Response, status
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 
 # Internal/Service Imports (These must match your actual project structure)
-from models.experiments import ExperimentCreate, ExperimentResponse, ExperimentAssignmentResponse
+from models.experiments import ExperimentCreate, ExperimentResponse, ExperimentAssignmentResponse, BatchAssignmentRequest
 from models.results import ExperimentResultsSummary, VariantResult
 from services import assignment, results
 from services.cache import CacheClient
 from api.depends import CLIENT_AUTH, DB_DEPENDENCY, CACHE_CLIENT
+from api.routing import TimedRoute
 
 import logging
 
@@ -19,6 +20,7 @@ experiment_router = APIRouter(
     prefix="/experiments",
     tags=["experiments"],
     dependencies=[CLIENT_AUTH], # CLIENT_AUTH is now applied to all routes in this router
+    route_class=TimedRoute,
 )
 
 
@@ -30,10 +32,11 @@ experiment_router = APIRouter(
 )
 def create_experiment_route(
     experiment_data: ExperimentCreate, 
-    db: Session = DB_DEPENDENCY       # client_token is implicit from router dependencies
+    db: Session = DB_DEPENDENCY,      # client_token is implicit from router dependencies
+    cache: CacheClient = CACHE_CLIENT
 ):
     """Create a new experiment with variants and traffic allocation."""
-    return assignment.create_new_experiment(db, experiment_data)
+    return assignment.create_new_experiment(db, cache, experiment_data)
 
 
 # GET /experiments/{experiment_id}/assignment/{user_id} (The Idempotent Logic)
@@ -48,27 +51,37 @@ def get_user_assignment_route(
     return assignment.get_or_create_assignment(db, cache, experiment_id, user_id)
 
 
+# POST /experiments/{experiment_id}/assignments (Batch version of the above)
+@experiment_router.post("/{experiment_id}/assignments", response_model=list[ExperimentAssignmentResponse])
+def get_batch_assignments_route(
+    experiment_id: int,
+    batch: BatchAssignmentRequest,
+    db: Session = DB_DEPENDENCY,        # client_token is implicit from router dependencies
+    cache: CacheClient = CACHE_CLIENT
+):
+    """Get or create the assignments of many users for one experiment, in request order."""
+    return assignment.get_or_create_assignments(db, cache, experiment_id, batch.user_ids)
+
+
 # GET /experiments/{id}/results
 @experiment_router.get("/{experiment_id}/results", response_model=ExperimentResultsSummary)
 def get_experiment_results_route(
     experiment_id: int, 
+    request: Request,
+    background_tasks: BackgroundTasks,
     db: Session = DB_DEPENDENCY,        # client_token is implicit from router dependencies
+    cache: CacheClient = CACHE_CLIENT,
     event_type: str = "purchase",       # Default conversion type
     start_date: str | None = None,      # YYYY-MM-DDTHH:MM:SS
-    last_day: int | None = None         # eg: 7 for 7day
+    last_day: int | None = None,        # eg: 7 for 7day
+    raw: bool = False                   # exact join instead of the rollups
 ):
     """
     Retrieve experiment performance summary, only counting events after assignment.
+    Responses carry a strong ETag, a matching If-None-Match is answered with 304.
     """
-    start_datetime = None
-
     try:
-        # last days will override start_date
-        if last_day:
-            today = datetime.now()
-            start_datetime = today - timedelta(last_day)
-        elif start_date:
-            start_datetime = datetime.fromisoformat(start_date)
+        start_datetime = parse_results_start(start_date, last_day)
     except ValueError as e:
         logger.info("datetime conversion ValueError error: %s", str(e))
         return JSONResponse(content={"status": "failed", "error": str(e)}, status_code=status.HTTP_400_BAD_REQUEST)
@@ -77,9 +90,39 @@ def get_experiment_results_route(
         return JSONResponse(content={"status": "failed", "error": str(e)}, status_code=status.HTTP_400_BAD_REQUEST)
     
 
-    return results.calculate_summary(
-        db=db, 
-        experiment_id=experiment_id, 
-        event_type=event_type, 
-        start_datetime=start_datetime
-    )
\ No newline at end of file
+    if raw:
+        entry = results.compute_results_entry(db, experiment_id, event_type, start_datetime, use_rollups=False)
+    else:
+        entry = results.get_cached_summary(db, cache, background_tasks, experiment_id, event_type, start_datetime)
+
+    return results_response(request, entry)
+
+
+def parse_results_start(start_date: str | None, last_day: int | None) -> datetime | None:
+    """Start of the results window, last_day overrides start_date. Raises ValueError."""
+    # last days will override start_date
+    if last_day:
+        today = datetime.now()
+        return today - timedelta(last_day)
+    elif start_date:
+        return datetime.fromisoformat(start_date)
+    return None
+
+
+def results_response(request: Request, entry: dict) -> Response:
+    """Results cache entry as a response, 304 when the client already has it."""
+    headers = {"ETag": entry["etag"], "Cache-Control": "private, no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), entry["etag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=entry["body"], media_type="application/json", headers=headers)
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """If-None-Match uses the weak comparison: W/ prefixes are ignored, "*" matches anything."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
\ No newline at end of file
@@ -0,0 +1,30 @@
+from fastapi import APIRouter
+from sqlalchemy.orm import Session
+
+from models.experiments import ExperimentAssignmentResponse
+from services import assignment
+from services.cache import CacheClient
+from api.depends import CLIENT_AUTH, DB_DEPENDENCY, CACHE_CLIENT
+from api.routing import TimedRoute
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+users_router = APIRouter(
+    prefix="/users",
+    tags=["users"],
+    dependencies=[CLIENT_AUTH], # CLIENT_AUTH is applied to all routes in this router
+    route_class=TimedRoute,
+)
+
+
+# GET /users/{user_id}/assignments
+@users_router.get("/{user_id}/assignments", response_model=list[ExperimentAssignmentResponse])
+def get_user_assignments_route(
+    user_id: str,
+    db: Session = DB_DEPENDENCY,        # client_token is implicit from router dependencies
+    cache: CacheClient = CACHE_CLIENT
+):
+    """Get user's variant assignments for every active experiment. Performs assignment if none exists."""
+    return assignment.get_or_create_user_assignments(db, cache, user_id)
@@ -0,0 +1,60 @@
+from typing import NamedTuple
+from config import config
+import hashlib
+import threading
+
+
+class ApiClient(NamedTuple):
+    """An integration allowed to call the API, rate is 0 when it is not rate limited."""
+    name: str
+    rate: float     # requests per second refilled into the bucket
+    burst: float    # bucket size
+
+
+def token_digest(token: str) -> bytes:
+    """Tokens are only kept as SHA-256 digests, a lookup is one hash and one dict probe."""
+    return hashlib.sha256(token.encode()).digest()
+
+
+class ClientRegistry:
+    """
+    The API tokens of config.valid_tokens as a dict of token digest -> ApiClient.
+
+    Tokens given as a list get a name derived from their digest ("client-1a2b3c4d"),
+    a JSON object of name -> token names them. Rate limits come from
+    config.rate_limit_rate/burst, overridden per name by config.client_rate_limits.
+    """
+
+    def __init__(self, tokens: list[str] | dict[str, str], rate_limits: dict[str, dict] | None = None, rate: float = 0, burst: float = 0):
+        if isinstance(tokens, dict):
+            named = tokens.items()
+        else:
+            named = ((f"client-{token_digest(token).hex()[:8]}", token) for token in tokens)
+
+        self._clients: dict[bytes, ApiClient] = {}
+        for name, token in named:
+            limits = (rate_limits or {}).get(name, {})
+            client_rate = float(limits.get("rate", rate))
+            client_burst = float(limits.get("burst", burst)) or client_rate
+            self._clients[token_digest(token)] = ApiClient(name, client_rate, client_burst)
+
+    def authenticate(self, token: str) -> ApiClient | None:
+        return self._clients.get(token_digest(token))
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+
+_registry: ClientRegistry | None = None
+_registry_source: tuple | None = None
+_registry_lock = threading.Lock()
+
+def get_client_registry() -> ClientRegistry:
+    """Registry of the current config, rebuilt when the token or rate limit settings are replaced."""
+    global _registry, _registry_source
+    source = (config.valid_tokens, config.client_rate_limits, config.rate_limit_rate, config.rate_limit_burst)
+    if _registry is None or any(a is not b for a, b in zip(source, _registry_source)):
+        with _registry_lock:
+            _registry = ClientRegistry(*source)
+            _registry_source = source
+    return _registry
@@ -0,0 +1,140 @@
+from auth.clients import ApiClient
+from services.cache import RealValkeyBackend, VALKEY_BACKEND
+from typing import Any, NamedTuple
+from config import config
+import math
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Supported values for config.rate_limit_backend
+RATE_LIMIT_LOCAL = "local"     # buckets per process
+RATE_LIMIT_VALKEY = "valkey"   # buckets shared by every API worker
+
+# Refill and take one token atomically, on the server clock so workers never disagree.
+# Returns {allowed, tokens left}, the tokens as a string: Lua numbers are truncated to integers.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    limit: int          # bucket size
+    remaining: int      # whole tokens left
+    reset: float        # seconds until the bucket is full again
+    retry_after: float  # seconds until the next token, 0 when allowed
+
+
+def bucket_result(client: ApiClient, allowed: bool, tokens: float) -> RateLimitResult:
+    return RateLimitResult(
+        allowed=allowed,
+        limit=int(client.burst),
+        remaining=int(tokens),
+        reset=(client.burst - tokens) / client.rate,
+        retry_after=0.0 if allowed else (1 - tokens) / client.rate
+    )
+
+
+class RateLimiter:
+    """
+    Per-client token buckets, checked once per authenticated request.
+
+    Buckets live in this process, or with the valkey backend in one Valkey hash per
+    client updated by TOKEN_BUCKET_SCRIPT. When Valkey fails the process falls back to
+    its own buckets rather than rejecting (or admitting) every request.
+    Usage counters are per process, like the other /stats sections.
+    """
+
+    def __init__(self, backend: str = RATE_LIMIT_LOCAL, valkey_client=None):
+        self.backend = backend
+        self._script = None
+        if backend == RATE_LIMIT_VALKEY:
+            if valkey_client is None:
+                logger.warning("RATE_LIMIT_BACKEND=valkey without a Valkey connection, using per-process buckets.")
+            else:
+                self._script = valkey_client.register_script(TOKEN_BUCKET_SCRIPT)
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+        # Stats
+        self.usage: dict[str, dict[str, int]] = {}
+        self.shared_failures = 0
+
+    def check(self, client: ApiClient) -> RateLimitResult | None:
+        """Take one token of the client's bucket, None when the client is not rate limited."""
+        result = None
+        if client.rate > 0:
+            result = self._take_shared(client) if self._script is not None else None
+            if result is None:
+                result = self._take_local(client)
+
+        with self._lock:
+            usage = self.usage.setdefault(client.name, {"requests": 0, "limited": 0})
+            usage["requests"] += 1
+            if result is not None and not result.allowed:
+                usage["limited"] += 1
+        return result
+
+    def _take_local(self, client: ApiClient) -> RateLimitResult:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(client.name, (client.burst, now))
+            tokens = min(client.burst, tokens + (now - updated_at) * client.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[client.name] = (tokens, now)
+        return bucket_result(client, allowed, tokens)
+
+    def _take_shared(self, client: ApiClient) -> RateLimitResult | None:
+        try:
+            allowed, tokens = self._script(keys=[f"ratelimit:{client.name}"], args=[client.rate, client.burst])
+        except Exception as e:
+            self.shared_failures += 1
+            logger.error("Valkey rate limit error for client %s: %s", client.name, e)
+            return None
+        return bucket_result(client, bool(allowed), float(tokens))
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            usage = {name: dict(counters) for name, counters in self.usage.items()}
+        return {"backend": self.backend, "shared_failures": self.shared_failures, "clients": usage}
+
+
+def rate_limit_headers(result: RateLimitResult) -> dict[str, str]:
+    headers = {
+        "X-RateLimit-Limit": str(result.limit),
+        "X-RateLimit-Remaining": str(result.remaining),
+        "X-RateLimit-Reset": str(math.ceil(result.reset)),
+    }
+    if not result.allowed:
+        headers["Retry-After"] = str(max(1, math.ceil(result.retry_after)))
+    return headers
+
+
+_limiter: RateLimiter | None = None
+
+def get_rate_limiter() -> RateLimiter:
+    global _limiter
+    if _limiter is None:
+        valkey_client = VALKEY_BACKEND.client if isinstance(VALKEY_BACKEND, RealValkeyBackend) else None
+        _limiter = RateLimiter(config.rate_limit_backend, valkey_client)
+    return _limiter
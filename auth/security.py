@@ -1,20 +1,39 @@
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi import Depends, HTTPException, status
-from config import config
+from fastapi import Depends, HTTPException, Request, status
+from auth.clients import get_client_registry
+from auth.rate_limit import get_rate_limiter, rate_limit_headers
+import timing
 
-# This list would typically be loaded securely from a .env file
+# Tokens come from VALID_TOKENS, see auth.clients.ClientRegistry
 # VALID_TOKENS = {"my_secret_api_key_123"} 
 
 # Instantiate the HTTP Bearer scheme
 bearer_scheme = HTTPBearer()
 
-def get_current_client(credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
-    """Validates the Bearer token for every secured endpoint."""
-    if credentials.scheme != "Bearer" or credentials.credentials not in config.valid_tokens:
+@timing.timed("auth")
+def get_current_client(request: Request, credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
+    """
+    Validates the Bearer token for every secured endpoint and takes one token of the
+    client's rate limit bucket, 429 when it is empty. The X-RateLimit-* headers are
+    added to the response by the RequestIDMiddleware.
+    """
+    client = get_client_registry().authenticate(credentials.credentials) if credentials.scheme == "Bearer" else None
+    if client is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid or missing Bearer token.",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    # Returns the token value, which can be used to identify the client if needed
-    return credentials.credentials
\ No newline at end of file
+
+    result = get_rate_limiter().check(client)
+    if result is not None:
+        headers = rate_limit_headers(result)
+        if not result.allowed:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Rate limit exceeded.",
+                headers=headers,
+            )
+        request.state.rate_limit_headers = headers
+    # Returns the client name, which can be used to identify the client if needed
+    return client.name
@@ -0,0 +1,246 @@
+"""
+Offline bulk importer for historical events and assignments (NDJSON files).
+
+    uv run python backfill.py events events.ndjson --workers 4
+    uv run python backfill.py assignments assignments.ndjson --chunk-size 20000
+    uv run python backfill.py bloom --experiment-id 1 --reset
+
+Events lines use the POST /events body: {"user_id", "type", "timestamp", "properties"}.
+Assignments lines: {"experiment_id", "user_id", "variant_name", "assigned_at"}.
+Lines without a timestamp (assigned_at) are rejected. "loaded" counts the rows inserted,
+assignments already in the table are skipped.
+
+The file is streamed in chunks of --chunk-size lines and every chunk is loaded by
+a process pool worker. Postgres is loaded with COPY FROM STDIN (assignments through a
+staging table + ON CONFLICT DO NOTHING to keep the unique constraint), other
+databases (SQLite) with a batched executemany. SQLite allows a single writer,
+use --workers 1 there.
+
+`bloom` rebuilds the shared (ASSIGNMENT_BLOOM=valkey) Bloom filters of assigned users
+from the assignments table, it runs automatically after an assignments backfill.
+"""
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from typing import Any, Iterator
+import argparse
+import csv
+import io
+import json
+import logging
+import time
+
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import sessionmaker
+from config import config
+from data.database import Assignment, Event, Experiment
+from services.bloom import BLOOM_VALKEY, get_assignment_bloom
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 50000
+
+# Columns loaded per kind, in COPY order
+EVENT_COLUMNS = ("user_id", "type", "timestamp", "properties_json")
+ASSIGNMENT_COLUMNS = ("experiment_id", "user_id", "variant_name", "assigned_at")
+
+
+# --- Row conversion ---
+
+def _parse_datetime(value: Any) -> datetime:
+    # Historical rows keep their own time, a line without one is rejected
+    if not value:
+        raise ValueError("missing timestamp")
+    return datetime.fromisoformat(value)
+
+def event_row(data: dict[str, Any]) -> tuple:
+    properties = data.get("properties")
+    properties_json = json.dumps(properties) if properties else data.get("properties_json")
+    return (str(data["user_id"]), str(data["type"]), _parse_datetime(data.get("timestamp")), properties_json)
+
+def assignment_row(data: dict[str, Any]) -> tuple:
+    return (int(data["experiment_id"]), str(data["user_id"]), str(data["variant_name"]), _parse_datetime(data.get("assigned_at")))
+
+ROW_CONVERTERS = {"events": event_row, "assignments": assignment_row}
+
+def parse_lines(kind: str, lines: list[bytes]) -> tuple[list[tuple], int]:
+    """ Convert NDJSON lines into column tuples, returns (rows, rejected count) """
+    convert = ROW_CONVERTERS[kind]
+    rows = []
+    rejected = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            rows.append(convert(json.loads(line)))
+        except (KeyError, TypeError, ValueError) as e:
+            rejected += 1
+            logger.debug("rejected %s line %r: %s", kind, line[:200], e)
+    return rows, rejected
+
+
+# --- Loaders ---
+
+def _to_csv(rows: list[tuple]) -> io.StringIO:
+    buffer = io.StringIO()
+    # QUOTE_NOTNULL: None stays an unquoted empty field (NULL for COPY), '' is quoted
+    writer = csv.writer(buffer, quoting=csv.QUOTE_NOTNULL, lineterminator="\n")
+    writer.writerows(
+        tuple(value.isoformat() if isinstance(value, datetime) else value for value in row) for row in rows
+    )
+    buffer.seek(0)
+    return buffer
+
+def copy_rows_postgres(engine, kind: str, rows: list[tuple]) -> int:
+    """ Load rows with COPY FROM STDIN in one transaction, returns the rows inserted """
+    raw = engine.raw_connection()
+    try:
+        with raw.cursor() as cursor:
+            if kind == "events":
+                cursor.copy_expert(f"COPY events ({', '.join(EVENT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", _to_csv(rows))
+            else:
+                # COPY can't skip duplicates, go through a staging table to honour _exp_user_uc
+                columns = ", ".join(ASSIGNMENT_COLUMNS)
+                cursor.execute(
+                    "CREATE TEMP TABLE assignments_stage "
+                    "(experiment_id integer, user_id varchar, variant_name varchar, assigned_at timestamp) "
+                    "ON COMMIT DROP"
+                )
+                cursor.copy_expert(f"COPY assignments_stage ({columns}) FROM STDIN WITH (FORMAT csv)", _to_csv(rows))
+                cursor.execute(
+                    f"INSERT INTO assignments ({columns}) SELECT {columns} FROM assignments_stage "
+                    "ON CONFLICT (experiment_id, user_id) DO NOTHING"
+                )
+            # Duplicates skipped by ON CONFLICT are not counted
+            inserted = cursor.rowcount
+        raw.commit()
+        return inserted
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+
+def insert_rows_executemany(engine, kind: str, rows: list[tuple]) -> int:
+    """ Load rows with one batched executemany in one transaction, returns the rows inserted """
+    if kind == "events":
+        statement, columns = insert(Event), EVENT_COLUMNS
+    else:
+        statement, columns = insert(Assignment).prefix_with("OR IGNORE", dialect="sqlite"), ASSIGNMENT_COLUMNS
+    with engine.begin() as conn:
+        # Duplicates skipped by OR IGNORE are not counted
+        return conn.execute(statement, [dict(zip(columns, row)) for row in rows]).rowcount
+
+_engines: dict[str, Any] = {}
+
+def _get_engine(database_url: str):
+    # One engine per worker process, created after the fork
+    if database_url not in _engines:
+        _engines[database_url] = create_engine(database_url, pool_size=1, max_overflow=0)
+    return _engines[database_url]
+
+def load_chunk(kind: str, lines: list[bytes], database_url: str) -> tuple[int, int]:
+    """ Parse and load one chunk, returns (inserted, rejected). Runs in a pool worker. """
+    rows, rejected = parse_lines(kind, lines)
+    if not rows:
+        return 0, rejected
+    engine = _get_engine(database_url)
+    if engine.dialect.name == "postgresql":
+        return copy_rows_postgres(engine, kind, rows), rejected
+    return insert_rows_executemany(engine, kind, rows), rejected
+
+
+# --- Driver ---
+
+def read_chunks(path: str, chunk_size: int) -> Iterator[list[bytes]]:
+    """ Stream the file as lists of chunk_size raw lines """
+    with open(path, "rb") as f:
+        chunk = []
+        for line in f:
+            chunk.append(line)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+def backfill(kind: str, path: str, database_url: str, chunk_size: int = DEFAULT_CHUNK_SIZE, workers: int = 4) -> dict[str, float]:
+    """ Load the file with a pool of workers, keeping at most 2 chunks in flight per worker """
+    started = time.monotonic()
+    loaded = rejected = chunks_done = 0
+
+    def report(done):
+        nonlocal loaded, rejected, chunks_done
+        for future in done:
+            chunk_loaded, chunk_rejected = future.result()
+            loaded += chunk_loaded
+            rejected += chunk_rejected
+            chunks_done += 1
+        elapsed = time.monotonic() - started
+        logger.info("%s backfill: %d chunks, %d rows loaded, %d rejected, %.0f rows/s",
+                    kind, chunks_done, loaded, rejected, loaded / elapsed if elapsed else 0.0)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = set()
+        for chunk in read_chunks(path, chunk_size):
+            in_flight.add(pool.submit(load_chunk, kind, chunk, database_url))
+            if len(in_flight) >= workers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                report(done)
+        if in_flight:
+            done, _ = wait(in_flight)
+            report(done)
+
+    elapsed = time.monotonic() - started
+    return {
+        "loaded": loaded,
+        "rejected": rejected,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(loaded / elapsed, 1) if elapsed else 0.0,
+    }
+
+def rebuild_bloom(database_url: str, experiment_ids: list[int] | None = None, reset: bool = False, bloom=None) -> dict[int, int]:
+    """ Rebuild the shared Bloom filters of the experiments (default: all), returns the users added per experiment """
+    bloom = bloom or get_assignment_bloom()
+    if bloom.mode != BLOOM_VALKEY:
+        raise ValueError("ASSIGNMENT_BLOOM=valkey is required, local filters are rebuilt by every process")
+
+    engine = create_engine(database_url)
+    try:
+        with sessionmaker(bind=engine)() as db:
+            if not experiment_ids:
+                experiment_ids = list(db.execute(select(Experiment.id).order_by(Experiment.id)).scalars())
+            return bloom.rebuild_many(db, experiment_ids, reset=reset)
+    finally:
+        engine.dispose()
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Bulk load NDJSON files into the events or assignments table.")
+    commands = parser.add_subparsers(dest="kind", required=True)
+    for kind in sorted(ROW_CONVERTERS):
+        command = commands.add_parser(kind, help=f"Load {kind} into the {kind} table.")
+        command.add_argument("path", help="NDJSON file, one row per line.")
+        command.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Lines per chunk (default: %(default)s).")
+        command.add_argument("--workers", type=int, default=4, help="Parallel loader processes (default: %(default)s).")
+        command.add_argument("--database-url", default=config.database_url, help="Defaults to DATABASE_URL.")
+    command = commands.add_parser("bloom", help="Rebuild the shared Bloom filters of assigned users.")
+    command.add_argument("--experiment-id", type=int, action="append", help="Experiment to rebuild, repeatable (default: all).")
+    command.add_argument("--reset", action="store_true", help="Build new filters instead of adding to the current ones, needed after resizing the filter.")
+    command.add_argument("--database-url", default=config.database_url, help="Defaults to DATABASE_URL.")
+    args = parser.parse_args(argv)
+
+    if args.kind == "bloom":
+        stats = rebuild_bloom(args.database_url, args.experiment_id, reset=args.reset)
+        logger.info("bloom rebuild finished: %s", stats)
+        print(json.dumps(stats))
+        return
+
+    stats = backfill(args.kind, args.path, args.database_url, chunk_size=args.chunk_size, workers=args.workers)
+    logger.info("%s backfill finished: %s", args.kind, stats)
+    if args.kind == "assignments" and config.assignment_bloom == BLOOM_VALKEY:
+        # The loaded users must be in the shared filters, or they would look never assigned
+        stats["bloom"] = rebuild_bloom(args.database_url)
+    print(json.dumps(stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -34,8 +34,22 @@ celery_app.conf.update(
         'interval_step': 0.5,    # Amount to increase wait time by
         'interval_max': 5,       # Maximum wait time
     },
+
+    # In batch writer mode a task returns only after its group commit,
+    # acknowledging late means a message is never lost between ack and commit.
+    # Batches span several messages only with a thread pool, e.g. `--pool threads -c 64`.
+    task_acks_late=config.event_writer_mode == "batch",
 )
 
+# Keeps the results rollups current while no events arrive (ingestion refreshes them too),
+# needs a beat scheduler, e.g. the worker's -B flag in docker-compose.yml
+celery_app.conf.beat_schedule = {
+    'refresh-results-rollups': {
+        'task': 'celery_tasks.event_tasks.refresh_results_rollups',
+        'schedule': 60.0,
+    },
+}
+
 # celery_app.conf.broker_transport_options = {"visibility_timeout": 14400}
 
 celery_app.conf.task_routes = {
@@ -0,0 +1,189 @@
+from sqlalchemy import insert
+from sqlalchemy.exc import InterfaceError, OperationalError
+from data.database import Event, SessionLocal
+from typing import Any, Callable
+from config import config
+import os
+import queue
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Supported values for config.event_writer_mode
+EVENT_WRITER_MODE_SINGLE = "single"   # one INSERT + commit per task
+EVENT_WRITER_MODE_BATCH = "batch"     # group commit through EventBatchWriter
+
+
+# Guards the hand-over of pending rows between a timed out submitter and the flusher
+_pending_state_lock = threading.Lock()
+
+class _PendingRows:
+    """Rows of one task message waiting for the flusher."""
+    __slots__ = ("rows", "done", "rejected", "error", "state")
+
+    def __init__(self, rows: list[dict[str, Any]]):
+        self.rows = rows
+        self.done = threading.Event()
+        self.rejected: list[dict[str, Any]] = []
+        self.error: Exception | None = None
+        self.state = "queued"
+
+    def take(self) -> bool:
+        """Flusher side: claim the rows for writing, False when the submitter gave up on them."""
+        with _pending_state_lock:
+            if self.state == "cancelled":
+                return False
+            self.state = "taken"
+            return True
+
+    def cancel(self) -> bool:
+        """Submitter side: withdraw the rows, False when the flusher is already writing them."""
+        with _pending_state_lock:
+            if self.state == "taken":
+                return False
+            self.state = "cancelled"
+            return True
+
+
+class EventBatchWriter:
+    """
+    Group commit writer for the events table.
+
+    Rows submitted by concurrently running tasks are gathered until max_rows rows
+    are pending or max_wait_ms has passed since the first one, then written with one
+    multi-row INSERT in a single transaction. submit() blocks until that transaction
+    is committed, so with acks_late the broker message is acknowledged only after
+    its rows are durable.
+
+    If the batch INSERT fails on bad data, the batch is written again row by row
+    (one SAVEPOINT per row) so a poison event only rejects itself.
+    Connection errors fail the whole batch and are raised to the callers for retry.
+    """
+
+    def __init__(self, session_factory: Callable = SessionLocal, max_rows: int = 1000, max_wait_ms: float = 50):
+        self.session_factory = session_factory
+        self.max_rows = max_rows
+        self.max_wait = max_wait_ms / 1000
+        self._queue: queue.Queue[_PendingRows] = queue.Queue()
+        self._flusher: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def submit(self, rows: list[dict[str, Any]], timeout: float | None = None) -> list[dict[str, Any]]:
+        """
+        Queue rows for the next group commit and wait for it.
+        Returns the rejected (poison) rows, raises if the batch could not be written.
+        After timeout seconds raises TimeoutError: rows still queued are withdrawn, rows the
+        flusher is already writing may still be committed.
+        """
+        if not rows:
+            return []
+
+        self._ensure_flusher()
+        pending = _PendingRows(rows)
+        self._queue.put(pending)
+        if not pending.done.wait(timeout):
+            if pending.cancel():
+                raise TimeoutError(f"Event batch was not written within {timeout}s.")
+            raise TimeoutError(f"Event batch was not committed within {timeout}s, it may still be written.")
+        if pending.error:
+            raise pending.error
+        return pending.rejected
+
+    def _ensure_flusher(self):
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self._run, name="event-batch-writer", daemon=True)
+                self._flusher.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            row_count = len(batch[0].rows)
+            deadline = time.monotonic() + self.max_wait
+
+            # Gather more messages until the batch is full or the first row waited long enough
+            while row_count < self.max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(pending)
+                row_count += len(pending.rows)
+
+            batch = [pending for pending in batch if pending.take()]
+            if not batch:
+                continue
+            try:
+                self._flush(batch)
+            except Exception as exc:
+                logger.exception("Event batch writer failed to flush %d rows.", row_count)
+                for pending in batch:
+                    pending.error = exc
+            finally:
+                for pending in batch:
+                    pending.done.set()
+
+    def _flush(self, batch: list[_PendingRows]):
+        rows = [row for pending in batch for row in pending.rows]
+        rejected = self.write(rows)
+        if rejected:
+            rejected_ids = {id(row) for row in rejected}
+            for pending in batch:
+                pending.rejected = [row for row in pending.rows if id(row) in rejected_ids]
+        logger.info("Event batch writer committed %d rows from %d messages (%d rejected).",
+                    len(rows) - len(rejected), len(batch), len(rejected))
+
+    def write(self, rows: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """Write rows in one transaction, falling back to per-row writes to isolate poison rows."""
+        db = self.session_factory()
+        try:
+            try:
+                db.execute(insert(Event), rows)
+                db.commit()
+                return []
+            except (OperationalError, InterfaceError):
+                db.rollback()
+                raise
+            except Exception as exc:
+                db.rollback()
+                logger.warning("Multi-row insert of %d events failed (%s), retrying row by row.", len(rows), exc)
+
+            rejected = []
+            for row in rows:
+                try:
+                    with db.begin_nested():
+                        db.execute(insert(Event), [row])
+                except (OperationalError, InterfaceError):
+                    raise
+                except Exception as exc:
+                    logger.error("Rejected poison event %s: %s", row, exc)
+                    rejected.append(row)
+            db.commit()
+            return rejected
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+_writer: EventBatchWriter | None = None
+_writer_pid: int | None = None
+
+def get_event_writer() -> EventBatchWriter:
+    """Per-process writer, created lazily so every forked worker gets its own flusher thread."""
+    global _writer, _writer_pid
+    if _writer is None or _writer_pid != os.getpid():
+        _writer = EventBatchWriter(
+            max_rows=config.event_batch_max_rows,
+            max_wait_ms=config.event_batch_max_wait_ms
+        )
+        _writer_pid = os.getpid()
+    return _writer
@@ -1,12 +1,24 @@
 from celery_config import celery_app
+from sqlalchemy import insert
+from sqlalchemy.exc import InterfaceError, OperationalError
 from data.database import Event, SessionLocal # Assuming SessionLocal is available to create isolated sessions
+from celery_tasks.batch_writer import EVENT_WRITER_MODE_BATCH, get_event_writer
+from services.attribution import attribute_new_events, attribute_new_events_until_current
+from services.cache import get_cache_client
+from services.events import event_row
+from services.rollups import refresh_rollups, refresh_rollups_until_current
 from typing import Any
-from datetime import datetime
 from config import config # initialize logging
+import threading
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+# Throttles the results refreshes (attribution + rollups) triggered by ingestion, per worker process
+_rollup_refresh_lock = threading.Lock()
+_last_rollup_refresh = 0.0
+
 # NOTE: This function simulates getting a fresh, isolated DB session 
 # (You might need to implement SessionLocal in data/database.py)
 def get_db_session():
@@ -18,8 +30,65 @@ def get_db_session():
         logger.error(f"Failed to create database session in Celery task: {e}")
         return None
 
-# ignore result flag in celery as we don't need the result and reduced storage bloat
-@celery_app.task(bind=True, max_retries=3, default_retry_delay=30, ignore_result_flag=True)
+def submit_timeout(task) -> float:
+    """ Seconds to wait for the group commit: config.event_batch_submit_timeout, within the task's time limits """
+    limits = [limit * 0.9 for limit in (task.request.timelimit or ()) if limit]
+    return min([config.event_batch_submit_timeout, *limits])
+
+def write_batched(task, event_data_dicts: list[dict[str, Any]]) -> int:
+    """
+    Hand the events to the per-process group commit writer and wait for the commit.
+    Returns the number of rejected (poison) events, which are logged and not retried.
+    """
+    rows = []
+    rejected = 0
+    for event_data_dict in event_data_dicts:
+        try:
+            rows.append(event_row(event_data_dict))
+        except (KeyError, TypeError, ValueError) as exc:
+            logger.error(f"Rejected malformed event {event_data_dict}: {exc}")
+            rejected += 1
+
+    try:
+        rejected += len(get_event_writer().submit(rows, timeout=submit_timeout(task)))
+    except (OperationalError, InterfaceError) as exc:
+        logger.error("Database connection failed in Celery task. Retrying...")
+        raise task.retry(exc=exc)
+    except TimeoutError as exc:
+        logger.error(f"Event batch writer did not answer: {exc}. Retrying...")
+        raise task.retry(exc=exc)
+
+    logger.info(f"Task {task.name}[{task.request.id}]. Committed {len(event_data_dicts) - rejected} events in a group commit, {rejected} rejected.")
+    return rejected
+
+def maybe_refresh_rollups():
+    """
+    Attribute newly inserted events to the users' variants and fold them into the
+    results rollups, at most once per
+    config.rollup_refresh_interval seconds per process and never concurrently within one.
+    Failures are only logged: the events are committed and the next refresh picks them up.
+    """
+    global _last_rollup_refresh
+    if time.monotonic() - _last_rollup_refresh < config.rollup_refresh_interval:
+        return
+    if not _rollup_refresh_lock.acquire(blocking=False):
+        return
+    db = None
+    try:
+        _last_rollup_refresh = time.monotonic()
+        db = get_db_session()
+        if db:
+            attribute_new_events(db, get_cache_client())
+            refresh_rollups(db)
+    except Exception as exc:
+        logger.error(f"Failed to refresh results rollups: {exc}")
+    finally:
+        if db:
+            db.close()
+        _rollup_refresh_lock.release()
+
+# ignore result in celery as we don't need the result, no result backend write per event
+@celery_app.task(bind=True, max_retries=3, default_retry_delay=30, ignore_result=True)
 def insert_event_to_db(self, event_data_dict: dict[str, Any]):
     """
     Asynchronously inserts a recorded event into the database.
@@ -27,6 +96,13 @@ def insert_event_to_db(self, event_data_dict: dict[str, Any]):
     Right now we're using postgres for simplicity, as it grows bigger this 
     needs to migrate to Clickhouse eventually for high performance events collecting and analysis
     """
+    if config.event_writer_mode == EVENT_WRITER_MODE_BATCH:
+        if write_batched(self, [event_data_dict]):
+            # re-raise so Celery marks FAILURE and we can debug it
+            raise ValueError(f"Event rejected by the database: {event_data_dict}")
+        maybe_refresh_rollups()
+        return
+
     db = None
     db_event = None
     try:
@@ -36,12 +112,7 @@ def insert_event_to_db(self, event_data_dict: dict[str, Any]):
             raise ConnectionError("Could not establish database session.")
             
         # Create the ORM object from the dictionary data
-        db_event = Event(
-            user_id=event_data_dict['user_id'],
-            type=event_data_dict['type'],
-            timestamp=datetime.fromisoformat(event_data_dict['timestamp']),
-            properties_json=event_data_dict['properties_json']
-        )
+        db_event = Event(**event_row(event_data_dict))
         
         db.add(db_event)
         db.commit()
@@ -59,4 +130,60 @@ def insert_event_to_db(self, event_data_dict: dict[str, Any]):
     finally:
         if db:
             db.close()
-    
\ No newline at end of file
+
+    maybe_refresh_rollups()
+
+
+@celery_app.task(bind=True, max_retries=3, default_retry_delay=30, ignore_result=True)
+def insert_events_to_db(self, event_data_dicts: list[dict[str, Any]]):
+    """
+    Batched version of insert_event_to_db, used by POST /events/batch.
+    All events of the message are written with one multi-row INSERT in a single transaction.
+    """
+    if config.event_writer_mode == EVENT_WRITER_MODE_BATCH:
+        write_batched(self, event_data_dicts)
+        maybe_refresh_rollups()
+        return
+
+    db = None
+    try:
+        db = get_db_session()
+        if not db:
+            # Raise an exception to potentially trigger Celery retry
+            raise ConnectionError("Could not establish database session.")
+
+        rows = [event_row(event_data_dict) for event_data_dict in event_data_dicts]
+        if rows:
+            db.execute(insert(Event), rows)
+            db.commit()
+
+        logger.info(f"Task {self.name}[{self.request.id}]. Successfully inserted {len(rows)} events.")
+    except ConnectionError as exc:
+        logger.error("Database connection failed in Celery task. Retrying...")
+        raise self.retry(exc=exc)
+    except Exception as exc:
+        logger.error(f"Failed to insert {len(event_data_dicts)} events to DB: {exc}")
+        raise  # re-raise so Celery marks FAILURE and we can debug it
+
+    finally:
+        if db:
+            db.close()
+
+    maybe_refresh_rollups()
+
+
+@celery_app.task(bind=True, ignore_result=True)
+def refresh_results_rollups(self):
+    """
+    Periodic (beat) rollup refresh, so assignments are counted even while no events arrive.
+    Catches up in batches until the rollups are current.
+    """
+    db = get_db_session()
+    if not db:
+        raise ConnectionError("Could not establish database session.")
+    try:
+        attributed = attribute_new_events_until_current(db, get_cache_client())
+        batches = refresh_rollups_until_current(db)
+        logger.info(f"Task {self.name}[{self.request.id}]. Attributed events in {attributed} batches, refreshed results rollups in {batches} batches.")
+    finally:
+        db.close()
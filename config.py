@@ -1,4 +1,5 @@
 import os
+import json
 import log
 from dotenv import load_dotenv
 
@@ -6,21 +7,181 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+def _getenv_bool(name: str, default: bool = False) -> bool:
+    """Read a boolean flag from the environment (1/true/yes/on are truthy)."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+def _getenv_json(name: str, default=None):
+    """Read a JSON value from the environment, default when unset or blank."""
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    return json.loads(value)
+
+
+def _getenv_tokens(name: str) -> list[str] | dict[str, str]:
+    """
+    API tokens: a JSON list of tokens, a JSON object of client name -> token,
+    or a comma separated list of tokens.
+    """
+    value = os.getenv(name, "").strip()
+    if not value:
+        return []
+    try:
+        tokens = json.loads(value)
+    except ValueError:
+        tokens = None
+    # Other JSON values are plain tokens: 123456 or "abc" (a string would be iterated per character)
+    if isinstance(tokens, dict):
+        return {str(name): str(token) for name, token in tokens.items()}
+    if isinstance(tokens, list):
+        return [str(token) for token in tokens]
+    return [token.strip() for token in value.split(",") if token.strip()]
+
+
 class Config:
     def __init__(self):
         self.valkey_host = os.getenv("VALKEY_HOST", "localhost")
         self.valkey_port = int(os.getenv("VALKEY_PORT", 6379))
         self.database_url = os.getenv("DATABASE_URL", "sqlite:///./experimentation.db")
+
+        # Connection pool of every API worker and celery worker process, size it so that
+        # processes * (DB_POOL_SIZE + DB_MAX_OVERFLOW) stays below Postgres max_connections.
+        # DB_POOL_CLASS=null disables pooling, e.g. behind PgBouncer in transaction mode
+        self.db_pool_class = os.getenv("DB_POOL_CLASS", "queue")
+        self.db_pool_size = int(os.getenv("DB_POOL_SIZE", 5))
+        self.db_max_overflow = int(os.getenv("DB_MAX_OVERFLOW", 10))
+        self.db_pool_timeout = float(os.getenv("DB_POOL_TIMEOUT", 30))
+        self.db_pool_recycle = int(os.getenv("DB_POOL_RECYCLE", 1800))
+        self.db_pool_pre_ping = _getenv_bool("DB_POOL_PRE_PING", True)
         self.log_level = os.getenv("LOG_LEVEL", default="INFO")
-        self.valid_tokens = os.getenv("VALID_TOKENS", [])
+        # LOG_QUEUE: request threads only enqueue log records, a listener thread per process writes
+        # them. LOG_FORMAT: "text" or "json". INFO records of hot loggers are thinned out by
+        # LOG_SAMPLE_RATES ({"logger": fraction kept}) and LOG_RATE_LIMITS ({"logger": per second}),
+        # both empty by default: every record is written
+        self.log_queue = _getenv_bool("LOG_QUEUE", False)
+        self.log_format = os.getenv("LOG_FORMAT", "text").lower()
+        self.log_sample_rates = _getenv_json("LOG_SAMPLE_RATES", {})
+        self.log_rate_limits = _getenv_json("LOG_RATE_LIMITS", {})
+        # Server-Timing response header: time spent in auth, cache, db, app and serialize
+        self.server_timing = _getenv_bool("SERVER_TIMING", True)
+        self.valid_tokens = _getenv_tokens("VALID_TOKENS")
+        # Per-client token bucket: RATE_LIMIT_RATE requests per second, bursts of up to
+        # RATE_LIMIT_BURST (defaults to the rate). 0 disables it, CLIENT_RATE_LIMITS overrides
+        # it per client name: {"mobile": {"rate": 50, "burst": 100}}. "local" buckets are per
+        # process (every API worker allows the full rate), "valkey" buckets are shared
+        self.rate_limit_rate = float(os.getenv("RATE_LIMIT_RATE", 0))
+        self.rate_limit_burst = float(os.getenv("RATE_LIMIT_BURST", 0))
+        self.rate_limit_backend = os.getenv("RATE_LIMIT_BACKEND", "local").lower()
+        self.client_rate_limits = _getenv_json("CLIENT_RATE_LIMITS", {})
         self.celery_broker_url = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/1" )
         self.celery_backend_url = os.getenv("CELERY_BACKEND_URL", "redis://localhost:6379/1" )
+
+        # Event ingestion transport: "celery" (a task per event or batch) or "stream"
+        # (XADD to a Valkey stream answered with 202, drained in blocks by stream_worker.py).
+        # Entries beyond maxlen are trimmed even if unread, size it above the worst backlog
+        self.event_transport = os.getenv("EVENT_TRANSPORT", "celery").lower()
+        self.event_stream_url = os.getenv("EVENT_STREAM_URL", self.celery_broker_url)
+        self.event_stream_name = os.getenv("EVENT_STREAM_NAME", "events")
+        self.event_stream_maxlen = int(os.getenv("EVENT_STREAM_MAXLEN", 1000000))
+        self.event_stream_read_count = int(os.getenv("EVENT_STREAM_READ_COUNT", 500))
+        self.event_stream_block_ms = int(os.getenv("EVENT_STREAM_BLOCK_MS", 1000))
+        self.event_stream_claim_idle_ms = int(os.getenv("EVENT_STREAM_CLAIM_IDLE_MS", 60000))
+        # Celery transport only: POST /events appends to a per-process buffer and answers 202,
+        # a background thread publishes it as one insert_events_to_db message every max_events
+        # events or max_wait_ms. Events buffered when a process is killed (not stopped) are lost
+        self.event_buffer = _getenv_bool("EVENT_BUFFER", False)
+        self.event_buffer_max_events = int(os.getenv("EVENT_BUFFER_MAX_EVENTS", 500))
+        self.event_buffer_max_wait_ms = float(os.getenv("EVENT_BUFFER_MAX_WAIT_MS", 50))
+        self.event_buffer_max_pending = int(os.getenv("EVENT_BUFFER_MAX_PENDING", 100000))
+
+        # Ingestion backpressure: /events and /events/batch answer 429 with Retry-After while the
+        # broker backlog exceeds max_queue_depth messages or publishes take longer than
+        # max_publish_latency_ms (0 disables either). Publishes run on their own max_concurrency
+        # threads, an ingestion surge cannot take the threadpool the assignment routes use
+        self.ingest_max_queue_depth = int(os.getenv("INGEST_MAX_QUEUE_DEPTH", 0))
+        self.ingest_max_publish_latency_ms = float(os.getenv("INGEST_MAX_PUBLISH_LATENCY_MS", 0))
+        self.ingest_max_concurrency = int(os.getenv("INGEST_MAX_CONCURRENCY", 16))
+        self.ingest_retry_after = int(os.getenv("INGEST_RETRY_AFTER", 5))
+
+        # Assignment strategy: "random" (weighted draw, persisted) or "deterministic"
+        # (stable hash of experiment salt + user_id, same variant on every worker)
+        self.assignment_mode = os.getenv("ASSIGNMENT_MODE", "random").lower()
+        # Deterministic mode only: when false, skip the DB read/write entirely
+        self.assignment_persist = _getenv_bool("ASSIGNMENT_PERSIST", default=True)
+        # Changing the salt reshuffles every deterministic assignment
+        self.assignment_salt = os.getenv("ASSIGNMENT_SALT", "")
+
+        # In-process experiment cache in front of Valkey (0 disables it)
+        self.experiment_l1_max_size = int(os.getenv("EXPERIMENT_L1_MAX_SIZE", 1024))
+        self.experiment_l1_ttl = float(os.getenv("EXPERIMENT_L1_TTL", 30))
+        # Experiment cache misses: concurrent loads in a process always share one database read,
+        # with the lock enabled workers also coalesce on a Valkey lock (waiting at most lock_wait_ms).
+        # Early refresh reloads a key shortly before it expires, beta scales how early (0 disables)
+        self.experiment_cache_lock = _getenv_bool("EXPERIMENT_CACHE_LOCK", False)
+        self.experiment_cache_lock_wait_ms = float(os.getenv("EXPERIMENT_CACHE_LOCK_WAIT_MS", 200))
+        self.experiment_early_refresh_beta = float(os.getenv("EXPERIMENT_EARLY_REFRESH_BETA", 1.0))
+
+        # Celery event writer: "single" (commit per event) or "batch" (group commit,
+        # run the worker with a thread pool so concurrent messages share a batch)
+        self.event_writer_mode = os.getenv("EVENT_WRITER_MODE", "single").lower()
+        self.event_batch_max_rows = int(os.getenv("EVENT_BATCH_MAX_ROWS", 1000))
+        self.event_batch_max_wait_ms = float(os.getenv("EVENT_BATCH_MAX_WAIT_MS", 50))
+        # Seconds a task waits for its group commit before it is retried (capped below the task's
+        # time limits), so a stuck writer can't hold the worker's threads forever
+        self.event_batch_submit_timeout = float(os.getenv("EVENT_BATCH_SUBMIT_TIMEOUT", 60))
+
+        # Assignment persistence: "sync" (commit before responding) or "write_behind"
+        # (claim in Valkey with SET NX, bulk insert from a background thread)
+        self.assignment_write_mode = os.getenv("ASSIGNMENT_WRITE_MODE", "sync").lower()
+        # Cached assignments: "key" (one JSON key per user) or "hash" (per-experiment hash buckets
+        # with packed values). Keep users per bucket below Valkey's hash-max-listpack-entries.
+        # A bucket expires as a whole ASSIGNMENT_CACHE_TTL after it was created (EXPIRE NX, Valkey/Redis 7+)
+        self.assignment_cache_layout = os.getenv("ASSIGNMENT_CACHE_LAYOUT", "key").lower()
+        self.assignment_cache_buckets = int(os.getenv("ASSIGNMENT_CACHE_BUCKETS", 1024))
+        self.assignment_flush_interval_ms = float(os.getenv("ASSIGNMENT_FLUSH_INTERVAL_MS", 200))
+        self.assignment_flush_max_rows = int(os.getenv("ASSIGNMENT_FLUSH_MAX_ROWS", 1000))
+
+        # Users known to have no assignment skip the assignment read: negative entries cached for
+        # this many seconds (0 disables), and an optional per-experiment Bloom filter of assigned
+        # users: "off", "local" (per process) or "valkey" (shared), sized for capacity users per experiment
+        self.assignment_negative_cache_ttl = int(os.getenv("ASSIGNMENT_NEGATIVE_CACHE_TTL", 60))
+        self.assignment_bloom = os.getenv("ASSIGNMENT_BLOOM", "off").lower()
+        self.assignment_bloom_capacity = int(os.getenv("ASSIGNMENT_BLOOM_CAPACITY", 1000000))
+        self.assignment_bloom_error_rate = float(os.getenv("ASSIGNMENT_BLOOM_ERROR_RATE", 0.01))
+
+        # Results: answer from the incrementally maintained rollups (raw join on ?raw=true)
+        self.results_use_rollups = _getenv_bool("RESULTS_USE_ROLLUPS", True)
+        # Minimum seconds between two rollup refreshes triggered by one ingestion worker process
+        self.rollup_refresh_interval = float(os.getenv("ROLLUP_REFRESH_INTERVAL", 5))
+        # Seconds a source id skipped by the attribution/rollup watermarks is waited for: rows commit
+        # out of id order under concurrent writers, must exceed the longest inserting transaction
+        self.rollup_gap_timeout = float(os.getenv("ROLLUP_GAP_TIMEOUT", 600))
+        # Results cache: entries are fresh for RESULTS_CACHE_TTL seconds (0 disables the cache),
+        # then served stale while one background refresh runs, up to RESULTS_CACHE_STALE_TTL
+        self.results_cache_ttl = float(os.getenv("RESULTS_CACHE_TTL", 5))
+        self.results_cache_stale_ttl = int(os.getenv("RESULTS_CACHE_STALE_TTL", 300))
+
+        # Async request path: async SQLAlchemy engine (asyncpg/aiosqlite) and async Valkey client.
+        # ASYNC_DATABASE_URL defaults to DATABASE_URL with the async driver of its dialect
+        self.async_mode = _getenv_bool("ASYNC_MODE", False)
+        self.async_database_url = os.getenv("ASYNC_DATABASE_URL")
+        self.valkey_max_connections = int(os.getenv("VALKEY_MAX_CONNECTIONS", 100))
         
         # Call setup_logging when the application starts
-        log.setup_logging(self.log_level)
+        log.setup_logging(
+            self.log_level,
+            use_queue=self.log_queue,
+            log_format=self.log_format,
+            sample_rates=self.log_sample_rates,
+            rate_limits=self.log_rate_limits
+        )
 
     def __repr__(self):
-        return f"<Settings host={self.valkey_host} port={self.valkey_port} loglevel={self.log_level}, broker_url:{self.celery_broker_url}, backend_url:{self.celery_backend_url}>"
+        return f"<Settings host={self.valkey_host} port={self.valkey_port} loglevel={self.log_level}, broker_url:{self.celery_broker_url}, backend_url:{self.celery_backend_url}, assignment_mode:{self.assignment_mode}>"
     
 config = Config()
 
@@ -0,0 +1,68 @@
+from config import config
+from data.pool import InstrumentedQueuePool, engine_pool_options
+import logging
+
+logger = logging.getLogger(__name__)
+
+# --- Async Database Setup ---
+# Used by the async request path (config.async_mode). Needs the asyncio extra of SQLAlchemy
+# and the async driver of the database: asyncpg for Postgres, aiosqlite for SQLite.
+# The engine is created on first use, so the sync service runs without those packages.
+
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+_async_engine = None
+_async_session_factory = None
+
+def async_database_url(database_url: str) -> str:
+    """Same database as database_url, through its async driver."""
+    scheme, separator, rest = database_url.partition("://")
+    if scheme in ASYNC_DRIVERS:
+        return f"{ASYNC_DRIVERS[scheme]}{separator}{rest}"
+    # Already an async driver (or one we don't know), use as is
+    return database_url
+
+def get_async_engine():
+    global _async_engine
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        url = config.async_database_url or async_database_url(config.database_url)
+        logger.info("ASYNC_DATABASE_URL: %s", url)
+        options = engine_pool_options(url)
+        # The sync pool class can't serve asyncio connections, keep the async default (AsyncAdaptedQueuePool)
+        if options.get("poolclass") is InstrumentedQueuePool:
+            del options["poolclass"]
+        _async_engine = create_async_engine(url, **options)
+    return _async_engine
+
+def get_async_session_factory():
+    global _async_session_factory
+    if _async_session_factory is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+
+        # expire_on_commit=False: returned ORM objects are serialized after the commit,
+        # reloading their attributes would need an implicit (not allowed) async IO
+        _async_session_factory = async_sessionmaker(get_async_engine(), autoflush=False, expire_on_commit=False)
+    return _async_session_factory
+
+async def get_async_db():
+    """Dependency to yield a new async database session."""
+    async with get_async_session_factory()() as db:
+        yield db
+
+async def dispose_async_engine():
+    """Close the pooled connections, called on shutdown."""
+    global _async_engine, _async_session_factory
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    _async_engine = None
+    _async_session_factory = None
+
+def get_started_async_engine():
+    """The async engine if this process created it, None otherwise (e.g. for statistics)."""
+    return _async_engine
@@ -1,11 +1,15 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Text, Boolean, UniqueConstraint, Index
+from sqlalchemy import event, create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Text, Boolean, UniqueConstraint, Index
 from sqlalchemy.orm import sessionmaker, relationship, declarative_base
 from sqlalchemy.orm import class_mapper 
+from sqlalchemy.engine import Engine
 from datetime import datetime, timezone
 from config import config
+from data.pool import dispose_after_fork, engine_pool_options
 import sqlite3
+import timing
 import json
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
@@ -18,12 +22,44 @@ SQLALCHEMY_DATABASE_URL =  config.database_url
 logger.info("SQLALCHEMY_DATABASE_URL: %s", SQLALCHEMY_DATABASE_URL)
 
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL
+    SQLALCHEMY_DATABASE_URL,
+    **engine_pool_options(SQLALCHEMY_DATABASE_URL)
 )
+
+# Forked workers (gunicorn, celery prefork) must never use the parent's pooled connections
+os.register_at_fork(after_in_child=lambda: dispose_after_fork(engine))
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+
+# --- Server-Timing ---
+# Statement time of every engine (sync, async and the tests') counts as "db" in the request's
+# Server-Timing header. The timings are remembered on the connection, a failed statement
+# ends its measurement in handle_error.
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _db_timing_start(conn, cursor, statement, parameters, context, executemany):
+    timings = timing.current()
+    if timings is not None:
+        timings.enter("db")
+        conn.info.setdefault("request_timings", []).append(timings)
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _db_timing_end(conn, cursor, statement, parameters, context, executemany):
+    _end_db_timing(conn)
+
+@event.listens_for(Engine, "handle_error")
+def _db_timing_error(exception_context):
+    if exception_context.connection is not None:
+        _end_db_timing(exception_context.connection)
+
+def _end_db_timing(conn):
+    pending = conn.info.get("request_timings")
+    if pending:
+        pending.pop().exit()
+
 def get_db():
     """Dependency to yield a new database session."""
     db = SessionLocal()
@@ -160,6 +196,77 @@ class Event(Base, SerializerMixin):
         Index('idx_user_type_ts', 'user_id', 'type', 'timestamp'),
     )
 
+class EventAttribution(Base, SerializerMixin):
+    """
+    Event credited to the variant a user was assigned to, written by the enrichment stage
+    (services.attribution) so results aggregate one table instead of joining on user_id.
+    Type and timestamp are copied from the event to keep the aggregation index-only.
+    """
+    __tablename__ = "event_attributions"
+    event_id = Column(Integer, ForeignKey("events.id"), primary_key=True)
+    experiment_id = Column(Integer, ForeignKey("experiments.id"), primary_key=True)
+    variant_name = Column(String)
+    event_type = Column(String)
+    timestamp = Column(DateTime)
+
+    __table_args__ = (
+        Index('idx_attribution_exp_type_ts', 'experiment_id', 'event_type', 'timestamp', 'variant_name'),
+    )
+
+class ResultsRollup(Base, SerializerMixin):
+    """
+    Pre-aggregated results, maintained incrementally by services.rollups.refresh_rollups.
+    Conversion rows count the attributed events of event_type in the bucket.
+    Assignment rows (event_type == "") count assignments per bucket.
+    """
+    __tablename__ = "results_rollups"
+    id = Column(Integer, primary_key=True, index=True)
+    experiment_id = Column(Integer, ForeignKey("experiments.id"))
+    variant_name = Column(String)
+    event_type = Column(String)
+    bucket_start = Column(DateTime)
+    conversion_count = Column(Integer, default=0)
+    assignment_count = Column(Integer, default=0)
+
+    # Upsert target, also serves the (experiment_id, event_type) lookups of calculate_summary
+    __table_args__ = (
+        UniqueConstraint('experiment_id', 'event_type', 'variant_name', 'bucket_start', name='_rollup_bucket_uc'),
+    )
+
+class RollupWatermark(Base, SerializerMixin):
+    """Last source row id processed by an incremental stage (rollups, attribution)."""
+    __tablename__ = "rollup_watermarks"
+    source = Column(String, primary_key=True)
+    last_id = Column(Integer, default=0)
+    updated_at = Column(DateTime, nullable=True)
+
+class RollupGap(Base, SerializerMixin):
+    """
+    Source ids below a watermark that were not committed yet when the stage passed them,
+    inserted by a transaction still open then. Processed once they commit, dropped after
+    config.rollup_gap_timeout (rolled back inserts, deleted rows).
+    """
+    __tablename__ = "rollup_gaps"
+    id = Column(Integer, primary_key=True, index=True)
+    source = Column(String, index=True)
+    low_id = Column(Integer)
+    high_id = Column(Integer)
+    first_seen = Column(DateTime)
+
+def dialect_insert(bind, table):
+    """
+    INSERT construct of the bind's dialect, exposing on_conflict_do_nothing/do_update.
+    Only Postgres and SQLite are supported, as everywhere else in the service.
+    """
+    dialect_name = bind.dialect.name
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"Upsert is not supported on {dialect_name}")
+    return insert(table)
+
 # Function to create tables
 def create_tables():
     try:
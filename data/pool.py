@@ -0,0 +1,103 @@
+from sqlalchemy.pool import NullPool, QueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from config import config
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Supported values for config.db_pool_class
+DB_POOL_QUEUE = "queue"     # pooled connections per process (default)
+DB_POOL_NULL = "null"       # no pooling, e.g. behind PgBouncer in transaction mode
+
+
+class PoolWaitStats:
+    """Thread safe checkout timings of one pool."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds_avg": self.wait_seconds_total / self.checkouts if self.checkouts else 0.0,
+                "wait_seconds_max": self.wait_seconds_max,
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool that measures how long each checkout waits, i.e. the time spent waiting
+    for a free connection when the pool is exhausted (plus the connect of new ones).
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = PoolWaitStats()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.wait_stats.record(time.perf_counter() - started, timed_out=True)
+            raise
+        self.wait_stats.record(time.perf_counter() - started)
+        return connection
+
+
+def engine_pool_options(database_url: str) -> dict:
+    """create_engine keyword arguments of the pool configured in config.Config."""
+    if config.db_pool_class == DB_POOL_NULL:
+        return {"poolclass": NullPool}
+    if database_url.startswith("sqlite") and ":memory:" in database_url:
+        # In-memory SQLite lives in its single connection, keep SQLAlchemy's default pool
+        return {}
+    return {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": config.db_pool_size,
+        "max_overflow": config.db_max_overflow,
+        "pool_timeout": config.db_pool_timeout,
+        "pool_recycle": config.db_pool_recycle,
+        "pool_pre_ping": config.db_pool_pre_ping,
+    }
+
+
+def pool_stats(engine) -> dict:
+    """Live statistics of an engine's pool, exposed on GET /stats."""
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__, "pid": os.getpid()}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "max_overflow": pool._max_overflow,
+        })
+    if isinstance(pool, InstrumentedQueuePool):
+        stats.update(pool.wait_stats.as_dict())
+    return stats
+
+
+def dispose_after_fork(engine):
+    """
+    Drop the connections a forked child inherited from its parent without closing them,
+    they still belong to the parent (gunicorn pre-fork, celery prefork pool).
+    The child opens its own connections on first use.
+    """
+    engine.dispose(close=False)
+    logger.debug("pid %d: disposed inherited connection pool", os.getpid())
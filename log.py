@@ -1,23 +1,137 @@
+import atexit
+import copy
+import json
 import logging
+import os
+import queue
+import random
 import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
 from contextvars import ContextVar
 from middleware import RequestIDMiddleware
 
 class ContextualFilter(logging.Filter):
     """A logging filter that injects the request ID from ContextVar."""
     def filter(self, record: logging.LogRecord) -> bool:
-        # Get the current ID from the context
-        record.request_id = RequestIDMiddleware.request_id_context().get()
+        # Get the current ID from the context, records from the log queue already carry theirs
+        if not hasattr(record, "request_id"):
+            record.request_id = RequestIDMiddleware.request_id_context().get()
         return True
 
+
+class SamplingFilter(logging.Filter):
+    """
+    Thins out the INFO and DEBUG records of one hot logger: keeps sample_rate of them
+    and at most max_per_second. Warnings and errors always pass.
+    Called from every logging thread, the counters are updated under a lock.
+    """
+    def __init__(self, sample_rate: float = 1.0, max_per_second: int = 0):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.max_per_second = max_per_second
+        self.dropped = 0
+        self._second = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            with self._lock:
+                self.dropped += 1
+            return False
+        if self.max_per_second:
+            second = int(time.monotonic())
+            with self._lock:
+                if second != self._second:
+                    self._second = second
+                    self._count = 0
+                self._count += 1
+                if self._count > self.max_per_second:
+                    self.dropped += 1
+                    return False
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers."""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "request_id": getattr(record, "request_id", "N/A"),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        if record.stack_info:
+            entry["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class PreparedQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread. The message is merged and the traceback
+    rendered on the calling thread, the request ID is set before by the ContextualFilter,
+    formatting and I/O happen on the listener.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+_exception_formatter = logging.Formatter()
+
+
+def queue_handler(handlers: list[logging.Handler]) -> tuple[QueueHandler, QueueListener]:
+    """A QueueHandler for the logging threads and the started listener writing to handlers."""
+    log_queue = queue.SimpleQueue()
+    handler = PreparedQueueHandler(log_queue)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return handler, listener
+
+
+# Queue mode state of this process
+_listener: QueueListener | None = None
+_queue_handler: QueueHandler | None = None
+_handlers: list[logging.Handler] = []
+
 # 3. Configure the Logger with the new filter and format
-def setup_logging(log_level: str = "INFO", log_filename: str = "experiment_service.log"):
+def setup_logging(
+    log_level: str = "INFO",
+    log_filename: str = "experiment_service.log",
+    use_queue: bool = False,
+    log_format: str = "text",
+    sample_rates: dict[str, float] | None = None,
+    rate_limits: dict[str, int] | None = None
+):
+    """
+    use_queue: the request threads only enqueue records, one listener thread per process
+    formats and writes them. log_format "json" writes one JSON object per line.
+    sample_rates / rate_limits thin out INFO records of the named loggers (exact names).
+    """
+    global _listener, _queue_handler, _handlers
     log_filter = ContextualFilter()
 
     # The format must include the custom 'request_id' attribute
-    formatter = logging.Formatter(
-        '%(asctime)s - %(levelname)s - [%(request_id)s] - %(name)s - %(message)s'
-    )
+    if log_format == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            '%(asctime)s - %(levelname)s - [%(request_id)s] - %(name)s - %(message)s'
+        )
 
     # Configure handler (e.g., console handler)
     stream_handler = logging.StreamHandler(sys.stdout)
@@ -35,8 +149,48 @@ def setup_logging(log_level: str = "INFO", log_filename: str = "experiment_servi
     for handler in handlers:
         handler.addFilter(log_filter)
         handler.setFormatter(formatter)
+    _handlers = handlers
+
+    if use_queue:
+        # The request ID lives in the request's context, capture it before the record changes thread
+        _queue_handler, _listener = queue_handler(handlers)
+        _queue_handler.addFilter(log_filter)
+        handlers = [_queue_handler]
+        os.register_at_fork(after_in_child=_restart_listener)
+        atexit.register(stop_logging)
+
+    for name in set(sample_rates or {}) | set(rate_limits or {}):
+        logging.getLogger(name).addFilter(SamplingFilter(
+            sample_rate=(sample_rates or {}).get(name, 1.0),
+            max_per_second=(rate_limits or {}).get(name, 0)
+        ))
 
     # Apply the handler to the root logger
-    # TODO: get logging level from env
     logging.basicConfig(level=logging.getLevelName(log_level), handlers=handlers)
 
+
+def _restart_listener():
+    """The listener thread does not survive a fork (celery prefork, gunicorn --preload)."""
+    global _listener
+    if _queue_handler is None or _listener is None:
+        return
+    _queue_handler.queue = queue.SimpleQueue()
+    _listener = QueueListener(_queue_handler.queue, *_handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging():
+    """
+    Write the queued records and stop the listener, called on shutdown.
+    Records logged afterwards go straight to the handlers again.
+    """
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    _listener.stop()
+    root = logging.getLogger()
+    root.removeHandler(_queue_handler)
+    for handler in _handlers:
+        root.addHandler(handler)
+    _listener = None
+    _queue_handler = None
@@ -3,20 +3,33 @@ from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 
 # Internal imports
-from config import Config
+from config import Config, config
 from data.database import create_tables, get_db, Event, Experiment
 from auth.security import get_current_client
+from auth.rate_limit import get_rate_limiter
 from models.experiments import ExperimentCreate, ExperimentResponse, ExperimentAssignmentResponse
 from models.events import EventCreate, EventResponse
 from models.results import ExperimentResultsSummary, VariantResult
 from services import assignment, results
-from services.cache import get_cache_client, CacheClient, RealValkeyBackend
+from services.cache import get_cache_client, CacheClient, RealValkeyBackend, close_async_cache_client
+from data.async_database import dispose_async_engine, get_started_async_engine
+from data.database import engine
+from data.pool import pool_stats
+from services.write_behind import get_assignment_writer
+from services.bloom import get_assignment_bloom
+from services.event_stream import EVENT_TRANSPORT_STREAM, get_event_stream
+from services.event_buffer import get_event_buffer
+from services.backpressure import get_ingestion_admission
 
 # Import the modular router
 from api.experiment_routes import experiment_router 
 from api.events_routes import events_router
+from api.users_routes import users_router
+from api.async_routes import async_experiment_router, async_events_router
+from api.routing import TimedRoute
 
 import contextlib
+import log
 import logging
 import middleware
 
@@ -41,6 +54,16 @@ async def lifespan(app: FastAPI):
     
     # --- SHUTDOWN LOGIC ---
     logger.info("Application shutting down: Closing resources...")
+    # Persist the assignments still queued in write-behind mode
+    get_assignment_writer().close()
+    # Publish the events still buffered with EVENT_BUFFER=true
+    if config.event_buffer:
+        get_event_buffer().close()
+    if config.async_mode:
+        await dispose_async_engine()
+        await close_async_cache_client()
+    # LOG_QUEUE=true: write the queued log records and stop the listener thread
+    log.stop_logging()
 
 # --- FastAPI App Initialization ---
 app = FastAPI(
@@ -50,12 +73,20 @@ app = FastAPI(
     description="A service for A/B testing: creation, assignment, events, and results."
 )
 
+# Routes declared below (/health, /stats) report their Server-Timing parts too
+app.router.route_class = TimedRoute
+
 # Add the middleware to the application
-app.add_middleware(middleware.RequestIDMiddleware)
+app.add_middleware(middleware.RequestIDMiddleware, server_timing=config.server_timing)
 
 # --- Include Modular Router (All /experiments/* endpoints) ---
+# Async mode: the async routes come first, so they win over their sync versions
+if config.async_mode:
+    app.include_router(async_experiment_router)
+    app.include_router(async_events_router)
 app.include_router(experiment_router) # 
 app.include_router(events_router)
+app.include_router(users_router)
 
 # --- API Endpoints Remaining in Main App ---
 
@@ -63,3 +94,22 @@ app.include_router(events_router)
 def health_check():
     return JSONResponse(content={"status": "healthy"}, status_code=status.HTTP_200_OK)
 
+@app.get("/stats", dependencies=[Depends(get_current_client)])
+def stats():
+    """Per-worker runtime statistics (each gunicorn worker reports its own)."""
+    content = {
+        "assignment_write_behind": get_assignment_writer().stats(),
+        "assignment_bloom": get_assignment_bloom().stats(),
+        "db_pool": pool_stats(engine),
+        "ingestion": get_ingestion_admission().stats(),
+        "rate_limit": get_rate_limiter().stats(),
+    }
+    if config.event_transport == EVENT_TRANSPORT_STREAM:
+        content["event_stream"] = get_event_stream().stats()
+    elif config.event_buffer:
+        content["event_buffer"] = get_event_buffer().stats()
+    async_engine = get_started_async_engine()
+    if async_engine is not None:
+        content["async_db_pool"] = pool_stats(async_engine.sync_engine)
+    return JSONResponse(content=content, status_code=status.HTTP_200_OK)
+
@@ -1,8 +1,10 @@
-from fastapi import FastAPI, Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from contextvars import ContextVar
 
 import logging
+import time
+import timing
 import uuid
 
 # Define the ContextVar to store the request ID
@@ -12,40 +14,54 @@ logger = logging.getLogger(__name__)
 
 # --- Middleware Implementation ---
 
-class RequestIDMiddleware(BaseHTTPMiddleware):
+class RequestIDMiddleware:
+    """
+    Pure ASGI middleware: sets request_id_context for the logs and adds the X-Request-ID,
+    rate limit and Server-Timing headers. Unlike BaseHTTPMiddleware it does not run the
+    app in a separate task or re-stream the response body.
+    """
+
+    def __init__(self, app: ASGIApp, server_timing: bool = True):
+        self.app = app
+        self.server_timing = server_timing
+
     @classmethod
     def request_id_context(cls):
         return request_id_context
     
-    async def dispatch(self, request: Request, call_next):
-        
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
         # Generate a unique ID (shortened for readability in logs)
         new_request_id = str(uuid.uuid4())[:8]
         
         # Store the token (ContextVar token) to be used for reset later
         token = request_id_context.set(new_request_id)
-        
-        # Log the start of the request, INCLUDING THE METHOD AND PATH
-        http_method = request.method
-        path_uri = request.url.path
-        
-        # logger.info("%s %s Request started", http_method, path_uri)
-        
+        timings_token = timing.start()
+        started = time.perf_counter()
+
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                # Optional: Add the Request ID to the response header
+                headers["X-Request-ID"] = new_request_id
+                # Rate limit state of the client, set by auth.security.get_current_client
+                for name, value in scope.get("state", {}).get("rate_limit_headers", {}).items():
+                    headers[name] = value
+                if self.server_timing:
+                    headers.append("Server-Timing", timing.current().header(time.perf_counter() - started))
+            await send(message)
+
         try:
             # 1. Process the request normally
-            response = await call_next(request)
-            
-            # Optional: Add the Request ID to the response header
-            response.headers["X-Request-ID"] = new_request_id
-            
-        except Exception as e:
+            await self.app(scope, receive, send_with_headers)
+        except Exception:
             # Log any exceptions with the context intact
             logger.exception("Unhandled error during request processing.")
-            raise e
-            
+            raise
         finally:
-            # 2. CRITICAL: Reset the context variable when the request is done
-            # logger.info("%s %s Request finished", http_method, path_uri)
+            # 2. CRITICAL: Reset the context variables when the request is done
+            timing.reset(timings_token)
             request_id_context.reset(token)
-
-        return response
\ No newline at end of file
@@ -1,6 +1,9 @@
 from pydantic import BaseModel, Field
 from datetime import datetime
 
+# Upper bound of users per batch assignment request, larger jobs should page through
+MAX_BATCH_ASSIGNMENT_USERS = 10000
+
 # --- Pydantic Models for Requests/Responses ---
 
 class VariantAllocation(BaseModel):
@@ -26,11 +29,15 @@ class ExperimentResponse(BaseModel):
 
 class ExperimentAssignmentResponse(BaseModel):
     """Schema returned by GET /assignment/{user_id}."""
-    id: int
+    id: int | None = None # None when the assignment is not persisted (deterministic mode)
     experiment_id: int
     user_id: str
     variant_name: str
     assigned_at: datetime
     
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class BatchAssignmentRequest(BaseModel):
+    """Schema for assigning many users via POST /experiments/{id}/assignments."""
+    user_ids: list[str] = Field(..., min_length=1, max_length=MAX_BATCH_ASSIGNMENT_USERS, description="Users to assign.")
@@ -0,0 +1,100 @@
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Iterable
+from weakref import WeakKeyDictionary
+import hashlib
+import random
+import logging
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# 64 bit hash space used to map a user onto the allocation ranges
+_HASH_SPACE = float(1 << 64)
+
+def experiment_salt(experiment_id: int) -> str:
+    """ Salt used to hash users of an experiment, stable for the experiment lifetime """
+    return f"{config.assignment_salt}:{experiment_id}"
+
+def hash_user_to_unit(salt: str, user_id: str) -> float:
+    """
+    Map (salt, user_id) to a point in [0, 1).
+    Uses blake2b instead of hash() because the builtin is randomized per process,
+    and the same user must land in the same bucket on every API worker.
+    """
+    digest = hashlib.blake2b(f"{salt}:{user_id}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / _HASH_SPACE
+
+
+class AllocationTable:
+    """
+    Immutable, precompiled traffic allocation of one experiment version.
+    Holds the cumulative allocation_percent array so that picking a variant is a
+    single bisect (or one random.choices call with cum_weights) per user.
+    """
+    __slots__ = ("experiment_id", "salt", "variant_names", "cum_weights", "total")
+
+    def __init__(self, experiment_id: int, variants: Iterable[tuple[str, float]]):
+        variants = tuple(variants)
+        self.experiment_id = experiment_id
+        self.salt = experiment_salt(experiment_id)
+        self.variant_names = tuple(name for name, _ in variants)
+        self.cum_weights = tuple(accumulate(weight for _, weight in variants))
+        self.total = self.cum_weights[-1] if self.cum_weights else 0.0
+
+    @classmethod
+    def from_experiment(cls, experiment) -> "AllocationTable":
+        return cls(experiment.id, ((v.name, v.allocation_percent) for v in experiment.variants))
+
+    def _pick(self, point: float) -> str:
+        # min() guards the (practically impossible) float rounding at the upper edge
+        index = bisect_right(self.cum_weights, point * self.total)
+        return self.variant_names[min(index, len(self.variant_names) - 1)]
+
+    def pick_random(self) -> str:
+        """ Weighted random variant """
+        return random.choices(self.variant_names, cum_weights=self.cum_weights, k=1)[0]
+
+    def pick_random_many(self, count: int) -> list[str]:
+        """ Weighted random variants for a whole batch in one call """
+        if count <= 0:
+            return []
+        return random.choices(self.variant_names, cum_weights=self.cum_weights, k=count)
+
+    def pick_for_user(self, user_id: str) -> str:
+        """ Deterministic variant, the same user always gets the same variant """
+        return self._pick(hash_user_to_unit(self.salt, user_id))
+
+    def pick_for_users(self, user_ids: Iterable[str]) -> list[str]:
+        """ Deterministic variants for a whole batch in one call """
+        salt, pick = self.salt, self._pick
+        return [pick(hash_user_to_unit(salt, user_id)) for user_id in user_ids]
+
+    def __repr__(self):
+        return f"<AllocationTable experiment_id={self.experiment_id} variants={list(zip(self.variant_names, self.cum_weights))}>"
+
+
+# Compiled tables keyed by experiment object. Cached experiments are long lived,
+# immutable objects (one per experiment version), so each table is built once per
+# cached version and released together with it.
+_compiled_tables: WeakKeyDictionary = WeakKeyDictionary()
+
+def get_allocation_table(experiment) -> AllocationTable:
+    """ Get the compiled allocation table of an experiment, compiling it on first use """
+    # Cached experiments (services.cache_values) carry the table compiled at decode time
+    table = getattr(experiment, "allocation", None)
+    if isinstance(table, AllocationTable):
+        return table
+    try:
+        return _compiled_tables[experiment]
+    except KeyError:
+        pass
+    except TypeError:
+        # not weak referenceable, compile without memoizing
+        return AllocationTable.from_experiment(experiment)
+
+    table = AllocationTable.from_experiment(experiment)
+    _compiled_tables[experiment] = table
+    logger.debug("compiled allocation table: %s", table)
+    return table
@@ -0,0 +1,49 @@
+import unittest
+from unittest.mock import patch
+from data.database import Experiment, Variant
+from services.allocation import AllocationTable, get_allocation_table
+
+
+def make_experiment(experiment_id=1, weights=(("Control", 50.0), ("Treatment", 50.0))):
+    experiment = Experiment(id=experiment_id, name="Allocation Test")
+    experiment.variants = [
+        Variant(experiment_id=experiment_id, name=name, allocation_percent=weight) for name, weight in weights
+    ]
+    return experiment
+
+
+class TestAllocationTable(unittest.TestCase):
+
+    def test_compiled_once_per_experiment_object(self):
+        experiment = make_experiment()
+
+        table = get_allocation_table(experiment)
+
+        self.assertIs(get_allocation_table(experiment), table)
+        self.assertIsNot(get_allocation_table(make_experiment()), table)
+        self.assertEqual(table.variant_names, ("Control", "Treatment"))
+        self.assertEqual(table.cum_weights, (50.0, 100.0))
+
+    def test_batch_matches_single_user_picks(self):
+        table = AllocationTable(3, [("A", 20), ("B", 0), ("C", 80)])
+        user_ids = [f"user-{i}" for i in range(2000)]
+
+        picks = table.pick_for_users(user_ids)
+
+        self.assertEqual(picks, [table.pick_for_user(user_id) for user_id in user_ids])
+        self.assertNotIn("B", picks)
+        self.assertAlmostEqual(picks.count("A") / len(picks), 0.2, delta=0.03)
+
+    def test_salt_depends_on_experiment(self):
+        user_ids = [f"user-{i}" for i in range(200)]
+        first = AllocationTable(1, [("A", 50), ("B", 50)]).pick_for_users(user_ids)
+        second = AllocationTable(2, [("A", 50), ("B", 50)]).pick_for_users(user_ids)
+
+        self.assertNotEqual(first, second)
+
+    @patch("services.allocation.random.choices", return_value=["A", "A", "B"])
+    def test_random_batch_uses_cumulative_weights(self, mock_choices):
+        table = AllocationTable(1, [("A", 30), ("B", 70)])
+
+        self.assertEqual(table.pick_random_many(3), ["A", "A", "B"])
+        mock_choices.assert_called_once_with(("A", "B"), cum_weights=(30, 100), k=3)
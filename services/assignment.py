@@ -1,24 +1,28 @@
-from sqlalchemy.orm import Session
-from sqlalchemy.exc import IntegrityError
-from data.database import Experiment, Variant, Assignment
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session, selectinload
+from data.database import Experiment, Variant, Assignment, dialect_insert
 from models.experiments import ExperimentCreate
 from datetime import datetime, timezone
-import random
 import logging
 from fastapi import HTTPException
-from services.cache import CacheClient
+from services.allocation import get_allocation_table
+from services.bloom import get_assignment_bloom
+from services.cache import ASSIGNMENT_LAYOUT_HASH, CacheClient
+from services.write_behind import ASSIGNMENT_WRITE_MODE_SYNC, ASSIGNMENT_WRITE_MODE_WRITE_BEHIND, get_assignment_writer
+from config import config
 
 logger = logging.getLogger(__name__)
 
-# Define the maximum number of times to retry the transaction
-MAX_RETRIES = 3
+# Supported values for config.assignment_mode
+ASSIGNMENT_MODE_RANDOM = "random"
+ASSIGNMENT_MODE_DETERMINISTIC = "deterministic"
 
 class Cache():
     def __init__(self):
         pass
 
 # --- Experiment Creation ---
-def create_new_experiment(db: Session, experiment_data: ExperimentCreate):
+def create_new_experiment(db: Session, cache: CacheClient, experiment_data: ExperimentCreate):
     """Creates a new experiment and its associated variants."""
     db_experiment = Experiment(name=experiment_data.name, description=experiment_data.description)
     db.add(db_experiment)
@@ -35,22 +39,47 @@ def create_new_experiment(db: Session, experiment_data: ExperimentCreate):
     db.commit()
     db.refresh(db_experiment)
     logger.info("create new experiment %s success with experiment id: %d", experiment_data.name, db_experiment.id)
+    # Drops whatever every worker still caches under this id (e.g. reused after a database reset)
+    cache.invalidate_experiment(db_experiment.id)
 
     # TODO: set to cache
     return db_experiment
 
+def known_unassigned(db: Session, cache: CacheClient, pairs: list[tuple[int, str]], shared_only: bool = False) -> set[tuple[int, str]]:
+    """
+    (experiment_id, user_id) pairs that certainly have no assignment, so their database read
+    can be skipped: users missing from the Bloom filter or recently found unassigned.
+    The per-process filter misses other workers' assignments, it is only trusted when the
+    unique constraint catches them (sync writes), never with shared_only.
+    """
+    bloom = get_assignment_bloom()
+    unassigned = set()
+    if bloom.shared or (bloom.enabled and not shared_only and config.assignment_write_mode == ASSIGNMENT_WRITE_MODE_SYNC):
+        unassigned = bloom.unassigned(db, pairs)
+    rest = [pair for pair in pairs if pair not in unassigned]
+    if rest:
+        unassigned |= cache.get_many_unassigned(rest)
+    return unassigned
+
 def get_existing_assignment(db: Session, cache: CacheClient, experiment_id: int, user_id: str):
-    """ Get existing assignemtn from database """
+    """ Get existing assignemtn, cache first. Users known to be unassigned skip the database """
 
-    # TODO: Get from cache
     existing_assignment = cache.get_assignment(experiment_id, user_id)
     if not existing_assignment:
+        if known_unassigned(db, cache, [(experiment_id, user_id)]):
+            logger.debug("get_existing_assignment %d user %s never assigned", experiment_id, user_id)
+            return None
+
         existing_assignment = db.query(Assignment).filter(
                 Assignment.user_id == user_id,
                 Assignment.experiment_id == experiment_id
             ).first()
         
         if existing_assignment:
+            get_assignment_bloom().add([(experiment_id, user_id)])
+            if cache.assignment_layout == ASSIGNMENT_LAYOUT_HASH:
+                # Packed assignments are cached against the experiment's variants, cache it too
+                get_experiment(db=db, cache=cache, experiment_id=experiment_id)
             cache.set_assignment(existing_assignment)
             logger.debug("get_existing_assignment %d cache miss", experiment_id)
     else:
@@ -59,98 +88,312 @@ def get_existing_assignment(db: Session, cache: CacheClient, experiment_id: int,
     return existing_assignment
 
 def get_experiment(db: Session, cache: CacheClient, experiment_id: int,):
-    """ Get experiment from database """
-
-    # TODO Get from cache
-    experiment = cache.get_experiment(experiment_id=experiment_id)
-    if not experiment:
-        experiment = db.query(Experiment).filter(Experiment.id == experiment_id).one_or_none()
-        if experiment:
-            cache.set_experiment(experiment=experiment)
-            logger.debug("get_experiment %d cache miss", experiment_id)
-    else:
-        logger.debug("get_experiment %d cache hit", experiment_id)
-        
-    return experiment
+    """ Get experiment, cache first. Concurrent cache misses share a single database read """
+
+    def load_experiment():
+        logger.debug("get_experiment %d cache miss", experiment_id)
+        return db.query(Experiment).filter(Experiment.id == experiment_id).one_or_none()
+
+    return cache.get_or_load_experiment(experiment_id, load_experiment)
+
+def assignment_insert_statement(bind):
+    """ INSERT ... ON CONFLICT (experiment_id, user_id) DO NOTHING RETURNING the rows actually inserted """
+    return dialect_insert(bind, Assignment).on_conflict_do_nothing(
+        index_elements=["experiment_id", "user_id"]
+    ).returning(Assignment)
+
+def assignment_row(assignment: Assignment) -> dict:
+    return {
+        "experiment_id": assignment.experiment_id,
+        "user_id": assignment.user_id,
+        "variant_name": assignment.variant_name,
+        # set here, the column default is evaluated once at import
+        "assigned_at": assignment.assigned_at or datetime.now(timezone.utc),
+    }
+
+def insert_assignments(db: Session, assignments: list[Assignment]) -> dict[tuple[int, str], Assignment]:
+    """
+    Persist new assignments with one upsert statement. Users assigned concurrently by another
+    request keep their stored assignment: nothing is returned for them and they are read back
+    instead (on Postgres the conflict waits for the other transaction to commit).
+    Commits, returns the stored assignments by (experiment_id, user_id), detached with their columns loaded.
+    """
+    stored = {}
+    for assignment in db.scalars(assignment_insert_statement(db.get_bind()), [assignment_row(a) for a in assignments]):
+        stored[(assignment.experiment_id, assignment.user_id)] = assignment
+
+    conflicts = [(a.experiment_id, a.user_id) for a in assignments if (a.experiment_id, a.user_id) not in stored]
+    if conflicts:
+        logger.info("RACE DETECTED: %d of %d users were assigned concurrently, reading their assignments.",
+                    len(conflicts), len(assignments))
+        stored.update(get_existing_assignments(db, conflicts))
+
+    # Detach before commit so the objects keep their loaded state
+    # instead of being expired and reloaded one by one afterwards
+    for assignment in stored.values():
+        db.expunge(assignment)
+    db.commit()
+    return stored
 
-def set_assignment(db: Session, cache: CacheClient, experiment_id: int, user_id: str, assignment: Assignment):
-    """ Set assignment """
+def set_assignment(db: Session, cache: CacheClient, experiment_id: int, user_id: str, assignment: Assignment) -> Assignment:
+    """ Persist a new assignment, returns the stored one: the concurrent winner's when the user was assigned meanwhile """
 
-    db.add(assignment)
-    db.commit() # This is where the database constraint check happens
-    db.refresh(assignment)
-    cache.set_assignment(assignment)
+    stored = insert_assignments(db, [assignment])[(experiment_id, user_id)]
+    cache.set_assignment(stored)
+    get_assignment_bloom().add([(experiment_id, user_id)])
+    return stored
 
-    # TODO: add to cache
+def set_assignment_write_behind(cache: CacheClient, assignment: Assignment) -> Assignment:
+    """
+    Write-behind version of set_assignment: claim the assignment in the cache with SET NX
+    and queue it for a background bulk insert, nothing is written on the request path.
+    When another worker claimed the user first, its assignment is returned instead.
+    The returned assignment has no id until it is read back from the database.
+    """
+    if assignment.assigned_at is None:
+        assignment.assigned_at = datetime.now(timezone.utc)
+
+    claimed = cache.add_assignment(assignment)
+    if claimed is False:
+        winner = cache.get_assignment(assignment.experiment_id, assignment.user_id)
+        if winner:
+            logger.debug("write-behind: user %s (EID %d) already claimed", assignment.user_id, assignment.experiment_id)
+            return winner
+
+    get_assignment_writer().enqueue(assignment)
+    get_assignment_bloom().add([(assignment.experiment_id, assignment.user_id)])
+    return assignment
+
+def set_assignments_write_behind(cache: CacheClient, assignments: list[Assignment]) -> list[Assignment]:
+    """
+    Batch version of set_assignment_write_behind: all claims are sent in one pipelined
+    round-trip, the winners of the lost claims are read back in one more, and the
+    claimed assignments are queued together. Results are returned in the order of assignments.
+    """
+    assigned_at = datetime.now(timezone.utc)
+    for assignment in assignments:
+        if assignment.assigned_at is None:
+            assignment.assigned_at = assigned_at
+
+    claims = cache.add_many_assignments(assignments)
+    lost = [(a.experiment_id, a.user_id) for a, claimed in zip(assignments, claims) if claimed is False]
+    winners = cache.get_many_assignments(lost) if lost else {}
+    logger.debug("write-behind: %d/%d users already claimed", len(winners), len(assignments))
+
+    results, queued = [], []
+    for assignment in assignments:
+        winner = winners.get((assignment.experiment_id, assignment.user_id))
+        if winner:
+            results.append(winner)
+        else:
+            queued.append(assignment)
+            results.append(assignment)
+
+    get_assignment_writer().enqueue_many(queued)
+    get_assignment_bloom().add([(a.experiment_id, a.user_id) for a in queued])
+    return results
+
+# --- Variant Selection ---
+def choose_deterministic_variant(experiment, user_id: str) -> str:
+    """ Pick the variant whose cumulative allocation_percent range contains the user's hash """
+    return get_allocation_table(experiment).pick_for_user(user_id)
+
+def choose_variant(experiment, user_id: str) -> str:
+    """ Pick a variant for the user according to config.assignment_mode """
+    table = get_allocation_table(experiment)
+    if config.assignment_mode == ASSIGNMENT_MODE_DETERMINISTIC:
+        return table.pick_for_user(user_id)
+    return table.pick_random()
+
+def choose_variants(experiment, user_ids: list[str]) -> list[str]:
+    """ Batch version of choose_variant, one call for all the users of an experiment """
+    table = get_allocation_table(experiment)
+    if config.assignment_mode == ASSIGNMENT_MODE_DETERMINISTIC:
+        return table.pick_for_users(user_ids)
+    return table.pick_random_many(len(user_ids))
+
+def get_experiment_or_404(db: Session, cache: CacheClient, experiment_id: int):
+    """ Get an experiment that can be assigned, raise 404 otherwise """
+    experiment = get_experiment(db=db, cache=cache, experiment_id=experiment_id)
+    if not experiment or not experiment.variants:
+        logger.info("Experiment ID %d not found or has no variants.", experiment_id)
+        raise HTTPException(status_code=404, detail=f"Experiment ID {experiment_id} not found or has no variants.")
+    return experiment
+
+def get_deterministic_assignment(db: Session, cache: CacheClient, experiment_id: int, user_id: str):
+    """
+    Stateless assignment: the variant is derived from the user hash only,
+    so nothing is read from or written to the assignments table.
+    The returned Assignment is transient and has no id.
+    """
+    experiment = get_experiment_or_404(db=db, cache=cache, experiment_id=experiment_id)
+    assigned_variant_name = choose_deterministic_variant(experiment, user_id)
+    logger.debug("Deterministic assignment for user %s on EID %d: %s", user_id, experiment_id, assigned_variant_name)
+    return Assignment(
+        user_id=user_id,
+        experiment_id=experiment_id,
+        variant_name=assigned_variant_name,
+        assigned_at=datetime.now(timezone.utc)
+    )
 
 # --- Idempotent Assignment ---
 def get_or_create_assignment(db: Session, cache: CacheClient, experiment_id: int, user_id: str):
     """
-    Retrieves an existing assignment or creates a new one if doesn't exist,
-    safely handling concurrent requests using the Unique Constraint + Retry pattern.
+    Retrieves an existing assignment or creates a new one if doesn't exist.
+    Concurrent requests for the same user are settled by the unique constraint in a single
+    upsert statement, the loser gets the winner's assignment (see insert_assignments).
+    In deterministic mode without persistence no database round-trip is made.
     """
-    
-    # Retry loop handles concurrent inserts that fail the unique constraint
-    for attempt in range(MAX_RETRIES):
-        
-        # 1. CHECK FOR EXISTING ASSIGNMENT 
-        existing_assignment = get_existing_assignment(db=db, cache=cache, experiment_id=experiment_id, user_id=user_id)
+    if config.assignment_mode == ASSIGNMENT_MODE_DETERMINISTIC and not config.assignment_persist:
+        return get_deterministic_assignment(db=db, cache=cache, experiment_id=experiment_id, user_id=user_id)
 
-        if existing_assignment:
-            logger.info("Found persistent assignment for user %s on EID %d: %s", 
-                        user_id, experiment_id, existing_assignment.variant_name)
-            return existing_assignment
+    # 1. CHECK FOR EXISTING ASSIGNMENT 
+    existing_assignment = get_existing_assignment(db=db, cache=cache, experiment_id=experiment_id, user_id=user_id)
 
-        # --- Assignment is NEW, proceed to create it ---
-        
-        try:
-            # 2. PERFORM WEIGHTED RANDOM SELECTION
-            # Fetch experiment details (variants and weights) - assumes Experiment model is available
-            experiment = get_experiment(db=db, cache=cache, experiment_id=experiment_id)
-            if not experiment or not experiment.variants:
-                logger.info("Experiment ID %d not found or has no variants.", experiment_id)
-
-                # this exception will be catched by out try/except, so it will need to re-raise
-                raise HTTPException(status_code=404, detail=f"Experiment ID {experiment_id} not found or has no variants.")
-
-                
-            variant_names = [v.name for v in experiment.variants]
-            weights = [v.allocation_percent for v in experiment.variants]
-            assigned_variant_name = random.choices(variant_names, weights=weights, k=1)[0]
-            
-            # 3. ATTEMPT TO CREATE THE NEW ASSIGNMENT (THE WRITE)
-            new_assignment = Assignment(
+    if existing_assignment:
+        logger.info("Found persistent assignment for user %s on EID %d: %s", 
+                    user_id, experiment_id, existing_assignment.variant_name)
+        return existing_assignment
+
+    # --- Assignment is NEW, proceed to create it ---
+
+    # 2. PERFORM WEIGHTED SELECTION (random or deterministic, see config.assignment_mode)
+    # Fetch experiment details (variants and weights), raises 404
+    experiment = get_experiment_or_404(db=db, cache=cache, experiment_id=experiment_id)
+    assigned_variant_name = choose_variant(experiment, user_id)
+
+    # 3. CREATE THE NEW ASSIGNMENT (THE WRITE)
+    new_assignment = Assignment(
+        user_id=user_id,
+        experiment_id=experiment_id,
+        variant_name=assigned_variant_name
+    )
+
+    if config.assignment_write_mode == ASSIGNMENT_WRITE_MODE_WRITE_BEHIND:
+        return set_assignment_write_behind(cache=cache, assignment=new_assignment)
+
+    try:
+        assignment = set_assignment(db=db, cache=cache, experiment_id=experiment_id, user_id=user_id, assignment=new_assignment)
+    except Exception:
+        db.rollback()
+        logger.exception("An unexpected error occurred during assignment for user %s.", user_id)
+        raise HTTPException(status_code=400, detail=f"Experiment ID {experiment_id} unable to create assignment.")
+
+    logger.info("SUCCESS: User %s assigned to %s (EID %d).", user_id, assignment.variant_name, experiment_id)
+    return assignment
+
+# --- Batch Assignment ---
+# Max (experiment_id, user_id) pairs per IN (...) query, keeps us below SQLite's bind parameter limit
+BULK_QUERY_CHUNK_SIZE = 500
+
+def get_active_experiments(db: Session) -> list[Experiment]:
+    """ Get all active experiments with their variants in two queries """
+    return db.query(Experiment).options(
+            selectinload(Experiment.variants)
+        ).filter(
+            Experiment.is_active == True
+        ).order_by(Experiment.id).all()
+
+def get_existing_assignments(db: Session, pairs: list[tuple[int, str]]) -> dict[tuple[int, str], Assignment]:
+    """ Bulk read of (experiment_id, user_id) pairs from database """
+    found = {}
+    for start in range(0, len(pairs), BULK_QUERY_CHUNK_SIZE):
+        chunk = pairs[start:start + BULK_QUERY_CHUNK_SIZE]
+        rows = db.query(Assignment).filter(
+                tuple_(Assignment.experiment_id, Assignment.user_id).in_(chunk)
+            ).all()
+        for row in rows:
+            found[(row.experiment_id, row.user_id)] = row
+
+    return found
+
+def _pick_new_variants(experiments: dict[int, Experiment], pairs: list[tuple[int, str]]) -> list[tuple[int, str, str]]:
+    """ Pick the variants of each experiment in one call, returns (experiment_id, user_id, variant_name) """
+    users_by_experiment: dict[int, list[str]] = {}
+    for experiment_id, user_id in pairs:
+        users_by_experiment.setdefault(experiment_id, []).append(user_id)
+
+    picks = []
+    for experiment_id, user_ids in users_by_experiment.items():
+        variant_names = choose_variants(experiments[experiment_id], user_ids)
+        picks.extend((experiment_id, user_id, variant_name) for user_id, variant_name in zip(user_ids, variant_names))
+    return picks
+
+def bulk_get_or_create_assignments(db: Session, cache: CacheClient, targets: list[tuple[Experiment, str]]) -> list[Assignment]:
+    """
+    Batch version of get_or_create_assignment for (experiment, user_id) targets.
+    Costs one bulk cache lookup, one bulk DB read for the cache misses and one bulk
+    upsert for the new assignments. Users assigned concurrently keep their stored
+    assignment, only those are read back (see insert_assignments).
+    Results are returned in the order of targets.
+    """
+    if config.assignment_mode == ASSIGNMENT_MODE_DETERMINISTIC and not config.assignment_persist:
+        assigned_at = datetime.now(timezone.utc)
+        return [
+            Assignment(
                 user_id=user_id,
-                experiment_id=experiment_id,
-                variant_name=assigned_variant_name
-            )
- 
-            set_assignment(db=db, cache=cache, experiment_id=experiment_id, user_id=user_id, assignment=new_assignment)
- 
-            logger.info("SUCCESS: User %s newly assigned to %s (EID %d) on attempt %d.", 
-                           user_id, assigned_variant_name, experiment_id, attempt + 1)
-            return new_assignment
-            
-        except IntegrityError:
-            # 4. HANDLE THE RACE CONDITION (The Retry Mechanism)
-            # IntegrityError is raised if a concurrent transaction beat us to the INSERT.
-            db.rollback() # Rollback the failed INSERT to clear the session
-            
-            logger.warning("RACE DETECTED: IntegrityError on user %s (EID %d). Retrying (Attempt %d/%d)...",
-                           user_id, experiment_id, attempt + 2, MAX_RETRIES)
-                           
-            # The loop immediately repeats, and on the next pass, the initial READ 
-            # (Step 1) will now find the assignment created by the competing transaction.
-        
-        except HTTPException as e:
-            # reraise this exception
-            raise e
-        
-        except Exception as e:
+                experiment_id=experiment.id,
+                variant_name=get_allocation_table(experiment).pick_for_user(user_id),
+                assigned_at=assigned_at
+            ) for experiment, user_id in targets
+        ]
+
+    experiments = {experiment.id: experiment for experiment, _ in targets}
+    cache.prime_experiments(list(experiments.values()))
+    target_pairs = [(experiment.id, user_id) for experiment, user_id in targets]
+    pairs = list(dict.fromkeys(target_pairs))
+
+    # 1. CHECK THE CACHE, THEN THE DATABASE FOR THE MISSES
+    assignments = cache.get_many_assignments(pairs)
+    missing = [pair for pair in pairs if pair not in assignments]
+    if missing:
+        unassigned = known_unassigned(db, cache, missing)
+        from_db = get_existing_assignments(db, [pair for pair in missing if pair not in unassigned])
+        # Detached objects keep their loaded state across the commit below
+        for existing_assignment in from_db.values():
+            db.expunge(existing_assignment)
+        cache.set_many_assignments(list(from_db.values()))
+        get_assignment_bloom().add(list(from_db))
+        assignments.update(from_db)
+        missing = [pair for pair in missing if pair not in assignments]
+
+    logger.debug("bulk assignment: %d pairs, %d to create", len(pairs), len(missing))
+
+    # 2. CREATE THE NEW ASSIGNMENTS IN ONE INSERT (or queue them in write-behind mode)
+    if missing and config.assignment_write_mode == ASSIGNMENT_WRITE_MODE_WRITE_BEHIND:
+        new_assignments = [
+            Assignment(user_id=user_id, experiment_id=experiment_id, variant_name=variant_name)
+            for experiment_id, user_id, variant_name in _pick_new_variants(experiments, missing)
+        ]
+        for stored in set_assignments_write_behind(cache, new_assignments):
+            assignments[(stored.experiment_id, stored.user_id)] = stored
+        missing = []
+
+    if missing:
+        new_assignments = [
+            Assignment(user_id=user_id, experiment_id=experiment_id, variant_name=variant_name)
+            for experiment_id, user_id, variant_name in _pick_new_variants(experiments, missing)
+        ]
+        try:
+            stored = insert_assignments(db, new_assignments)
+        except Exception:
             db.rollback()
-            logger.exception("An unexpected error occurred during assignment for user %s.", user_id)
-            raise HTTPException(status_code=400, detail=f"Experiment ID {experiment_id} unable to create assignment.")
-            
-    # If all retries fail, something is seriously wrong
-    logger.warning("Failed to get or create assignment for user %s after %d attempts.", user_id, MAX_RETRIES)
-    raise HTTPException(status_code=400, detail=f"Experiment ID {experiment_id} unable to create assignment.")
\ No newline at end of file
+            logger.exception("An unexpected error occurred during bulk assignment of %d pairs.", len(missing))
+            raise HTTPException(status_code=400, detail="Unable to create assignments.")
+
+        cache.set_many_assignments(list(stored.values()))
+        get_assignment_bloom().add(list(stored))
+        assignments.update(stored)
+        logger.info("SUCCESS: %d users newly assigned.", len(stored))
+
+    return [assignments[pair] for pair in target_pairs]
+
+def get_or_create_assignments(db: Session, cache: CacheClient, experiment_id: int, user_ids: list[str]) -> list[Assignment]:
+    """ Get or create the assignments of many users for one experiment """
+    experiment = get_experiment_or_404(db=db, cache=cache, experiment_id=experiment_id)
+    return bulk_get_or_create_assignments(db, cache, [(experiment, user_id) for user_id in user_ids])
+
+def get_or_create_user_assignments(db: Session, cache: CacheClient, user_id: str) -> list[Assignment]:
+    """ Get or create the assignments of one user across all active experiments """
+    experiments = [experiment for experiment in get_active_experiments(db) if experiment.variants]
+    return bulk_get_or_create_assignments(db, cache, [(experiment, user_id) for experiment in experiments])
@@ -1,10 +1,8 @@
 import unittest
 from unittest.mock import MagicMock, patch, call
-from sqlalchemy.exc import IntegrityError
 from fastapi import HTTPException
 from services.cache import get_mock_cache_client
 import logging
-import sys # <-- Import sys for mocking external modules
 
 # --- Mock SQLAlchemy ORM models (These still need to be mocks) ---
 # Define Mock ORM classes with class-level attributes for query mocking
@@ -18,6 +16,9 @@ class MockExperiment:
         self.id = id
         self.name = name
         self.description = description
+        # Read by the real CacheClient when caching the mock
+        self.is_active = True
+        self.created_at = None
         self.variants = variants if variants is not None else []
         self.assignments = [] # Mock relationship
 
@@ -27,7 +28,8 @@ class MockVariant:
     name = None
     allocation_percent = None
 
-    def __init__(self, experiment_id, name, allocation_percent):
+    def __init__(self, experiment_id, name, allocation_percent, id=None):
+        self.id = id
         self.experiment_id = experiment_id
         self.name = name
         self.allocation_percent = allocation_percent
@@ -38,23 +40,18 @@ class MockAssignment:
     experiment_id = None
     variant_name = None
 
-    def __init__(self, user_id, experiment_id, variant_name, id=1):
+    def __init__(self, user_id, experiment_id, variant_name, id=1, assigned_at=None):
         self.id = id
         self.user_id = user_id
         self.experiment_id = experiment_id
         self.variant_name = variant_name
+        self.assigned_at = assigned_at
 
-# --- Setup Mock Module Path for 'data.database' (ORM Models) ---
-# This allows 'assignment.py' to import from 'data.database' successfully.
-mock_db_module = MagicMock()
-mock_db_module.Experiment = MockExperiment
-mock_db_module.Variant = MockVariant
-mock_db_module.Assignment = MockAssignment
-sys.modules['data.database'] = mock_db_module
-sys.modules['data'] = MagicMock() # Mock the parent module
-
+# NOTE: the ORM classes are swapped with the mocks above by the @patch decorators
+# on the test class. Replacing 'data.database' in sys.modules instead would leak the
+# mocks into every test module collected afterwards (e.g. tests/experiments_test.py).
 
-# --- Mock Pydantic models and set up 'models.experiments' path ---
+# --- Placeholder Pydantic models ---
 # Define placeholder classes (Pydantic models) used by the tests
 class VariantAllocation:
     def __init__(self, name, allocation_percent):
@@ -66,19 +63,13 @@ class ExperimentCreate:
         self.description = description
         self.variants = variants
 
-# Inject these mock Pydantic classes into the 'models.experiments' module path
-mock_pydantic_module = MagicMock()
-mock_pydantic_module.ExperimentCreate = ExperimentCreate
-mock_pydantic_module.VariantAllocation = VariantAllocation
-sys.modules['models.experiments'] = mock_pydantic_module
-sys.modules['models'] = MagicMock() # Mock the parent module
-
-
 # Import functions from the module under test (assuming they are in 'assignment.py')
 from services.assignment import (
     create_new_experiment, 
     get_or_create_assignment,
-    MAX_RETRIES # Import the retry constant
+    choose_deterministic_variant,
+    set_assignment_write_behind,
+    set_assignments_write_behind
 )
 
 # Set up logging to capture output during tests
@@ -131,8 +122,10 @@ class TestAssignmentService(unittest.TestCase):
         self.mock_db.flush.side_effect = mock_flush
         self.mock_db.refresh.side_effect = lambda x: None # Mock refresh to do nothing complex
 
+        self.mock_cache_client.set_experiment(MockExperiment(id=100, name="stale", description=None, variants=[]))
+
         # Execute the function
-        result = create_new_experiment(self.mock_db, experiment_data)
+        result = create_new_experiment(self.mock_db, self.mock_cache_client, experiment_data)
 
         # Assertions
         # Check that the first call to add was with an Experiment instance
@@ -143,10 +136,13 @@ class TestAssignmentService(unittest.TestCase):
         self.assertEqual(result.id, 100)
         # Assert the new, specific name
         self.assertEqual(result.name, new_experiment_name) 
+        # Whatever was cached under the new id is dropped in every worker
+        self.assertIsNone(self.mock_cache_client.get_experiment(100))
+        self.assertEqual(self.mock_cache_client.backend.get("exp:generation"), "1")
 
     # --- Test Cases for get_or_create_assignment ---
 
-    @patch('services.assignment.random.choices')
+    @patch('services.allocation.random.choices')
     def test_get_or_create_assignment_exists_happy_path(self, mock_choices):
         """Tests the happy path when an assignment already exists (READ hit)."""
         
@@ -164,7 +160,7 @@ class TestAssignmentService(unittest.TestCase):
         self.mock_db.rollback.assert_not_called()
         mock_choices.assert_not_called()
         
-    @patch('services.assignment.random.choices', return_value=['Treatment'])
+    @patch('services.allocation.random.choices', return_value=['Treatment'])
     def test_get_or_create_assignment_new_creation_happy_path(self, mock_choices):
         """Tests the happy path for creating a new assignment on first attempt (WRITE hit)."""
         
@@ -180,21 +176,21 @@ class TestAssignmentService(unittest.TestCase):
         mock_experiment = MockExperiment(id=1, variants=mock_variants)
         self.mock_db.query.return_value.filter.return_value.one_or_none.return_value = mock_experiment
 
-        # 3. Mock the refresh to simulate ID being set after commit
-        def mock_refresh(obj):
-            obj.id = 500 # Simulate database setting the primary key
+        # 3. Mock the upsert to simulate ID being set by the database
+        def mock_insert(db, assignments):
+            assignments[0].id = 500 # Simulate database setting the primary key
+            return {(1, 'u2'): assignments[0]}
 
-        self.mock_db.refresh.side_effect = mock_refresh
-        
         # Execute the function
-        result = get_or_create_assignment(self.mock_db, self.mock_cache_client, experiment_id=1, user_id='u2')
+        with patch('services.assignment.insert_assignments', side_effect=mock_insert) as mock_insert_assignments:
+            result = get_or_create_assignment(self.mock_db, self.mock_cache_client, experiment_id=1, user_id='u2')
 
         # Assertions
         self.assertEqual(result.variant_name, 'Treatment')
         self.assertEqual(result.id, 500)
-        self.mock_db.add.assert_called_once()
-        self.mock_db.commit.assert_called_once()
+        mock_insert_assignments.assert_called_once()
         self.mock_db.rollback.assert_not_called()
+        self.assertEqual(self.mock_cache_client.get_assignment(1, 'u2').variant_name, 'Treatment')
         
     def test_get_or_create_assignment_experiment_not_found_sad_path(self):
         """Tests the sad path where the experiment is not found (404 HTTPException)."""
@@ -213,90 +209,132 @@ class TestAssignmentService(unittest.TestCase):
         self.mock_db.commit.assert_not_called()
         self.mock_db.rollback.assert_not_called()
 
-    @patch('services.assignment.random.choices', return_value=['Treatment'])
+    @patch('services.allocation.random.choices', return_value=['Treatment'])
     def test_get_or_create_assignment_race_condition_recovery(self, mock_choices):
         """
-        Tests the sad path where a race condition occurs (IntegrityError), 
-        and the function successfully recovers on the second attempt (retry).
+        Tests the race where a concurrent request assigned the user first:
+        the upsert returns the winner's assignment, without any retry or rollback.
         """
         
-        # 1. Mock the initial READ for the first attempt: No assignment found
-        self.mock_db.query.return_value.filter.return_value.first.side_effect = [
-            None, # Attempt 1: First check fails (triggers write)
-            MockAssignment(user_id='u4', experiment_id=1, variant_name='Control') # Attempt 2: Second check succeeds (reads competing transaction)
-        ]
+        # 1. Mock the initial READ: No assignment found
+        self.mock_db.query.return_value.filter.return_value.first.return_value = None
 
         # 2. Mock the Experiment fetch: Valid experiment
         mock_experiment = MockExperiment(id=1, variants=[MockVariant(1, 'A', 100)])
         self.mock_db.query.return_value.filter.return_value.one_or_none.return_value = mock_experiment
 
-        # 3. Mock the commit: Fail on the first attempt, succeed on the second (not reached)
-        self.mock_db.commit.side_effect = [
-            IntegrityError("Race", "Params", "Statement"), # Fail commit on Attempt 1
-            None # Success on commit (if reached)
-        ]
-        
-        # Execute the function
-        result = get_or_create_assignment(self.mock_db, self.mock_cache_client, experiment_id=1, user_id='u4')
+        # 3. Mock the upsert: the competing transaction's assignment is stored
+        winner = MockAssignment(user_id='u4', experiment_id=1, variant_name='Control')
+        with patch('services.assignment.insert_assignments', return_value={(1, 'u4'): winner}):
+            result = get_or_create_assignment(self.mock_db, self.mock_cache_client, experiment_id=1, user_id='u4')
         
         # Assertions
         
-        # 1. Check final result is the one loaded during the retry read (Control)
+        # 1. Check final result is the competing transaction's (Control), also cached
         self.assertEqual(result.variant_name, 'Control')
+        self.assertEqual(self.mock_cache_client.get_assignment(1, 'u4').variant_name, 'Control')
         
-        # 2. Commit was called once (failed), rollback was called once (to clear session)
-        self.mock_db.commit.assert_called_once()
-        self.mock_db.rollback.assert_called_once()
+        # 2. No exception driven control flow: nothing rolled back
+        self.mock_db.rollback.assert_not_called()
         
-        # 3. The loop ran twice (one failed write, one successful read)
-        # Assert that query was called 3 times (read, experiment fetch, retry read).
-        self.assertEqual(self.mock_db.query.call_count, 3) 
+        # 3. Query was called 2 times (read, experiment fetch), no retry read
+        self.assertEqual(self.mock_db.query.call_count, 2) 
 
-    @patch('services.assignment.random.choices', return_value=['A'])
-    def test_get_or_create_assignment_exceeds_max_retries_sad_path(self, mock_choices):
+    @patch('services.allocation.random.choices', return_value=['A'])
+    def test_get_or_create_assignment_unexpected_exception_sad_path(self, mock_choices):
         """
-        Tests the sad path where the IntegrityError persists for MAX_RETRIES times.
+        Tests the sad path where the database write fails.
         """
         
-        # 1. Mock the initial READ: Always returns None
+        # 1. Mock the initial READ: Returns None
         self.mock_db.query.return_value.filter.return_value.first.return_value = None
         
         # 2. Mock the Experiment fetch: Valid experiment
         mock_experiment = MockExperiment(id=1, variants=[MockVariant(1, 'A', 100)])
         self.mock_db.query.return_value.filter.return_value.one_or_none.return_value = mock_experiment
 
-        # 3. Mock the commit: Always fail with IntegrityError (for 3 attempts)
-        self.mock_db.commit.side_effect = IntegrityError("Race", "Params", "Statement")
-        
+        # 3. Mock the upsert: Fail with a general exception
         # Execute and assert HTTPException
-        with self.assertRaisesRegex(HTTPException, "unable to create assignment"):
-            get_or_create_assignment(self.mock_db, self.mock_cache_client, experiment_id=1, user_id='u5')
+        with patch('services.assignment.insert_assignments', side_effect=Exception("Database is down")):
+            with self.assertRaisesRegex(HTTPException, "unable to create assignment"):
+                get_or_create_assignment(self.mock_db, self.mock_cache_client, experiment_id=1, user_id='u6')
             
         # Assertions
-        # Loop runs MAX_RETRIES (3) times, so commit and rollback are called 3 times
-        self.assertEqual(self.mock_db.commit.call_count, MAX_RETRIES)
-        self.assertEqual(self.mock_db.rollback.call_count, MAX_RETRIES)
-        
-    @patch('services.assignment.random.choices', return_value=['A'])
-    def test_get_or_create_assignment_unexpected_exception_sad_path(self, mock_choices):
-        """
-        Tests the sad path where a non-IntegrityError Exception occurs.
-        """
-        
-        # 1. Mock the initial READ: Returns None
+        self.mock_db.rollback.assert_called_once()
+        self.assertIsNone(self.mock_cache_client.get_assignment(1, 'u6'))
+    # --- Test Cases for deterministic assignment mode ---
+
+    @patch('services.assignment.config')
+    def test_deterministic_assignment_is_stable_and_skips_db(self, mock_config):
+        """Deterministic mode without persistence returns the same variant and never touches the DB."""
+        mock_config.assignment_mode = 'deterministic'
+        mock_config.assignment_persist = False
+        mock_config.assignment_salt = ''
+
+        mock_experiment = MockExperiment(id=7, variants=[MockVariant(7, 'A', 50), MockVariant(7, 'B', 50)])
+        self.mock_cache_client.set_experiment(mock_experiment)
+
+        first = get_or_create_assignment(self.mock_db, self.mock_cache_client, experiment_id=7, user_id='u7')
+        self.assertIsNotNone(first.assigned_at)
+        second = get_or_create_assignment(self.mock_db, self.mock_cache_client, experiment_id=7, user_id='u7')
+
+        self.assertEqual(first.variant_name, second.variant_name)
+        self.mock_db.query.assert_not_called()
+        self.mock_db.add.assert_not_called()
+        self.mock_db.commit.assert_not_called()
+
+    def test_deterministic_variant_follows_allocation(self):
+        """The hash buckets follow allocation_percent and ignore zero weight variants."""
+        experiment = MockExperiment(id=8, variants=[
+            MockVariant(8, 'A', 90), MockVariant(8, 'Off', 0), MockVariant(8, 'B', 10)
+        ])
+        picks = [choose_deterministic_variant(experiment, f"user-{i}") for i in range(5000)]
+
+        self.assertNotIn('Off', picks)
+        self.assertAlmostEqual(picks.count('A') / len(picks), 0.9, delta=0.03)
+
+    # --- Test Cases for write-behind persistence ---
+
+    @patch('services.assignment.get_assignment_writer')
+    @patch('services.assignment.config')
+    def test_write_behind_skips_db_write(self, mock_config, mock_get_writer):
+        """Write-behind mode claims the assignment in the cache and queues it instead of committing."""
+        mock_config.assignment_mode = 'random'
+        mock_config.assignment_write_mode = 'write_behind'
         self.mock_db.query.return_value.filter.return_value.first.return_value = None
-        
-        # 2. Mock the Experiment fetch: Valid experiment
         mock_experiment = MockExperiment(id=1, variants=[MockVariant(1, 'A', 100)])
         self.mock_db.query.return_value.filter.return_value.one_or_none.return_value = mock_experiment
 
-        # 3. Mock the commit: Fail with a general exception
-        self.mock_db.commit.side_effect = Exception("Database is down")
-        
-        # Execute and assert HTTPException
-        with self.assertRaisesRegex(HTTPException, "unable to create assignment"):
-            get_or_create_assignment(self.mock_db, self.mock_cache_client, experiment_id=1, user_id='u6')
-            
-        # Assertions
-        self.mock_db.commit.assert_called_once()
-        self.mock_db.rollback.assert_called_once()
\ No newline at end of file
+        result = get_or_create_assignment(self.mock_db, self.mock_cache_client, experiment_id=1, user_id='u9')
+
+        self.assertEqual(result.variant_name, 'A')
+        self.assertIsNotNone(result.assigned_at)
+        self.mock_db.add.assert_not_called()
+        self.mock_db.commit.assert_not_called()
+        mock_get_writer.return_value.enqueue.assert_called_once_with(result)
+
+    @patch('services.assignment.get_assignment_writer')
+    def test_write_behind_returns_concurrent_winner(self, mock_get_writer):
+        """When another worker already claimed the user, its assignment is returned and nothing is queued."""
+        winner = MockAssignment(user_id='u10', experiment_id=1, variant_name='B')
+        self.mock_cache_client.add_assignment(winner)
+
+        result = set_assignment_write_behind(self.mock_cache_client, MockAssignment(user_id='u10', experiment_id=1, variant_name='A'))
+
+        self.assertEqual(result.variant_name, 'B')
+        mock_get_writer.return_value.enqueue.assert_not_called()
+
+    @patch('services.assignment.get_assignment_writer')
+    def test_bulk_write_behind_claims_in_one_pipeline(self, mock_get_writer):
+        """Bulk claims go in one round-trip, only the won claims are queued, in one batch."""
+        winner = MockAssignment(user_id='u11', experiment_id=1, variant_name='B')
+        self.mock_cache_client.add_assignment(winner)
+        backend = self.mock_cache_client.backend = MagicMock(wraps=self.mock_cache_client.backend)
+        new_assignments = [MockAssignment(user_id=f'u1{i}', experiment_id=1, variant_name='A') for i in range(3)]
+
+        results = set_assignments_write_behind(self.mock_cache_client, new_assignments)
+
+        self.assertEqual([r.variant_name for r in results], ['A', 'B', 'A'])
+        backend.set_many_nx.assert_called_once()
+        backend.set.assert_not_called()
+        mock_get_writer.return_value.enqueue_many.assert_called_once_with([new_assignments[0], new_assignments[2]])
@@ -0,0 +1,171 @@
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+from data.database import Experiment, Variant, Assignment
+from models.experiments import ExperimentCreate
+from datetime import datetime, timezone
+from fastapi import HTTPException
+from services.assignment import (
+    ASSIGNMENT_MODE_DETERMINISTIC, assignment_insert_statement, assignment_row, choose_deterministic_variant, choose_variant
+)
+from services.bloom import BLOOM_VALKEY, get_assignment_bloom
+from services.cache import ASSIGNMENT_LAYOUT_HASH, AsyncCacheClient
+from services.write_behind import ASSIGNMENT_WRITE_MODE_WRITE_BEHIND, get_assignment_writer
+from config import config
+import anyio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Async versions of services.assignment for the async request path (config.async_mode).
+# Variant selection is pure CPU and shared with the sync service, only the I/O is awaited.
+# Relationships are never lazy loaded here (no implicit async IO), they are eager loaded
+# with selectinload where the code needs them.
+
+# --- Experiment Creation ---
+async def create_new_experiment(db, cache: AsyncCacheClient, experiment_data: ExperimentCreate):
+    """Creates a new experiment and its associated variants."""
+    db_experiment = Experiment(name=experiment_data.name, description=experiment_data.description)
+    db_experiment.variants = [
+        Variant(name=v.name, allocation_percent=v.allocation_percent) for v in experiment_data.variants
+    ]
+    db.add(db_experiment)
+    await db.commit()
+    logger.info("create new experiment %s success with experiment id: %d", experiment_data.name, db_experiment.id)
+    await cache.invalidate_experiment(db_experiment.id)
+    return db_experiment
+
+async def add_to_bloom(pairs: list[tuple[int, str]]):
+    """ AssignmentBloom.add, in a worker thread when it writes to the shared filter in Valkey """
+    bloom = get_assignment_bloom()
+    if bloom.mode == BLOOM_VALKEY:
+        await anyio.to_thread.run_sync(bloom.add, pairs)
+    else:
+        bloom.add(pairs)
+
+async def get_existing_assignment(db, cache: AsyncCacheClient, experiment_id: int, user_id: str):
+    """ Get existing assignment, cache first. Users recently found unassigned skip the database """
+    existing_assignment = await cache.get_assignment(experiment_id, user_id)
+    if not existing_assignment:
+        if await cache.get_many_unassigned([(experiment_id, user_id)]):
+            logger.debug("get_existing_assignment %d user %s never assigned", experiment_id, user_id)
+            return None
+
+        existing_assignment = (await db.execute(
+            select(Assignment).where(
+                Assignment.user_id == user_id,
+                Assignment.experiment_id == experiment_id
+            )
+        )).scalars().first()
+
+        if existing_assignment:
+            await add_to_bloom([(experiment_id, user_id)])
+            if cache.assignment_layout == ASSIGNMENT_LAYOUT_HASH:
+                await get_experiment(db=db, cache=cache, experiment_id=experiment_id)
+            await cache.set_assignment(existing_assignment)
+            logger.debug("get_existing_assignment %d cache miss", experiment_id)
+    else:
+        logger.debug("get_existing_assignment %d cache hit", experiment_id)
+
+    return existing_assignment
+
+async def get_experiment(db, cache: AsyncCacheClient, experiment_id: int):
+    """ Get experiment with its variants, cache first. Concurrent cache misses share a single database read """
+
+    async def load_experiment():
+        logger.debug("get_experiment %d cache miss", experiment_id)
+        return (await db.execute(
+            select(Experiment).options(selectinload(Experiment.variants)).where(Experiment.id == experiment_id)
+        )).scalars().one_or_none()
+
+    return await cache.get_or_load_experiment(experiment_id, load_experiment)
+
+async def get_experiment_or_404(db, cache: AsyncCacheClient, experiment_id: int):
+    """ Get an experiment that can be assigned, raise 404 otherwise """
+    experiment = await get_experiment(db=db, cache=cache, experiment_id=experiment_id)
+    if not experiment or not experiment.variants:
+        logger.info("Experiment ID %d not found or has no variants.", experiment_id)
+        raise HTTPException(status_code=404, detail=f"Experiment ID {experiment_id} not found or has no variants.")
+    return experiment
+
+async def get_deterministic_assignment(db, cache: AsyncCacheClient, experiment_id: int, user_id: str):
+    """ See services.assignment.get_deterministic_assignment """
+    experiment = await get_experiment_or_404(db=db, cache=cache, experiment_id=experiment_id)
+    return Assignment(
+        user_id=user_id,
+        experiment_id=experiment_id,
+        variant_name=choose_deterministic_variant(experiment, user_id),
+        assigned_at=datetime.now(timezone.utc)
+    )
+
+async def set_assignment_write_behind(cache: AsyncCacheClient, assignment: Assignment) -> Assignment:
+    """ See services.assignment.set_assignment_write_behind """
+    if assignment.assigned_at is None:
+        assignment.assigned_at = datetime.now(timezone.utc)
+
+    claimed = await cache.add_assignment(assignment)
+    if claimed is False:
+        winner = await cache.get_assignment(assignment.experiment_id, assignment.user_id)
+        if winner:
+            return winner
+
+    # Non blocking, the flusher thread does the database write
+    get_assignment_writer().enqueue(assignment)
+    await add_to_bloom([(assignment.experiment_id, assignment.user_id)])
+    return assignment
+
+# --- Idempotent Assignment ---
+async def insert_assignment(db, assignment: Assignment) -> Assignment:
+    """ See services.assignment.insert_assignments: one upsert, the concurrent winner's row is read back """
+    stored = (await db.scalars(assignment_insert_statement(db.get_bind()), [assignment_row(assignment)])).one_or_none()
+    if stored is None:
+        logger.info("RACE DETECTED: user %s (EID %d) was assigned concurrently, reading the assignment.",
+                    assignment.user_id, assignment.experiment_id)
+        stored = (await db.execute(
+            select(Assignment).where(
+                Assignment.user_id == assignment.user_id,
+                Assignment.experiment_id == assignment.experiment_id
+            )
+        )).scalars().one()
+    db.expunge(stored)
+    await db.commit()
+    return stored
+
+async def get_or_create_assignment(db, cache: AsyncCacheClient, experiment_id: int, user_id: str):
+    """
+    Retrieves an existing assignment or creates a new one if doesn't exist,
+    races are settled by the same single upsert as the sync service.
+    """
+    if config.assignment_mode == ASSIGNMENT_MODE_DETERMINISTIC and not config.assignment_persist:
+        return await get_deterministic_assignment(db=db, cache=cache, experiment_id=experiment_id, user_id=user_id)
+
+    existing_assignment = await get_existing_assignment(db=db, cache=cache, experiment_id=experiment_id, user_id=user_id)
+    if existing_assignment:
+        logger.info("Found persistent assignment for user %s on EID %d: %s",
+                    user_id, experiment_id, existing_assignment.variant_name)
+        return existing_assignment
+
+    experiment = await get_experiment_or_404(db=db, cache=cache, experiment_id=experiment_id)
+    assigned_variant_name = choose_variant(experiment, user_id)
+
+    new_assignment = Assignment(
+        user_id=user_id,
+        experiment_id=experiment_id,
+        variant_name=assigned_variant_name,
+        # set here, the column default is only known after a refresh
+        assigned_at=datetime.now(timezone.utc)
+    )
+
+    if config.assignment_write_mode == ASSIGNMENT_WRITE_MODE_WRITE_BEHIND:
+        return await set_assignment_write_behind(cache=cache, assignment=new_assignment)
+
+    try:
+        assignment = await insert_assignment(db, new_assignment)
+    except Exception:
+        await db.rollback()
+        logger.exception("An unexpected error occurred during assignment for user %s.", user_id)
+        raise HTTPException(status_code=400, detail=f"Experiment ID {experiment_id} unable to create assignment.")
+
+    await cache.set_assignment(assignment)
+    await add_to_bloom([(experiment_id, user_id)])
+    logger.info("SUCCESS: User %s assigned to %s (EID %d).", user_id, assignment.variant_name, experiment_id)
+    return assignment
@@ -0,0 +1,79 @@
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+from datetime import datetime
+from fastapi import BackgroundTasks, HTTPException
+from models.results import ExperimentResultsSummary
+from data.database import Experiment
+from services.cache import AsyncCacheClient
+from services.results import build_summary, results_cache_key, results_entry, summary_statements
+from config import config
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Async versions of services.results for the async request path (config.async_mode),
+# the queries and the cache entries are the ones of the sync service.
+
+async def calculate_summary(
+    db,
+    experiment_id: int,
+    event_type: str,
+    start_datetime: datetime | None,
+    use_rollups: bool | None = None
+) -> ExperimentResultsSummary:
+    """ See services.results.calculate_summary """
+    experiment = (await db.execute(select(Experiment).options(selectinload(Experiment.variants)).where(Experiment.id == experiment_id))).scalars().first()
+    if not experiment:
+        raise HTTPException(status_code=404, detail="Experiment not found.")
+
+    conversion_statement, assignment_statement = summary_statements(experiment_id, event_type, start_datetime, use_rollups)
+    conversion_results = (await db.execute(conversion_statement)).all()
+    assignment_counts = (await db.execute(assignment_statement)).all()
+
+    return build_summary(experiment, conversion_results, assignment_counts)
+
+
+async def compute_results_entry(db, experiment_id: int, event_type: str, start_datetime: datetime | None, use_rollups: bool | None = None, previous: dict | None = None) -> dict:
+    summary = await calculate_summary(db, experiment_id, event_type, start_datetime, use_rollups=use_rollups)
+    return results_entry(summary, previous)
+
+
+async def refresh_cached_summary(session_factory, cache: AsyncCacheClient, key: str, token: str, experiment_id: int, event_type: str, start_datetime: datetime | None, previous: dict | None):
+    """ Background recomputation of a stale entry, runs only while holding the key's refresh lock """
+    try:
+        async with session_factory() as db:
+            entry = await compute_results_entry(db, experiment_id, event_type, start_datetime, previous=previous)
+        await cache.set_results(key, entry, ex=config.results_cache_stale_ttl)
+    except Exception as e:
+        logger.error("Failed to refresh results %s: %s", key, e)
+    finally:
+        await cache.release_results_refresh(key, token)
+
+
+async def get_cached_summary(
+    db,
+    session_factory,
+    cache: AsyncCacheClient,
+    background_tasks: BackgroundTasks,
+    experiment_id: int,
+    event_type: str,
+    start_datetime: datetime | None
+) -> dict:
+    """ See services.results.get_cached_summary """
+    if config.results_cache_ttl <= 0 or not config.results_use_rollups:
+        return await compute_results_entry(db, experiment_id, event_type, start_datetime)
+
+    key = results_cache_key(experiment_id, event_type, start_datetime)
+    entry = await cache.get_results(key)
+    if entry:
+        token = await cache.acquire_results_refresh(key) if time.time() - entry["computed_at"] > config.results_cache_ttl else None
+        if token:
+            background_tasks.add_task(
+                refresh_cached_summary, session_factory, cache, key, token, experiment_id, event_type, start_datetime, entry
+            )
+        return entry
+
+    entry = await compute_results_entry(db, experiment_id, event_type, start_datetime)
+    await cache.set_results(key, entry, ex=config.results_cache_stale_ttl)
+    return entry
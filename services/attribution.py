@@ -0,0 +1,113 @@
+from sqlalchemy.orm import Session
+from datetime import datetime, timezone
+from data.database import Assignment, Event, EventAttribution, Experiment, dialect_insert
+from services.assignment import get_existing_assignments, known_unassigned
+from services.bloom import get_assignment_bloom
+from services.cache import CacheClient
+from services.rollups import WATERMARK_ATTRIBUTION, advance_cursor, lock_cursors
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Events enriched per run, bounds the (experiment, user) lookups of one transaction
+ATTRIBUTION_BATCH_SIZE = 1000
+
+
+def _naive_utc(value: datetime) -> datetime:
+    """ Stored timestamps are naive UTC, cached ones may carry an offset """
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def lookup_assignments(db: Session, cache: CacheClient, pairs: list[tuple[int, str]]) -> dict[tuple[int, str], Assignment]:
+    """
+    Assignments of (experiment_id, user_id) pairs, cache first then one bulk read for the misses.
+    Most event users are in few experiments: pairs known to be unassigned skip the read and
+    the ones the read didn't find are negatively cached.
+    """
+    found = cache.get_many_assignments(pairs)
+    missing = [pair for pair in pairs if pair not in found]
+    if missing:
+        # No unique constraint protects this read, only trust filters shared by every worker
+        unassigned = known_unassigned(db, cache, missing, shared_only=True)
+        missing = [pair for pair in missing if pair not in unassigned]
+    if missing:
+        from_db = get_existing_assignments(db, missing)
+        for assignment in from_db.values():
+            db.expunge(assignment)
+        # Keep the cache warm for the next batches of the same users
+        cache.set_many_assignments(list(from_db.values()))
+        cache.set_many_unassigned([pair for pair in missing if pair not in from_db])
+        get_assignment_bloom().add(list(from_db))
+        found.update(from_db)
+    return found
+
+
+def attribute_events(db: Session, cache: CacheClient, events: list[Event]) -> list[dict]:
+    """
+    Attribution rows of events: one per active experiment the user was assigned to
+    before the event, inside the experiment's window (not before it was created).
+    """
+    experiments = db.query(Experiment.id, Experiment.created_at).filter(Experiment.is_active == True).all()
+    if not experiments or not events:
+        return []
+
+    user_ids = sorted({event.user_id for event in events})
+    pairs = [(experiment_id, user_id) for experiment_id, _ in experiments for user_id in user_ids]
+    assignments = lookup_assignments(db, cache, pairs)
+
+    rows = []
+    for event in events:
+        timestamp = _naive_utc(event.timestamp)
+        for experiment_id, created_at in experiments:
+            assignment = assignments.get((experiment_id, event.user_id))
+            if assignment is None or assignment.assigned_at is None:
+                continue
+            # Only events that happened AFTER assignment, within the experiment's lifetime
+            if timestamp <= _naive_utc(assignment.assigned_at):
+                continue
+            if created_at is not None and timestamp < _naive_utc(created_at):
+                continue
+            rows.append({
+                "event_id": event.id,
+                "experiment_id": experiment_id,
+                "variant_name": assignment.variant_name,
+                "event_type": event.type,
+                "timestamp": timestamp,
+            })
+    return rows
+
+
+def attribute_new_events(db: Session, cache: CacheClient, batch_size: int = ATTRIBUTION_BATCH_SIZE) -> int:
+    """
+    Enrichment stage: attribute the events inserted since the last run, in one transaction
+    together with the attribution cursor. Returns the number of events processed.
+    Assignments persisted after their user's events were enriched are not credited.
+    """
+    try:
+        cursor = lock_cursors(db, [WATERMARK_ATTRIBUTION])[WATERMARK_ATTRIBUTION]
+        events = db.query(Event).filter(cursor.pending(Event.id)).order_by(Event.id).limit(batch_size).all()
+        if events:
+            rows = attribute_events(db, cache, events)
+            if rows:
+                db.execute(
+                    dialect_insert(db.get_bind(), EventAttribution).on_conflict_do_nothing(index_elements=["event_id", "experiment_id"]),
+                    rows
+                )
+            advance_cursor(db, cursor, [event.id for event in events])
+            logger.debug("attributed %d events to %d experiment variants", len(events), len(rows))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return len(events)
+
+
+def attribute_new_events_until_current(db: Session, cache: CacheClient, batch_size: int = ATTRIBUTION_BATCH_SIZE) -> int:
+    """ Run attribute_new_events until every event is processed, returns the number of batches """
+    batches = 0
+    while attribute_new_events(db, cache, batch_size):
+        batches += 1
+    return batches
@@ -0,0 +1,181 @@
+from services.event_stream import EVENT_STREAM_GROUP, EVENT_TRANSPORT_STREAM
+from typing import Any, Callable
+from config import config
+import anyio
+import itertools
+import threading
+import time
+import redis
+import logging
+
+logger = logging.getLogger(__name__)
+
+CELERY_EVENT_QUEUE = "default"       # see celery_config.task_routes, a Valkey list on the broker
+QUEUE_DEPTH_CHECK_INTERVAL = 1.0     # seconds between two broker depth samples per process
+PUBLISH_LATENCY_ALPHA = 0.2          # weight of the newest publish in the latency average
+
+
+class IngestionOverloaded(Exception):
+    """The event ingestion routes are shedding load, retry after retry_after seconds."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class IngestionAdmission:
+    """
+    Admission control in front of the broker for /events and /events/batch.
+
+    Requests are shed (IngestionOverloaded, answered with 429 + Retry-After) while:
+    - the broker backlog, sampled by a background thread every QUEUE_DEPTH_CHECK_INTERVAL,
+      holds more than max_queue_depth messages (celery queue length, or unread plus pending
+      stream entries), e.g. because Postgres is slow and the workers fall behind;
+    - publishes take longer than max_publish_latency_ms, counting the publishes still
+      in flight, so a broker stuck in the celery publish retry policy is noticed before
+      its first retry gives up;
+    - all max_concurrency ingestion threads are busy.
+    Publishes run on their own capacity limiter instead of the shared threadpool, so an
+    ingestion surge cannot take the threads the assignment routes run on.
+    """
+
+    def __init__(
+        self,
+        max_queue_depth: int = 0,
+        max_publish_latency_ms: float = 0,
+        max_concurrency: int = 16,
+        retry_after: int = 5,
+        depth_reader: Callable[[], int] | None = None
+    ):
+        self.max_queue_depth = max_queue_depth
+        self.max_publish_latency = max_publish_latency_ms / 1000
+        self.retry_after = retry_after
+        self.limiter = anyio.CapacityLimiter(max_concurrency)
+        self.depth_reader = depth_reader
+        self.queue_depth: int | None = None
+        self.publish_latency = 0.0
+        self.last_publish_at: float | None = None
+        self._in_flight: dict[int, float] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._sampler: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+
+        # Stats
+        self.shed_total: dict[str, int] = {}
+        self.depth_read_failures = 0
+
+    def check(self):
+        """Raise IngestionOverloaded when the request must be shed, never blocks."""
+        if self.max_queue_depth:
+            self._ensure_sampler()
+            if self.queue_depth is not None and self.queue_depth > self.max_queue_depth:
+                self._shed("queue_depth")
+        if self.max_publish_latency and self.current_publish_latency() > self.max_publish_latency:
+            self._shed("publish_latency")
+        if self.limiter.borrowed_tokens >= self.limiter.total_tokens:
+            self._shed("concurrency")
+
+    def _shed(self, reason: str):
+        self.shed_total[reason] = self.shed_total.get(reason, 0) + 1
+        raise IngestionOverloaded(reason, self.retry_after)
+
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        """Run a blocking publish on the ingestion threads, timing it."""
+        return await anyio.to_thread.run_sync(self.timed, func, *args, limiter=self.limiter)
+
+    def timed(self, func: Callable[..., Any], *args) -> Any:
+        """Call a blocking publish, counting it in the publish latency."""
+        publish_id = next(self._ids)
+        started = time.monotonic()
+        with self._lock:
+            self._in_flight[publish_id] = started
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                del self._in_flight[publish_id]
+            self.last_publish_at = time.monotonic()
+            self.publish_latency += PUBLISH_LATENCY_ALPHA * (self.last_publish_at - started - self.publish_latency)
+
+    def current_publish_latency(self) -> float:
+        """
+        Average publish latency, or the age of the oldest publish still in flight when higher.
+        The average expires retry_after seconds after the last publish, shedding on it alone
+        would otherwise never let the publish through that shows the broker recovered.
+        """
+        now = time.monotonic()
+        with self._lock:
+            oldest = min(self._in_flight.values(), default=None)
+        latency = self.publish_latency
+        if self.last_publish_at is not None and now - self.last_publish_at > self.retry_after:
+            latency = 0.0
+        if oldest is None:
+            return latency
+        return max(latency, now - oldest)
+
+    def _ensure_sampler(self):
+        if self._sampler is not None and self._sampler.is_alive():
+            return
+        with self._start_lock:
+            if self._sampler is None or not self._sampler.is_alive():
+                self._sampler = threading.Thread(target=self._sample, name="ingestion-queue-depth", daemon=True)
+                self._sampler.start()
+
+    def _sample(self):
+        while True:
+            self.sample_queue_depth()
+            time.sleep(QUEUE_DEPTH_CHECK_INTERVAL)
+
+    def sample_queue_depth(self):
+        try:
+            if self.depth_reader is None:
+                self.depth_reader = _broker_depth_reader()
+            self.queue_depth = self.depth_reader()
+        except Exception as exc:
+            # Unknown depth admits requests, a broker that is down shows up in the publish latency
+            if self.queue_depth is not None or self.depth_read_failures == 0:
+                logger.warning("Could not read the broker queue depth: %s", exc)
+            self.queue_depth = None
+            self.depth_read_failures += 1
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "queue_depth": self.queue_depth,
+            "publish_latency_ms": round(self.current_publish_latency() * 1000, 3),
+            "publishes_in_flight": int(self.limiter.borrowed_tokens),
+            "shed_total": dict(self.shed_total),
+            "depth_read_failures": self.depth_read_failures,
+        }
+
+
+def _broker_depth_reader() -> Callable[[], int]:
+    """Backlog of the configured event transport, read from Valkey."""
+    if config.event_transport == EVENT_TRANSPORT_STREAM:
+        client = redis.Redis.from_url(config.event_stream_url, decode_responses=True, socket_timeout=1, socket_connect_timeout=1)
+
+        def stream_depth() -> int:
+            for group in client.xinfo_groups(config.event_stream_name):
+                if group["name"] == EVENT_STREAM_GROUP:
+                    # lag is unknown (None) after deletions, pending still counts
+                    return (group.get("lag") or 0) + group["pending"]
+            return client.xlen(config.event_stream_name)
+        return stream_depth
+
+    client = redis.Redis.from_url(config.celery_broker_url, socket_timeout=1, socket_connect_timeout=1)
+    return lambda: client.llen(CELERY_EVENT_QUEUE)
+
+
+_admission: IngestionAdmission | None = None
+
+def get_ingestion_admission() -> IngestionAdmission:
+    global _admission
+    if _admission is None:
+        _admission = IngestionAdmission(
+            max_queue_depth=config.ingest_max_queue_depth,
+            max_publish_latency_ms=config.ingest_max_publish_latency_ms,
+            max_concurrency=config.ingest_max_concurrency,
+            retry_after=config.ingest_retry_after
+        )
+    return _admission
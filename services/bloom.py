@@ -0,0 +1,425 @@
+from sqlalchemy import select
+from sqlalchemy.orm import Session, sessionmaker
+from data.database import Assignment
+from services.cache import VALKEY_BACKEND, _MockValkeyBackend
+from config import config
+from hashlib import blake2b
+from typing import NamedTuple
+import math
+import threading
+import time
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Supported values for config.assignment_bloom
+BLOOM_OFF = "off"
+BLOOM_LOCAL = "local"       # per-process filters, built from the database in the background on first use
+BLOOM_VALKEY = "valkey"     # one filter per experiment shared by every worker, mirrored in process
+
+BLOOM_BUILD_BATCH_SIZE = 10000    # user_ids streamed and added per round-trip while building
+BLOOM_BUILD_LOCK_TTL = 300        # a crashed build frees the experiment after 5 minutes
+BLOOM_READY_CHECK_INTERVAL = 5    # seconds a worker trusts its view of the shared filter keys
+# A build reads the assignments only once every worker adds to its bitmap: their views are
+# at most BLOOM_READY_CHECK_INTERVAL old, the rest covers the write-behind flush lag
+BLOOM_BUILD_DELAY = 2 * BLOOM_READY_CHECK_INTERVAL
+BLOOM_RETIRED_TTL = 2 * BLOOM_READY_CHECK_INTERVAL    # a replaced bitmap outlives every view of it
+
+
+class BloomFilter:
+    """
+    Fixed size Bloom filter of strings: no false negatives, false positives at about
+    error_rate while it holds at most capacity items. Positions use double hashing
+    over one blake2b digest, so the in-process bits and the Valkey bitmap agree.
+    """
+
+    def __init__(self, size_bits: int, hashes: int):
+        self.size_bits = size_bits
+        self.hashes = hashes
+        self.bits = bytearray((size_bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float) -> "BloomFilter":
+        return cls(*bloom_sizing(capacity, error_rate))
+
+    def positions(self, item: str) -> list[int]:
+        return bloom_positions(item, self.size_bits, self.hashes)
+
+    def add_positions(self, positions: list[int]):
+        for position in positions:
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def has_positions(self, positions: list[int]) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in positions)
+
+    def add(self, item: str):
+        self.add_positions(self.positions(item))
+
+    def __contains__(self, item: str) -> bool:
+        return self.has_positions(self.positions(item))
+
+
+def bloom_positions(item: str, size_bits: int, hashes: int) -> list[int]:
+    digest = blake2b(item.encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:], "little") | 1
+    return [(h1 + i * h2) % size_bits for i in range(hashes)]
+
+def bloom_sizing(capacity: int, error_rate: float) -> tuple[int, int]:
+    """Optimal (size_bits, hashes) for capacity items at error_rate false positives."""
+    capacity = max(capacity, 1)
+    size_bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+    hashes = max(1, round(size_bits / capacity * math.log(2)))
+    return size_bits, hashes
+
+
+class _SharedView(NamedTuple):
+    """A worker's view of the Valkey keys of one experiment's filter."""
+    live: str | None        # bitmap lookups read, None until a build completed
+    building: str | None    # bitmap being built, adds go to both
+    checked_at: float
+
+
+class AssignmentBloom:
+    """
+    Per-experiment Bloom filters of assigned user_ids, answering "this user was certainly
+    never assigned" so the assignment read can be skipped for first-time users.
+
+    local:  each process builds its filters from the database in the background on first
+            use, lookups read the database until it is ready, and adds the assignments it
+            sees. Assignments made by other workers are missing, so only callers where the
+            unique constraint arbitrates may trust it.
+    valkey: the bits live in a Valkey bitmap every worker adds to, the process keeps
+            a mirror of the bits it already saw. bloom:{id}:meta names the live bitmap,
+            bloom:{id}:next the one being built (see rebuild_many). A missing filter is
+            built in the background on first use, or with `backfill.py bloom`, lookups
+            read the database until it is ready.
+            The bitmaps and meta keys have no TTL: run Valkey with a volatile-* (or
+            noeviction) maxmemory-policy. An evicted bitmap is noticed by its sentinel bit
+            and rebuilt. With the mock backend (no VALKEY_HOST) the bitmap is per process,
+            shared_backend is False and the filter is trusted like a local one.
+    """
+
+    def __init__(self, backend, mode: str | None = None, capacity: int | None = None, error_rate: float | None = None,
+                 shared_backend: bool = True):
+        self.backend = backend
+        self.mode = (mode or config.assignment_bloom).lower()
+        self.shared_backend = shared_backend
+        self.size_bits, self.hashes = bloom_sizing(
+            config.assignment_bloom_capacity if capacity is None else capacity,
+            config.assignment_bloom_error_rate if error_rate is None else error_rate
+        )
+        self._filters: dict[int, BloomFilter] = {}
+        self._ready: set[int] = set()     # local filters completely built
+        self._views: dict[int, _SharedView] = {}
+        self._builds: dict[int, threading.Thread] = {}
+        self._lock = threading.Lock()
+
+        # Stats
+        self.skipped_reads = 0
+        self.builds = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode in (BLOOM_LOCAL, BLOOM_VALKEY)
+
+    @property
+    def shared(self) -> bool:
+        """True when every worker's assignments are in the filter."""
+        return self.mode == BLOOM_VALKEY and self.shared_backend
+
+    def _key(self, experiment_id: int) -> str:
+        return f"bloom:{experiment_id}"
+
+    def _sizing(self) -> str:
+        return f"{self.size_bits},{self.hashes}"
+
+    def _new_filter(self) -> BloomFilter:
+        return BloomFilter(self.size_bits, self.hashes)
+
+    def _bitmap_key(self, experiment_id: int, value: str | None, any_sizing: bool = False) -> str | None:
+        """Bitmap named by a meta/next value ("size_bits,hashes,version"), None when sized for another capacity."""
+        if not value:
+            return None
+        sizing, _, version = value.rpartition(",")
+        if not sizing or (sizing != self._sizing() and not any_sizing):
+            return None
+        return f"{self._key(experiment_id)}:{version}"
+
+    # --- Lookups ---
+
+    def unassigned(self, db: Session, pairs: list[tuple[int, str]]) -> set[tuple[int, str]]:
+        """The (experiment_id, user_id) pairs that certainly have no assignment."""
+        if not self.enabled or not pairs:
+            return set()
+
+        by_experiment: dict[int, list[str]] = {}
+        for experiment_id, user_id in pairs:
+            by_experiment.setdefault(experiment_id, []).append(user_id)
+
+        unassigned = set()
+        for experiment_id, user_ids in by_experiment.items():
+            if self.mode == BLOOM_LOCAL:
+                bloom = self._local_filter(db, experiment_id)
+                if bloom is not None:
+                    unassigned.update((experiment_id, user_id) for user_id in user_ids if user_id not in bloom)
+            else:
+                unassigned.update((experiment_id, user_id) for user_id in self._shared_unassigned(db, experiment_id, user_ids))
+
+        self.skipped_reads += len(unassigned)
+        return unassigned
+
+    def _local_filter(self, db: Session, experiment_id: int) -> BloomFilter | None:
+        """The experiment's filter, None until it is built: the scan never runs on the request thread."""
+        if experiment_id in self._ready:
+            return self._filters[experiment_id]
+        self._build_in_background(db, experiment_id)
+        return None
+
+    def _build_local(self, db: Session, experiment_id: int) -> int:
+        bloom = self._new_filter()
+        # Published before the scan so the assignments added meanwhile land in it too
+        with self._lock:
+            self._ready.discard(experiment_id)
+            self._filters[experiment_id] = bloom
+        added = 0
+        for user_ids in _assigned_user_ids(db, experiment_id):
+            for user_id in user_ids:
+                bloom.add(user_id)
+            added += len(user_ids)
+        with self._lock:
+            if self._filters.get(experiment_id) is bloom:
+                self._ready.add(experiment_id)
+        self.builds += 1
+        return added
+
+    def _shared_unassigned(self, db: Session, experiment_id: int, user_ids: list[str]) -> list[str]:
+        view = self._view(experiment_id)
+        if view.live is None:
+            # Missing, or sized for another capacity/error rate: until it is built reads go to the database
+            if view.building is None:
+                self._build_in_background(db, experiment_id)
+            return []
+
+        mirror = self._filters.get(experiment_id)
+        if mirror is None:
+            mirror = self._filters[experiment_id] = self._new_filter()
+        # Bits already seen in this process need no round-trip, they can only say "maybe"
+        to_check = []
+        for user_id in user_ids:
+            positions = mirror.positions(user_id)
+            if not mirror.has_positions(positions):
+                to_check.append((user_id, positions))
+        if not to_check:
+            return []
+
+        # The sentinel bit and the meta key, read after the bits, tell whether the bitmap
+        # still was the complete live one
+        meta_key = f"{self._key(experiment_id)}:meta"
+        items = [(view.live, position) for _, positions in to_check for position in positions]
+        reply = self.backend.getbit_many_then_get(items + [(view.live, self.size_bits)], meta_key)
+        if reply is None:
+            return []
+        bits, meta = reply
+        if self._bitmap_key(experiment_id, meta) != view.live:
+            # Replaced by a rebuild since the view was read
+            self._views.pop(experiment_id, None)
+            return []
+        if not bits[-1]:
+            logger.warning("Assignment Bloom filter of experiment %d was evicted, rebuilding it.", experiment_id)
+            self.backend.delete(meta_key)
+            self._views.pop(experiment_id, None)
+            return []
+
+        unassigned = []
+        for i, (user_id, positions) in enumerate(to_check):
+            if all(bits[i * self.hashes:(i + 1) * self.hashes]):
+                mirror.add_positions(positions)
+            else:
+                unassigned.append(user_id)
+        return unassigned
+
+    def _view(self, experiment_id: int, refresh: bool = False) -> _SharedView:
+        """Bitmaps of the experiment, re-read from Valkey every BLOOM_READY_CHECK_INTERVAL."""
+        view = self._views.get(experiment_id)
+        now = time.monotonic()
+        if refresh or view is None or now - view.checked_at >= BLOOM_READY_CHECK_INTERVAL:
+            key = self._key(experiment_id)
+            meta, building = self.backend.get_many([f"{key}:meta", f"{key}:next"])
+            live = self._bitmap_key(experiment_id, meta)
+            if view is None or view.live != live:
+                # The mirror holds bits of the previous bitmap
+                self._filters.pop(experiment_id, None)
+            view = self._views[experiment_id] = _SharedView(live, self._bitmap_key(experiment_id, building), now)
+        return view
+
+    def _build_in_background(self, db: Session, experiment_id: int):
+        with self._lock:
+            build = self._builds.get(experiment_id)
+            if build is not None and build.is_alive():
+                return
+            # The request session is closed before the build ends, use a new one on the same engine
+            session_factory = sessionmaker(autocommit=False, autoflush=False, bind=db.get_bind())
+            build = threading.Thread(
+                target=self._background_build, args=(session_factory, experiment_id),
+                name=f"assignment-bloom-{experiment_id}", daemon=True
+            )
+            self._builds[experiment_id] = build
+            build.start()
+
+    def _background_build(self, session_factory, experiment_id: int):
+        db = session_factory()
+        try:
+            self.rebuild(db, experiment_id)
+        except Exception:
+            logger.exception("Assignment Bloom filter of experiment %d could not be built.", experiment_id)
+        finally:
+            db.close()
+            # Built here or by another worker: the next lookup re-reads the keys
+            self._views.pop(experiment_id, None)
+
+    # --- Updates ---
+
+    def add(self, pairs: list[tuple[int, str]]):
+        """Record assignments, must be called for every assignment created or read from the database."""
+        if not self.enabled or not pairs:
+            return
+
+        items = []
+        for experiment_id, user_id in pairs:
+            positions = bloom_positions(user_id, self.size_bits, self.hashes)
+            bloom = self._filters.get(experiment_id)
+            if bloom is not None:
+                bloom.add_positions(positions)
+            if self.mode == BLOOM_VALKEY:
+                view = self._view(experiment_id)
+                for bitmap in (view.live, view.building):
+                    if bitmap is not None:
+                        items.extend((bitmap, position) for position in positions)
+        if items:
+            self.backend.setbit_many(items)
+
+    def rebuild(self, db: Session, experiment_id: int, reset: bool = False) -> int:
+        """(Re)build the filter of an experiment from the assignments table, returns the users added."""
+        if self.mode != BLOOM_VALKEY:
+            return self._build_local(db, experiment_id)
+        return self.rebuild_many(db, [experiment_id], reset=reset)[experiment_id]
+
+    def rebuild_many(self, db: Session, experiment_ids: list[int], reset: bool = False) -> dict[int, int]:
+        """
+        (Re)build the shared filters of experiments from the assignments table, returns the users
+        added per experiment.
+
+        Without reset the users are added to the current bitmaps, the live one and the one being
+        built: bits are only ever added, so concurrent assignments are never lost. Experiments
+        without either, and every experiment with reset (to drop the old bits, e.g. after
+        changing the capacity or error rate), get a full build into a new bitmap. The live
+        bitmap is never emptied: a build claims bloom:{id}:next, waits BLOOM_BUILD_DELAY until
+        every worker adds to the new bitmap too, reads the assignments into it and only then
+        points bloom:{id}:meta at it. The replaced bitmap expires after BLOOM_RETIRED_TTL.
+        """
+        added: dict[int, int] = {}
+        claimed: dict[int, str] = {}
+        for experiment_id in experiment_ids:
+            view = self._view(experiment_id, refresh=True)
+            if reset or (view.live is None and view.building is None):
+                version = self._claim_build(experiment_id)
+                if version is not None:
+                    claimed[experiment_id] = version
+                    continue
+                # Another worker is building it
+                view = self._view(experiment_id, refresh=True)
+            added[experiment_id] = self._add_assigned(db, experiment_id, [bitmap for bitmap in (view.live, view.building) if bitmap is not None])
+
+        if claimed:
+            time.sleep(BLOOM_BUILD_DELAY)
+        for experiment_id, version in claimed.items():
+            added[experiment_id] = self._build(db, experiment_id, version)
+        return added
+
+    def _claim_build(self, experiment_id: int) -> str | None:
+        version = f"{self._sizing()},{uuid.uuid4().hex[:12]}"
+        if not self.backend.set(f"{self._key(experiment_id)}:next", version, ex=BLOOM_BUILD_LOCK_TTL, nx=True):
+            return None
+        self._views.pop(experiment_id, None)
+        return version
+
+    def _add_assigned(self, db: Session, experiment_id: int, bitmaps: list[str]) -> int:
+        if not bitmaps:
+            return 0
+        return sum(self._add_users(experiment_id, bitmaps, user_ids) for user_ids in _assigned_user_ids(db, experiment_id))
+
+    def _add_users(self, experiment_id: int, bitmaps: list[str], user_ids: list[str]) -> int:
+        positions = [position for user_id in user_ids for position in bloom_positions(user_id, self.size_bits, self.hashes)]
+        if self.backend.setbit_many([(bitmap, position) for bitmap in bitmaps for position in positions]) is None:
+            raise RuntimeError(f"Could not add the assignments of experiment {experiment_id} to its Bloom filter")
+        return len(user_ids)
+
+    def _build(self, db: Session, experiment_id: int, version: str) -> int:
+        key = self._key(experiment_id)
+        bitmap = self._bitmap_key(experiment_id, version)
+        swapped = False
+        try:
+            added = 0
+            for user_ids in _assigned_user_ids(db, experiment_id):
+                added += self._add_users(experiment_id, [bitmap], user_ids)
+                # Keep the claim while building, the bitmap of a crashed build expires with it
+                self.backend.expire(bitmap, BLOOM_BUILD_LOCK_TTL)
+                self.backend.set(f"{key}:next", version, ex=BLOOM_BUILD_LOCK_TTL)
+
+            # Sentinel past the last position: lookups tell an evicted bitmap from a sparse one
+            if self.backend.setbit_many([(bitmap, self.size_bits)]) is None:
+                raise RuntimeError(f"Could not complete the Bloom filter of experiment {experiment_id}")
+            self.backend.expire(bitmap, None)
+            previous = self._bitmap_key(experiment_id, self.backend.get(f"{key}:meta"), any_sizing=True)
+            if not self.backend.set(f"{key}:meta", version, ex=None):
+                raise RuntimeError(f"Could not publish the Bloom filter of experiment {experiment_id}")
+            swapped = True
+            if previous is not None and previous != bitmap:
+                # Workers still reading it notice the new meta on their next lookup
+                self.backend.expire(previous, BLOOM_RETIRED_TTL)
+        finally:
+            if self.backend.get(f"{key}:next") == version:
+                self.backend.delete(f"{key}:next")
+            if not swapped:
+                self.backend.expire(bitmap, BLOOM_RETIRED_TTL)
+            self._views.pop(experiment_id, None)
+
+        self.builds += 1
+        logger.info("Assignment Bloom filter of experiment %d built: %d users, %d bits, %d hashes.",
+                    experiment_id, added, self.size_bits, self.hashes)
+        return added
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "size_bits": self.size_bits,
+            "hashes": self.hashes,
+            "experiments": len(self._filters),
+            "skipped_reads": self.skipped_reads,
+            "builds": self.builds,
+        }
+
+
+def _assigned_user_ids(db: Session, experiment_id: int):
+    """Stream the assigned user_ids of an experiment in batches."""
+    result = db.execute(
+        select(Assignment.user_id).where(Assignment.experiment_id == experiment_id).execution_options(yield_per=BLOOM_BUILD_BATCH_SIZE)
+    ).scalars()
+    while True:
+        user_ids = result.fetchmany(BLOOM_BUILD_BATCH_SIZE)
+        if not user_ids:
+            break
+        yield user_ids
+
+
+_bloom: AssignmentBloom | None = None
+
+def get_assignment_bloom() -> AssignmentBloom:
+    global _bloom
+    if _bloom is None:
+        _bloom = AssignmentBloom(backend=VALKEY_BACKEND, shared_backend=not isinstance(VALKEY_BACKEND, _MockValkeyBackend))
+        if _bloom.mode == BLOOM_VALKEY and not _bloom.shared:
+            logger.warning("ASSIGNMENT_BLOOM=valkey without a Valkey server, the filters are per process.")
+    return _bloom
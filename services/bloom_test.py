@@ -0,0 +1,127 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from services.bloom import BLOOM_VALKEY, AssignmentBloom, BloomFilter, bloom_sizing
+from services.cache import _MockValkeyBackend
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_no_false_negatives_and_bounded_false_positives(self):
+        bloom = BloomFilter.for_capacity(10000, 0.01)
+        for i in range(10000):
+            bloom.add(f"user-{i}")
+
+        self.assertTrue(all(f"user-{i}" in bloom for i in range(10000)))
+        false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives / 10000, 0.02)
+
+    def test_sizing(self):
+        self.assertEqual(bloom_sizing(1000000, 0.01), (9585059, 7))
+        self.assertEqual(bloom_sizing(1000, 0.001), (14378, 10))
+
+
+@patch("services.bloom.BLOOM_BUILD_DELAY", 0)
+class TestSharedAssignmentBloom(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = _MockValkeyBackend()
+        self.bloom = self.worker()
+        self.db = MagicMock()
+
+    def worker(self):
+        return AssignmentBloom(self.backend, mode=BLOOM_VALKEY, capacity=1000, error_rate=0.01)
+
+    def wait_for_build(self, bloom, experiment_id=1):
+        bloom._builds[experiment_id].join(5)
+
+    @patch("services.bloom._assigned_user_ids", return_value=iter([["u1", "u2"]]))
+    def test_lazy_build_then_shared_between_workers(self, _):
+        # Not built yet: answered "maybe" right away, built in the background
+        self.assertEqual(self.bloom.unassigned(self.db, [(1, "u1"), (1, "u3")]), set())
+        self.wait_for_build(self.bloom)
+        self.assertEqual(self.bloom.unassigned(self.db, [(1, "u1"), (1, "u3")]), {(1, "u3")})
+
+        # Another worker sees the bits this one adds
+        other_worker = self.worker()
+        self.bloom.add([(1, "u3")])
+        self.assertEqual(other_worker.unassigned(self.db, [(1, "u3"), (1, "u4")]), {(1, "u4")})
+        self.assertIsNone(self.backend.get("bloom:1:next"))
+
+    @patch("services.bloom._assigned_user_ids", return_value=iter([]))
+    def test_seen_bits_need_no_round_trip(self, _):
+        self.bloom.rebuild(self.db, 1)
+        self.bloom.unassigned(self.db, [(1, "u1")])
+        self.bloom.add([(1, "u1")])
+        self.backend.getbit_many_then_get = MagicMock()
+
+        self.assertEqual(self.bloom.unassigned(self.db, [(1, "u1")]), set())
+        self.backend.getbit_many_then_get.assert_not_called()
+
+    def test_build_in_progress_or_backend_error_reads_the_database(self):
+        self.backend.set("bloom:1:next", f"{self.bloom.size_bits},{self.bloom.hashes},abc", ex=300, nx=True)
+        self.assertEqual(self.bloom.unassigned(self.db, [(1, "u1")]), set())
+        self.assertNotIn(1, self.bloom._builds)
+
+        self.backend.set("bloom:1:meta", f"{self.bloom.size_bits},{self.bloom.hashes},abc", ex=None)
+        self.backend.getbit_many_then_get = MagicMock(return_value=None)
+        self.assertEqual(self.worker().unassigned(self.db, [(1, "u1")]), set())
+
+    @patch("services.bloom._assigned_user_ids", return_value=iter([]))
+    def test_resized_filter_is_rebuilt(self, _):
+        self.backend.set("bloom:1:meta", "64,3,old", ex=None)
+        self.backend.setbit_many([("bloom:1:old", 1)])
+
+        self.assertEqual(self.bloom.unassigned(self.db, [(1, "u1")]), set())
+        self.wait_for_build(self.bloom)
+        self.assertEqual(self.bloom.unassigned(self.db, [(1, "u1")]), {(1, "u1")})
+        self.assertTrue(self.backend.get("bloom:1:meta").startswith(f"{self.bloom.size_bits},{self.bloom.hashes},"))
+        # The old bitmap is left to expire
+        self.assertIn("bloom:1:old", self.backend._expires)
+
+    def test_reset_keeps_serving_the_live_filter(self):
+        with patch("services.bloom._assigned_user_ids", return_value=iter([["u1"]])):
+            self.bloom.rebuild(self.db, 1)
+        live = self.backend.get("bloom:1:meta")
+
+        during_build = []
+        def assigned_user_ids(db, experiment_id):
+            # Every worker still trusts the live filter while the new one is built
+            during_build.append(self.worker().unassigned(self.db, [(1, "u1"), (1, "u9")]))
+            self.bloom.add([(1, "u5")])
+            yield ["u1"]
+
+        with patch("services.bloom._assigned_user_ids", assigned_user_ids):
+            self.assertEqual(self.bloom.rebuild(self.db, 1, reset=True), 1)
+        self.assertEqual(during_build, [{(1, "u9")}])
+        self.assertNotEqual(self.backend.get("bloom:1:meta"), live)
+
+        # Assignments made during the build are in the new filter
+        self.assertEqual(self.worker().unassigned(self.db, [(1, "u1"), (1, "u5"), (1, "u9")]), {(1, "u9")})
+
+    @patch("services.bloom._assigned_user_ids", return_value=iter([]))
+    def test_stale_view_of_a_replaced_filter_answers_maybe(self, _):
+        self.bloom.rebuild(self.db, 1)
+        self.assertEqual(self.bloom.unassigned(self.db, [(1, "u1")]), {(1, "u1")})
+        other_worker = self.worker()
+        other_worker.rebuild(self.db, 1, reset=True)
+        other_worker.add([(1, "u1")])
+
+        # Still reading the replaced bitmap: the new meta is noticed in the same round-trip
+        self.assertEqual(self.bloom.unassigned(self.db, [(1, "u1")]), set())
+        self.assertEqual(self.bloom.unassigned(self.db, [(1, "u1"), (1, "u2")]), {(1, "u2")})
+
+    @patch("services.bloom._assigned_user_ids", return_value=iter([]))
+    def test_evicted_filter_reads_the_database_and_is_rebuilt(self, _):
+        self.bloom.rebuild(self.db, 1)
+        bitmap = self.bloom._bitmap_key(1, self.backend.get("bloom:1:meta"))
+        self.backend.delete(bitmap)
+
+        self.assertEqual(self.bloom.unassigned(self.db, [(1, "u1")]), set())
+        self.assertIsNone(self.backend.get("bloom:1:meta"))
+        self.assertEqual(self.bloom.unassigned(self.db, [(1, "u1")]), set())
+        self.wait_for_build(self.bloom)
+        self.assertEqual(self.bloom.unassigned(self.db, [(1, "u1")]), {(1, "u1")})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,21 @@
+import asyncio
 import json
 import logging
+import math
 import os
+import random
+import threading
+import time
+import timing
+from collections import OrderedDict
 from typing import List, Any
-# Import the actual ORM classes for reconstruction. In a real app, 
-# you would decide whether to cache ORM objects or Pydantic schemas here.
+# Cached values are compact value objects (services.cache_values), not ORM instances,
+# callers only read their fields. The ORM classes are accepted when caching.
 from data.database import Variant, Experiment, Assignment
+from services.cache_values import (
+    CachedAssignment, CachedExperiment, decode_assignment, decode_experiment, encode_assignment, encode_experiment,
+    assignment_bucket_key, pack_assignment, unpack_assignment, variant_names_of
+)
 from config import config
 
 logger = logging.getLogger(__name__)
@@ -12,6 +23,154 @@ logger = logging.getLogger(__name__)
 # --- Configuration Constants ---
 EXPERIMENT_CACHE_TTL = 3600     # 1 hour for experiment details
 ASSIGNMENT_CACHE_TTL = 600      # 10 minute for user assignments
+EXPERIMENT_GENERATION_KEY = "exp:generation"  # bumped on every experiment invalidation
+RESULTS_REFRESH_LOCK_TTL = 60   # a crashed refresh frees the results key after 1 minute
+EXPERIMENT_LOAD_LOCK_TTL = 5    # a crashed experiment load frees its lock after 5 seconds
+EXPERIMENT_LOCK_POLL_INTERVAL = 0.02          # seconds between cache reads while another worker loads
+EXPERIMENT_LOAD_SECONDS_DEFAULT = 0.05        # load time estimate for early refresh until one is measured
+L1_GENERATION_CHECK_INTERVAL = 1.0            # seconds between generation checks, bounds L1 staleness
+
+# DEL of a lock only while it still holds the caller's token: a holder that outlived the
+# lock's TTL must not release the lock another worker took since
+DELETE_IF_EQUAL_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Supported values for config.assignment_cache_layout
+ASSIGNMENT_LAYOUT_KEY = "key"
+ASSIGNMENT_LAYOUT_HASH = "hash"
+
+# --- In-process (L1) Cache ---
+
+class _LocalTTLCache:
+    """Bounded, thread safe LRU cache with a TTL per entry, kept in process memory."""
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+# --- In-process single-flight ---
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class _SingleFlight:
+    """
+    Coalesces concurrent calls per key: the first caller runs the function, callers
+    arriving while it runs wait for it and get the same result (or exception).
+    """
+    def __init__(self):
+        self._flights: dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn) -> tuple[Any, bool]:
+        """Returns (result, shared), shared is True when the result came from another caller."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = fn()
+            return flight.result, False
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._flights
+
+class _AsyncSingleFlight:
+    """asyncio version of _SingleFlight, for coroutines running on one event loop."""
+    def __init__(self):
+        self._flights: dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, fn) -> tuple[Any, bool]:
+        flight = self._flights.get(key)
+        if flight is not None:
+            # shield: a cancelled follower must not cancel the leader's load
+            return await asyncio.shield(flight), True
+
+        flight = self._flights[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+            flight.set_result(result)
+            return result, False
+        except BaseException as e:
+            flight.set_exception(e)
+            # Mark retrieved, nobody may be waiting on it
+            flight.exception()
+            raise
+        finally:
+            del self._flights[key]
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._flights
+
+def _lock_token() -> str:
+    """Unique value of a lock key, identifies its holder on release."""
+    return os.urandom(16).hex()
+
+def _refresh_early(ttl: float | None, load_seconds: float) -> bool:
+    """
+    Probabilistic early expiration (XFetch): refresh before the key expires with a probability
+    rising as the remaining TTL approaches the time a reload takes, scaled by
+    config.experiment_early_refresh_beta (0 disables it).
+    """
+    beta = config.experiment_early_refresh_beta
+    if ttl is None or beta <= 0:
+        return False
+    return load_seconds * beta * -math.log(1.0 - random.random()) >= ttl
 
 # --- Valkey/Redis Backend Implementations ---
 
@@ -19,15 +178,102 @@ class _MockValkeyBackend:
     """Simulates the low-level Valkey/Redis client (in-memory)."""
     def __init__(self):
         self._cache = {}
+        self._expires = {}
     
     def get(self, key: str) -> str | None:
         logger.debug("cache mock get: %s", key)
         return self._cache.get(key)
+
+    def get_with_ttl(self, key: str) -> tuple[str | None, float | None]:
+        """Value and remaining TTL in seconds (None without expiry). Expiry is tracked, not enforced."""
+        value = self._cache.get(key)
+        expires_at = self._expires.get(key)
+        if value is None or expires_at is None:
+            return value, None
+        return value, max(expires_at - time.monotonic(), 0.0)
+
+    def get_many(self, keys: List[str]) -> List[str | None]:
+        logger.debug("cache mock get_many: %d keys", len(keys))
+        return [self._cache.get(key) for key in keys]
         
-    def set(self, key: str, value: str, ex: int):
+    def set(self, key: str, value: str, ex: int, nx: bool = False) -> bool:
         # In a real setup, 'ex' handles expiration. Here, we just store.
         logger.debug("cache mock set: %s, value: %s", key, value)
+        if nx and key in self._cache:
+            return False
         self._cache[key] = value
+        if ex:
+            self._expires[key] = time.monotonic() + ex
+        else:
+            self._expires.pop(key, None)
+        return True
+
+    def delete(self, key: str):
+        logger.debug("cache mock delete: %s", key)
+        self._cache.pop(key, None)
+        self._expires.pop(key, None)
+
+    def delete_if_equal(self, key: str, value: str) -> bool:
+        if self._cache.get(key) != value:
+            return False
+        self.delete(key)
+        return True
+
+    def incr(self, key: str) -> int | None:
+        value = int(self._cache.get(key) or 0) + 1
+        self._cache[key] = str(value)
+        return value
+
+    def set_many(self, items: List[tuple[str, str]], ex: int) -> bool:
+        logger.debug("cache mock set_many: %d keys", len(items))
+        self._cache.update(items)
+        expires_at = time.monotonic() + ex
+        self._expires.update((key, expires_at) for key, _ in items)
+        return True
+
+    def hset_many(self, items: List[tuple[str, str, str]], ex: int) -> bool:
+        for key, field, value in items:
+            self._cache.setdefault(key, {})[field] = value
+            self._expires.setdefault(key, time.monotonic() + ex)
+        return True
+
+    def set_many_nx(self, items: List[tuple[str, str]], ex: int) -> List[bool]:
+        return [self.set(key, value, ex=ex, nx=True) for key, value in items]
+
+    def hset_many_nx(self, items: List[tuple[str, str, str]], ex: int) -> List[bool]:
+        return [self.hset(key, field, value, ex=ex, nx=True) for key, field, value in items]
+
+    def hmget_many(self, requests: List[tuple[str, List[str]]]) -> List[List[str | None]]:
+        logger.debug("cache mock hmget_many: %d keys", len(requests))
+        return [[self._cache.get(key, {}).get(field) for field in fields] for key, fields in requests]
+
+    def getbit_many(self, items: List[tuple[str, int]]) -> List[int]:
+        return [int(offset in self._cache.get(key, ())) for key, offset in items]
+
+    def getbit_many_then_get(self, items: List[tuple[str, int]], key: str) -> tuple[List[int], str | None]:
+        return self.getbit_many(items), self._cache.get(key)
+
+    def setbit_many(self, items: List[tuple[str, int]]) -> bool:
+        for key, offset in items:
+            self._cache.setdefault(key, set()).add(offset)
+        return True
+
+    def expire(self, key: str, ex: int | None):
+        if key not in self._cache:
+            return
+        if ex:
+            self._expires[key] = time.monotonic() + ex
+        else:
+            self._expires.pop(key, None)
+
+    def hset(self, key: str, field: str, value: str, ex: int, nx: bool = False) -> bool:
+        bucket = self._cache.setdefault(key, {})
+        # EXPIRE NX: the TTL of a hash is set when it is created
+        self._expires.setdefault(key, time.monotonic() + ex)
+        if nx and field in bucket:
+            return False
+        bucket[field] = value
+        return True
 
 class RealValkeyBackend:
     """Real implementation using redis-py client (compatible with Valkey)."""
@@ -51,6 +297,7 @@ class RealValkeyBackend:
         except Exception as e:
             logger.error("Failed to connect to Valkey/Redis: %s", e)
             raise
+        self._delete_if_equal_script = self.client.register_script(DELETE_IF_EQUAL_SCRIPT)
 
     def get(self, key: str) -> str | None:
         try:
@@ -60,40 +307,606 @@ class RealValkeyBackend:
             logger.error("Valkey GET error for key %s: %s", key, e)
             return None
 
-    def set(self, key: str, value: str, ex: int):
+    def get_with_ttl(self, key: str) -> tuple[str | None, float | None]:
+        """GET and PTTL in one round-trip, the TTL is in seconds (None without expiry). Errors are misses."""
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            pipeline.get(key)
+            pipeline.pttl(key)
+            value, pttl = pipeline.execute()
+            return value, (pttl / 1000 if pttl is not None and pttl >= 0 else None)
+        except Exception as e:
+            logger.error("Valkey GET error for key %s: %s", key, e)
+            return None, None
+
+    def get_many(self, keys: List[str]) -> List[str | None]:
+        """MGET: one round-trip for all keys, errors are treated as misses."""
+        if not keys:
+            return []
+        try:
+            logger.debug("cache valkey mget: %d keys", len(keys))
+            return self.client.mget(keys)
+        except Exception as e:
+            logger.error("Valkey MGET error for %d keys: %s", len(keys), e)
+            return [None] * len(keys)
+
+    def set(self, key: str, value: str, ex: int, nx: bool = False) -> bool | None:
+        """Returns whether the value was stored (False when nx and the key exists), None on error."""
         try:
             logger.debug("cache valkey set: %s, value: %s", key, value)
-            self.client.set(key, value, ex=ex)
+            return bool(self.client.set(key, value, ex=ex, nx=nx))
         except Exception as e:
             logger.error("Valkey SET error for key %s: %s", key, e)
+            return None
+
+    def delete(self, key: str):
+        try:
+            logger.debug("cache valkey delete: %s", key)
+            self.client.delete(key)
+        except Exception as e:
+            logger.error("Valkey DEL error for key %s: %s", key, e)
+
+    def delete_if_equal(self, key: str, value: str) -> bool | None:
+        """DEL only while the key holds value (compare-and-delete of a lock), None on error."""
+        try:
+            return bool(self._delete_if_equal_script(keys=[key], args=[value]))
+        except Exception as e:
+            logger.error("Valkey DEL error for key %s: %s", key, e)
+            return None
+
+    def incr(self, key: str) -> int | None:
+        try:
+            return self.client.incr(key)
+        except Exception as e:
+            logger.error("Valkey INCR error for key %s: %s", key, e)
+            return None
+
+    def set_many(self, items: List[tuple[str, str]], ex: int) -> bool | None:
+        """SET with expiry of every (key, value), in a single pipeline round-trip. None on error."""
+        if not items:
+            return True
+        try:
+            logger.debug("cache valkey set_many: %d keys", len(items))
+            pipeline = self.client.pipeline(transaction=False)
+            for key, value in items:
+                pipeline.set(key, value, ex=ex)
+            pipeline.execute()
+            return True
+        except Exception as e:
+            logger.error("Valkey SET error for %d keys: %s", len(items), e)
+            return None
+
+    def hset_many(self, items: List[tuple[str, str, str]], ex: int) -> bool | None:
+        """HSET of every (key, field, value) and one EXPIRE NX per hash, in a single pipeline round-trip."""
+        if not items:
+            return True
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for key, field, value in items:
+                pipeline.hset(key, field, value)
+            for key in {key for key, _, _ in items}:
+                pipeline.expire(key, ex, nx=True)
+            pipeline.execute()
+            return True
+        except Exception as e:
+            logger.error("Valkey HSET error for %d fields: %s", len(items), e)
+            return None
+
+    def set_many_nx(self, items: List[tuple[str, str]], ex: int) -> List[bool] | None:
+        """SET NX with expiry of every (key, value) in a single pipeline round-trip, whether each was stored. None on error."""
+        if not items:
+            return []
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for key, value in items:
+                pipeline.set(key, value, ex=ex, nx=True)
+            return [bool(stored) for stored in pipeline.execute()]
+        except Exception as e:
+            logger.error("Valkey SET error for %d keys: %s", len(items), e)
+            return None
+
+    def hset_many_nx(self, items: List[tuple[str, str, str]], ex: int) -> List[bool] | None:
+        """HSETNX of every (key, field, value) and one EXPIRE NX per hash in a single pipeline round-trip, whether each was stored. None on error."""
+        if not items:
+            return []
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for key, field, value in items:
+                pipeline.hsetnx(key, field, value)
+            for key in {key for key, _, _ in items}:
+                pipeline.expire(key, ex, nx=True)
+            return [bool(stored) for stored in pipeline.execute()[:len(items)]]
+        except Exception as e:
+            logger.error("Valkey HSET error for %d fields: %s", len(items), e)
+            return None
+
+    def hmget_many(self, requests: List[tuple[str, List[str]]]) -> List[List[str | None]]:
+        """One HMGET per hash, all sent in a single pipeline round-trip. Errors are misses."""
+        if not requests:
+            return []
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for key, fields in requests:
+                pipeline.hmget(key, fields)
+            return pipeline.execute()
+        except Exception as e:
+            logger.error("Valkey HMGET error for %d keys: %s", len(requests), e)
+            return [[None] * len(fields) for _, fields in requests]
+
+    def getbit_many(self, items: List[tuple[str, int]]) -> List[int] | None:
+        """GETBIT of every (key, offset) in a single pipeline round-trip, None on error."""
+        if not items:
+            return []
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for key, offset in items:
+                pipeline.getbit(key, offset)
+            return pipeline.execute()
+        except Exception as e:
+            logger.error("Valkey GETBIT error for %d bits: %s", len(items), e)
+            return None
+
+    def getbit_many_then_get(self, items: List[tuple[str, int]], key: str) -> tuple[List[int], str | None] | None:
+        """GETBIT of every (key, offset) followed by a GET of key, in a single pipeline round-trip. None on error."""
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for bitmap, offset in items:
+                pipeline.getbit(bitmap, offset)
+            pipeline.get(key)
+            *bits, value = pipeline.execute()
+            return bits, value
+        except Exception as e:
+            logger.error("Valkey GETBIT error for %d bits: %s", len(items), e)
+            return None
+
+    def expire(self, key: str, ex: int | None):
+        """EXPIRE, or PERSIST when ex is None."""
+        try:
+            if ex:
+                self.client.expire(key, ex)
+            else:
+                self.client.persist(key)
+        except Exception as e:
+            logger.error("Valkey EXPIRE error for key %s: %s", key, e)
+
+    def setbit_many(self, items: List[tuple[str, int]]) -> bool | None:
+        """SETBIT to 1 of every (key, offset) in a single pipeline round-trip, None on error."""
+        if not items:
+            return True
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for key, offset in items:
+                pipeline.setbit(key, offset, 1)
+            pipeline.execute()
+            return True
+        except Exception as e:
+            logger.error("Valkey SETBIT error for %d bits: %s", len(items), e)
+            return None
+
+    def hset(self, key: str, field: str, value: str, ex: int, nx: bool = False) -> bool | None:
+        """
+        HSET (HSETNX when nx), None on error. The TTL is only set on a new hash (EXPIRE NX): refreshed
+        by every write, the hash of a busy bucket would never expire and keep every user ever written.
+        """
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            if nx:
+                pipeline.hsetnx(key, field, value)
+            else:
+                pipeline.hset(key, field, value)
+            pipeline.expire(key, ex, nx=True)
+            stored, _ = pipeline.execute()
+            return bool(stored) if nx else True
+        except Exception as e:
+            logger.error("Valkey HSET error for key %s: %s", key, e)
+            return None
+
+
+
+# --- Async Backend Implementations (config.async_mode) ---
+
+class _AsyncMockValkeyBackend:
+    """Async facade of the in-memory mock backend."""
+    def __init__(self, backend: _MockValkeyBackend | None = None):
+        self._backend = backend or _MockValkeyBackend()
+
+    async def get(self, key: str) -> str | None:
+        return self._backend.get(key)
+
+    async def get_with_ttl(self, key: str) -> tuple[str | None, float | None]:
+        return self._backend.get_with_ttl(key)
+
+    async def get_many(self, keys: List[str]) -> List[str | None]:
+        return self._backend.get_many(keys)
+
+    async def set(self, key: str, value: str, ex: int, nx: bool = False) -> bool:
+        return self._backend.set(key, value, ex=ex, nx=nx)
+
+    async def delete(self, key: str):
+        self._backend.delete(key)
+
+    async def delete_if_equal(self, key: str, value: str) -> bool:
+        return self._backend.delete_if_equal(key, value)
+
+    async def incr(self, key: str) -> int | None:
+        return self._backend.incr(key)
+
+    async def set_many(self, items: List[tuple[str, str]], ex: int) -> bool:
+        return self._backend.set_many(items, ex=ex)
+
+    async def hset_many(self, items: List[tuple[str, str, str]], ex: int) -> bool:
+        return self._backend.hset_many(items, ex=ex)
+
+    async def set_many_nx(self, items: List[tuple[str, str]], ex: int) -> List[bool]:
+        return self._backend.set_many_nx(items, ex=ex)
+
+    async def hset_many_nx(self, items: List[tuple[str, str, str]], ex: int) -> List[bool]:
+        return self._backend.hset_many_nx(items, ex=ex)
+
+    async def hmget_many(self, requests: List[tuple[str, List[str]]]) -> List[List[str | None]]:
+        return self._backend.hmget_many(requests)
+
+    async def hset(self, key: str, field: str, value: str, ex: int, nx: bool = False) -> bool:
+        return self._backend.hset(key, field, value, ex=ex, nx=nx)
+
+class AsyncValkeyBackend:
+    """
+    redis.asyncio client over a bounded connection pool, commands wait on the event loop
+    instead of holding a thread. Same error handling as RealValkeyBackend: errors are misses.
+    """
+    def __init__(self, host: str, port: int, db: int = 0, password: str | None = None, max_connections: int = 100):
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError:
+            logger.error("Redis module not found. Install it with `pip install redis`.")
+            raise
+
+        self.pool = redis_asyncio.BlockingConnectionPool(
+            host=host,
+            port=port,
+            db=db,
+            password=password,
+            decode_responses=True,
+            socket_timeout=2.0,
+            max_connections=max_connections,
+            timeout=2.0                 # wait for a free connection at most this long
+        )
+        self.client = redis_asyncio.Redis(connection_pool=self.pool)
+        self._delete_if_equal_script = self.client.register_script(DELETE_IF_EQUAL_SCRIPT)
+
+    async def get(self, key: str) -> str | None:
+        try:
+            return await self.client.get(key)
+        except Exception as e:
+            logger.error("Valkey GET error for key %s: %s", key, e)
+            return None
+
+    async def get_with_ttl(self, key: str) -> tuple[str | None, float | None]:
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            pipeline.get(key)
+            pipeline.pttl(key)
+            value, pttl = await pipeline.execute()
+            return value, (pttl / 1000 if pttl is not None and pttl >= 0 else None)
+        except Exception as e:
+            logger.error("Valkey GET error for key %s: %s", key, e)
+            return None, None
+
+    async def get_many(self, keys: List[str]) -> List[str | None]:
+        if not keys:
+            return []
+        try:
+            return await self.client.mget(keys)
+        except Exception as e:
+            logger.error("Valkey MGET error for %d keys: %s", len(keys), e)
+            return [None] * len(keys)
+
+    async def set(self, key: str, value: str, ex: int, nx: bool = False) -> bool | None:
+        try:
+            return bool(await self.client.set(key, value, ex=ex, nx=nx))
+        except Exception as e:
+            logger.error("Valkey SET error for key %s: %s", key, e)
+            return None
+
+    async def delete(self, key: str):
+        try:
+            await self.client.delete(key)
+        except Exception as e:
+            logger.error("Valkey DEL error for key %s: %s", key, e)
+
+    async def delete_if_equal(self, key: str, value: str) -> bool | None:
+        try:
+            return bool(await self._delete_if_equal_script(keys=[key], args=[value]))
+        except Exception as e:
+            logger.error("Valkey DEL error for key %s: %s", key, e)
+            return None
+
+    async def incr(self, key: str) -> int | None:
+        try:
+            return await self.client.incr(key)
+        except Exception as e:
+            logger.error("Valkey INCR error for key %s: %s", key, e)
+            return None
+
+    async def set_many(self, items: List[tuple[str, str]], ex: int) -> bool | None:
+        if not items:
+            return True
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for key, value in items:
+                pipeline.set(key, value, ex=ex)
+            await pipeline.execute()
+            return True
+        except Exception as e:
+            logger.error("Valkey SET error for %d keys: %s", len(items), e)
+            return None
+
+    async def hset_many(self, items: List[tuple[str, str, str]], ex: int) -> bool | None:
+        if not items:
+            return True
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for key, field, value in items:
+                pipeline.hset(key, field, value)
+            for key in {key for key, _, _ in items}:
+                pipeline.expire(key, ex, nx=True)
+            await pipeline.execute()
+            return True
+        except Exception as e:
+            logger.error("Valkey HSET error for %d fields: %s", len(items), e)
+            return None
+
+    async def set_many_nx(self, items: List[tuple[str, str]], ex: int) -> List[bool] | None:
+        if not items:
+            return []
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for key, value in items:
+                pipeline.set(key, value, ex=ex, nx=True)
+            return [bool(stored) for stored in await pipeline.execute()]
+        except Exception as e:
+            logger.error("Valkey SET error for %d keys: %s", len(items), e)
+            return None
+
+    async def hset_many_nx(self, items: List[tuple[str, str, str]], ex: int) -> List[bool] | None:
+        if not items:
+            return []
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for key, field, value in items:
+                pipeline.hsetnx(key, field, value)
+            for key in {key for key, _, _ in items}:
+                pipeline.expire(key, ex, nx=True)
+            return [bool(stored) for stored in (await pipeline.execute())[:len(items)]]
+        except Exception as e:
+            logger.error("Valkey HSET error for %d fields: %s", len(items), e)
+            return None
 
+    async def hmget_many(self, requests: List[tuple[str, List[str]]]) -> List[List[str | None]]:
+        if not requests:
+            return []
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for key, fields in requests:
+                pipeline.hmget(key, fields)
+            return await pipeline.execute()
+        except Exception as e:
+            logger.error("Valkey HMGET error for %d keys: %s", len(requests), e)
+            return [[None] * len(fields) for _, fields in requests]
 
+    async def hset(self, key: str, field: str, value: str, ex: int, nx: bool = False) -> bool | None:
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            if nx:
+                pipeline.hsetnx(key, field, value)
+            else:
+                pipeline.hset(key, field, value)
+            pipeline.expire(key, ex, nx=True)
+            stored, _ = await pipeline.execute()
+            return bool(stored) if nx else True
+        except Exception as e:
+            logger.error("Valkey HSET error for key %s: %s", key, e)
+            return None
+
+    async def close(self):
+        await self.client.aclose()
+        await self.pool.disconnect()
 
 # --- Dedicated Cache Client Class ---
 
-class CacheClient:
-    """High-level client for managing application cache operations."""
+def _experiment_key(experiment_id: int) -> str:
+    return f"exp:{experiment_id}"
+
+def _assignment_key(experiment_id: int, user_id: str) -> str:
+    return f"asn:{experiment_id}:{user_id}"
+
+def _unassigned_key(experiment_id: int, user_id: str) -> str:
+    return f"asn0:{experiment_id}:{user_id}"
 
-    def __init__(self, backend):
+def _bucket_requests(pairs, variant_names: dict, buckets: int) -> List[tuple[str, List[str]]]:
+    """Group (experiment_id, user_id) pairs by hash bucket, one HMGET each. Uncached experiments are skipped."""
+    fields_by_key: dict[str, List[str]] = {}
+    for experiment_id, user_id in pairs:
+        if variant_names.get(experiment_id):
+            fields_by_key.setdefault(assignment_bucket_key(experiment_id, user_id, buckets), []).append(user_id)
+    return list(fields_by_key.items())
+
+def _unpack_buckets(requests, replies, variant_names: dict) -> dict[tuple[int, str], CachedAssignment]:
+    found = {}
+    for (key, user_ids), values in zip(requests, replies):
+        experiment_id = int(key.split(":")[1])
+        for user_id, value in zip(user_ids, values):
+            if value:
+                assignment = unpack_assignment(value, experiment_id, user_id, variant_names[experiment_id])
+                if assignment is not None:
+                    found[(experiment_id, user_id)] = assignment
+    return found
+
+def _decode_assignments(pairs, json_strs) -> dict[tuple[int, str], CachedAssignment]:
+    found = {}
+    for pair, json_str in zip(pairs, json_strs):
+        if json_str:
+            assignment = decode_assignment(json_str)
+            if assignment is not None:
+                found[pair] = assignment
+    return found
+
+
+class _CacheClientBase:
+    """
+    Keys, encoding, the experiment L1 and the decisions shared by CacheClient and
+    AsyncCacheClient, which only differ in how they call the backend.
+    """
+    _flights_class = _SingleFlight
+
+    def __init__(self, backend, l1_max_size: int | None = None, l1_ttl: float | None = None, assignment_layout: str | None = None):
         self.backend = backend
+        self._experiment_l1 = _LocalTTLCache(
+            max_size=config.experiment_l1_max_size if l1_max_size is None else l1_max_size,
+            ttl=config.experiment_l1_ttl if l1_ttl is None else l1_ttl
+        )
+        self._l1_generation = None
+        self._l1_generation_checked_at = float("-inf")
+        self.assignment_layout = assignment_layout or config.assignment_cache_layout
+        self.assignment_buckets = config.assignment_cache_buckets
+        self._experiment_flights = self._flights_class()
+        self._experiment_load_seconds = EXPERIMENT_LOAD_SECONDS_DEFAULT
+
+    # --- Experiment L1 ---
+
+    def _generation_check_due(self) -> bool:
+        """Whether the generation counter is to be read, at most once per L1_GENERATION_CHECK_INTERVAL."""
+        now = time.monotonic()
+        if now - self._l1_generation_checked_at < L1_GENERATION_CHECK_INTERVAL:
+            return False
+        self._l1_generation_checked_at = now
+        return True
+
+    def _apply_generation(self, generation: str | None):
+        """Clear the L1 when another worker invalidated an experiment."""
+        if generation != self._l1_generation:
+            if self._l1_generation is not None:
+                logger.debug("experiment generation changed %s -> %s, clearing L1", self._l1_generation, generation)
+            self._experiment_l1.clear()
+            self._l1_generation = generation
+
+    def _invalidated(self, key: str, generation: int | None):
+        """Drop the L1 entry of an invalidated experiment, generation is the new counter value."""
+        self._experiment_l1.delete(key)
+        self._l1_generation = str(generation) if generation is not None else None
+
+    def _decode_experiment(self, key: str, json_str: str | None) -> CachedExperiment | None:
+        """Decode a cached experiment and keep it in the L1."""
+        experiment = decode_experiment(json_str) if json_str else None
+        if experiment is not None:
+            self._experiment_l1.set(key, experiment)
+        return experiment
+
+    def _l1_experiments(self, experiment_ids: List[int]) -> tuple[dict[int, CachedExperiment], List[int]]:
+        """Experiments found in the L1, and the ids to read from the backend."""
+        found = {}
+        missing = []
+        for experiment_id in dict.fromkeys(experiment_ids):
+            experiment = self._experiment_l1.get(_experiment_key(experiment_id))
+            if experiment is not None:
+                found[experiment_id] = experiment
+            else:
+                missing.append(experiment_id)
+        return found, missing
+
+    # --- Experiment Loads ---
+
+    def _should_refresh_early(self, key: str, ttl: float | None) -> bool:
+        """Early refresh of a cached experiment about to expire, unless this process already reloads it."""
+        return _refresh_early(ttl, self._experiment_load_seconds) and not self._experiment_flights.in_flight(key)
+
+    def _record_experiment_load(self, seconds: float):
+        # Moving average of the load time, the early refresh window scales with it
+        self._experiment_load_seconds = 0.8 * self._experiment_load_seconds + 0.2 * seconds
+
+    def _encode_loaded(self, key: str, experiment: Experiment) -> tuple[str, CachedExperiment]:
+        """JSON to cache of a loaded experiment and its decoded copy (put in the L1), safe to share across callers."""
+        json_str = encode_experiment(experiment)
+        cached = decode_experiment(json_str)
+        self._experiment_l1.set(key, cached)
+        return json_str, cached
+
+    # --- Assignments ---
+
+    def _bucket_item(self, assignment: Assignment, variant_names: tuple[str, ...] | None) -> tuple[str, str, str] | None:
+        """(hash, field, packed value) of an assignment, None when its experiment isn't cached."""
+        value = pack_assignment(assignment, variant_names) if variant_names else None
+        if value is None:
+            return None
+        return assignment_bucket_key(assignment.experiment_id, assignment.user_id, self.assignment_buckets), assignment.user_id, value
+
+    def _bucket_items(self, assignments: List[Assignment], variant_names: dict) -> tuple[List[tuple[str, str, str]], List[int]]:
+        """Hash items of the assignments that can be packed, and their positions in assignments."""
+        items, positions = [], []
+        for position, assignment in enumerate(assignments):
+            item = self._bucket_item(assignment, variant_names.get(assignment.experiment_id))
+            if item is not None:
+                items.append(item)
+                positions.append(position)
+        return items, positions
+
+    def _key_items(self, assignments: List[Assignment]) -> List[tuple[str, str]]:
+        """(key, JSON) of assignments in the key layout."""
+        return [(_assignment_key(a.experiment_id, a.user_id), encode_assignment(a)) for a in assignments]
+
+    def _claimed(self, count: int, positions: List[int], stored: List[bool] | None) -> List[bool | None]:
+        """add_many_assignments result of count assignments, None where they couldn't be cached."""
+        claimed = [None] * count
+        for position, value in zip(positions, stored or ()):
+            claimed[position] = value
+        return claimed
+
+    # --- Negative Assignment Caching ---
+
+    def _unassigned_ttl(self) -> int:
+        """
+        Negative entries are never invalidated: they expire before ASSIGNMENT_CACHE_TTL,
+        and every new assignment is cached (checked first). 0 disables them.
+        """
+        return max(min(config.assignment_negative_cache_ttl, ASSIGNMENT_CACHE_TTL), 0)
+
+
+@timing.timed_methods("cache")
+class CacheClient(_CacheClientBase):
+    """
+    High-level client for managing application cache operations.
+    Experiments are kept in two tiers: a per-process L1 (decoded objects, no network)
+    in front of the shared backend. Workers drop their L1 when the experiment
+    generation counter in the backend changes, see invalidate_experiment.
+    """
+
+    def __init__(self, backend, l1_max_size: int | None = None, l1_ttl: float | None = None, assignment_layout: str | None = None):
+        super().__init__(backend, l1_max_size=l1_max_size, l1_ttl=l1_ttl, assignment_layout=assignment_layout)
         logger.debug("CacheClient backend: %s", self.backend)
 
     # --- Experiment Caching ---
 
-    def get_experiment(self, experiment_id: int) -> Experiment | None:
-        key = f"exp:{experiment_id}"
+    def _sync_l1_generation(self):
+        """Clear the L1 when another worker invalidated an experiment (checked at most once per interval)."""
+        if self._generation_check_due():
+            self._apply_generation(self.backend.get(EXPERIMENT_GENERATION_KEY))
+
+    def get_experiment(self, experiment_id: int) -> CachedExperiment | None:
+        key = _experiment_key(experiment_id)
+        self._sync_l1_generation()
+        experiment = self._experiment_l1.get(key)
+        if experiment is not None:
+            return experiment
+
         json_str = self.backend.get(key)
         if json_str:
             logger.debug("cache get experiment id: %d: key: %s, json_str: %s", experiment_id, key, json_str)
-            experiment = Experiment.from_json(json_str=json_str)
-            logger.debug("cache get experiment id: %d: experiment obj: %s", experiment_id, experiment.to_json())
-            return experiment
-        
-        return None
+        # The allocation is compiled once per cached experiment version, while decoding
+        return self._decode_experiment(key, json_str)
 
     def set_experiment(self, experiment: Experiment):
-        key = f"exp:{experiment.id}"
-        json_str = experiment.to_json(exclude_relationships_key=["assignments"])
+        key = _experiment_key(experiment.id)
+        json_str = encode_experiment(experiment)
         if json_str:
             logger.debug("cache set experiment id: %d: key: %s, json_str: %s", experiment.id, key, json_str)
             self.backend.set(key, json_str, ex=EXPERIMENT_CACHE_TTL)
@@ -101,26 +914,484 @@ class CacheClient:
 
         return None
 
+    def get_or_load_experiment(self, experiment_id: int, loader):
+        """
+        Cached experiment, or loader() (the database read) on a miss with stampede protection:
+        concurrent misses in this process share one load, with config.experiment_cache_lock
+        workers also coalesce on a Valkey lock, and shortly before the key expires a single
+        caller reloads it early while the others keep reading the current value.
+        The loader's own result (an ORM instance) is only returned to the caller that ran it.
+        """
+        key = _experiment_key(experiment_id)
+        self._sync_l1_generation()
+        experiment = self._experiment_l1.get(key)
+        if experiment is not None:
+            return experiment
+
+        json_str, ttl = self.backend.get_with_ttl(key)
+        experiment = decode_experiment(json_str) if json_str else None
+        if experiment is not None:
+            token = self._acquire_experiment_load(key) if self._should_refresh_early(key, ttl) else None
+            if token is not None:
+                logger.debug("experiment %d expires in %.3fs, refreshing early", experiment_id, ttl)
+                try:
+                    self._experiment_flights.do(key, lambda: self._load_experiment(key, loader, token=token))
+                except Exception as e:
+                    # The current value is still valid, a failed refresh is retried by a later caller
+                    logger.warning("early refresh of experiment %d failed: %s", experiment_id, e)
+            else:
+                self._experiment_l1.set(key, experiment)
+            return experiment
+
+        (loaded, cached), shared = self._experiment_flights.do(key, lambda: self._load_experiment(key, loader))
+        return cached if shared else loaded
+
+    def _load_experiment(self, key: str, loader, token: str | None = None):
+        """
+        Run the loader and cache its result, returns (loaded, cached copy safe to share across threads).
+        token: the load lock already held by the caller.
+        """
+        if token is None and config.experiment_cache_lock:
+            token = self._acquire_experiment_load(key)
+            if token is None:
+                experiment = self._wait_for_experiment(key)
+                if experiment is not None:
+                    return experiment, experiment
+                logger.debug("%s still not cached after waiting, loading it", key)
+
+        try:
+            started = time.monotonic()
+            experiment = loader()
+            self._record_experiment_load(time.monotonic() - started)
+            if experiment is None:
+                return None, None
+            json_str, cached = self._encode_loaded(key, experiment)
+            self.backend.set(key, json_str, ex=EXPERIMENT_CACHE_TTL)
+            return experiment, cached
+        finally:
+            if token is not None:
+                # A load outliving EXPERIMENT_LOAD_LOCK_TTL leaves the next holder's lock alone
+                self.backend.delete_if_equal(f"{key}:load", token)
+
+    def _acquire_experiment_load(self, key: str) -> str | None:
+        """
+        Cross-worker lock of an experiment load, returns the holder's token or None when another
+        worker holds it. An unavailable backend never blocks the load.
+        """
+        token = _lock_token()
+        return token if self.backend.set(f"{key}:load", token, ex=EXPERIMENT_LOAD_LOCK_TTL, nx=True) is not False else None
+
+    def _wait_for_experiment(self, key: str) -> CachedExperiment | None:
+        """Poll the backend while another worker loads the experiment, None when it takes too long."""
+        deadline = time.monotonic() + config.experiment_cache_lock_wait_ms / 1000
+        while time.monotonic() < deadline:
+            time.sleep(EXPERIMENT_LOCK_POLL_INTERVAL)
+            experiment = self._decode_experiment(key, self.backend.get(key))
+            if experiment is not None:
+                return experiment
+        return None
+
+    def get_many_experiments(self, experiment_ids: List[int]) -> dict[int, CachedExperiment]:
+        """Bulk lookup: L1 first, then one MGET for the rest. Only hits are returned."""
+        self._sync_l1_generation()
+        found, missing = self._l1_experiments(experiment_ids)
+        keys = [_experiment_key(experiment_id) for experiment_id in missing]
+        for experiment_id, key, json_str in zip(missing, keys, self.backend.get_many(keys)):
+            experiment = self._decode_experiment(key, json_str)
+            if experiment is not None:
+                found[experiment_id] = experiment
+
+        logger.debug("cache get_many_experiments: %d/%d hits", len(found), len(experiment_ids))
+        return found
+
+    def set_many_experiments(self, experiments: List[Experiment]):
+        """Cache many experiments in one pipelined round-trip."""
+        self.backend.set_many(
+            [(_experiment_key(experiment.id), encode_experiment(experiment)) for experiment in experiments],
+            ex=EXPERIMENT_CACHE_TTL
+        )
+
+    def invalidate_experiment(self, experiment_id: int):
+        """Drop an experiment from every tier, must be called whenever an experiment changes."""
+        key = _experiment_key(experiment_id)
+        self.backend.delete(key)
+        # Other workers see the new generation within L1_GENERATION_CHECK_INTERVAL
+        self._invalidated(key, self.backend.incr(EXPERIMENT_GENERATION_KEY))
+        logger.debug("Experiment %d invalidated, generation: %s", experiment_id, self._l1_generation)
+
     # --- Assignment Caching ---
 
-    def get_assignment(self, experiment_id: int, user_id: str) -> Assignment | None:
-        key = f"asn:{experiment_id}:{user_id}"
-        json_str = self.backend.get(key)
+    def get_assignment(self, experiment_id: int, user_id: str) -> CachedAssignment | None:
+        if self.assignment_layout == ASSIGNMENT_LAYOUT_HASH:
+            return self.get_many_assignments([(experiment_id, user_id)]).get((experiment_id, user_id))
+
+        json_str = self.backend.get(_assignment_key(experiment_id, user_id))
         if json_str:
-            return Assignment.from_json(json_str=json_str)
-        
+            return decode_assignment(json_str)
+
         return None
 
+    def get_many_assignments(self, pairs: List[tuple[int, str]]) -> dict[tuple[int, str], CachedAssignment]:
+        """Bulk lookup of (experiment_id, user_id) pairs, only hits are returned."""
+        if self.assignment_layout == ASSIGNMENT_LAYOUT_HASH:
+            variant_names = self._many_variant_names({experiment_id for experiment_id, _ in pairs})
+            requests = _bucket_requests(pairs, variant_names, self.assignment_buckets)
+            found = _unpack_buckets(requests, self.backend.hmget_many(requests), variant_names)
+            logger.debug("cache get_many_assignments (hash): %d/%d hits", len(found), len(pairs))
+            return found
+
+        keys = [_assignment_key(experiment_id, user_id) for experiment_id, user_id in pairs]
+        found = _decode_assignments(pairs, self.backend.get_many(keys))
+        logger.debug("cache get_many_assignments: %d/%d hits", len(found), len(pairs))
+        return found
+
     def set_assignment(self, assignment: Assignment):
-        key = f"asn:{assignment.experiment_id}:{assignment.user_id}"
-        json_str = assignment.to_json()
+        if self.assignment_layout == ASSIGNMENT_LAYOUT_HASH:
+            self._hset_assignment(assignment)
+            return None
+
+        key = _assignment_key(assignment.experiment_id, assignment.user_id)
+        # The experiment is cached on its own, don't lazy load it into every assignment
+        json_str = encode_assignment(assignment)
         if json_str:
             self.backend.set(key, json_str, ex=ASSIGNMENT_CACHE_TTL)
-            logger.debug("Assignment for user %s (EID %d) cached.", 
+            logger.debug("Assignment for user %s (EID %d) cached.",
                          assignment.user_id, assignment.experiment_id)
-            
+
         return None
 
+    def add_assignment(self, assignment: Assignment) -> bool | None:
+        """
+        Atomically cache a new assignment unless one already exists (SET NX),
+        so concurrent workers agree on a single variant for the user.
+        Returns True if this assignment won, False if another one was already cached
+        and None when the backend is unavailable.
+        """
+        if self.assignment_layout == ASSIGNMENT_LAYOUT_HASH:
+            return self._hset_assignment(assignment, nx=True)
+
+        key = _assignment_key(assignment.experiment_id, assignment.user_id)
+        json_str = encode_assignment(assignment)
+        return self.backend.set(key, json_str, ex=ASSIGNMENT_CACHE_TTL, nx=True)
+
+    def add_many_assignments(self, assignments: List[Assignment]) -> List[bool | None]:
+        """Bulk add_assignment in one pipelined round-trip, the result of each assignment in order."""
+        if not assignments:
+            return []
+
+        if self.assignment_layout == ASSIGNMENT_LAYOUT_HASH:
+            items, positions = self._bucket_items(assignments, self._many_variant_names({a.experiment_id for a in assignments}))
+            # Assignments of uncached experiments can't be packed, like a cache outage
+            return self._claimed(len(assignments), positions, self.backend.hset_many_nx(items, ex=ASSIGNMENT_CACHE_TTL))
+
+        stored = self.backend.set_many_nx(self._key_items(assignments), ex=ASSIGNMENT_CACHE_TTL)
+        return self._claimed(len(assignments), range(len(assignments)), stored)
+
+    def prime_experiments(self, experiments: List[Experiment]):
+        """
+        Put experiments already loaded by the caller into the L1, in the hash layout the
+        packed assignments of an experiment can only be read and written while it is cached.
+        """
+        if self.assignment_layout != ASSIGNMENT_LAYOUT_HASH:
+            return
+        for experiment in experiments:
+            key = _experiment_key(experiment.id)
+            if self._experiment_l1.get(key) is None:
+                self._encode_loaded(key, experiment)
+
+    def _many_variant_names(self, experiment_ids) -> dict[int, tuple[str, ...]]:
+        return {
+            experiment_id: variant_names_of(experiment)
+            for experiment_id, experiment in self.get_many_experiments(list(experiment_ids)).items()
+        }
+
+    def _variant_names(self, experiment_id: int) -> tuple[str, ...] | None:
+        """Index space of the packed assignments of an experiment, None when it isn't cached."""
+        experiment = self.get_experiment(experiment_id)
+        return variant_names_of(experiment) if experiment is not None else None
+
+    def _hset_assignment(self, assignment: Assignment, nx: bool = False) -> bool | None:
+        item = self._bucket_item(assignment, self._variant_names(assignment.experiment_id))
+        if item is None:
+            # Without the cached experiment the variant can't be packed, treat as a cache outage
+            logger.debug("Assignment for user %s (EID %d) not cached, experiment not cached.",
+                         assignment.user_id, assignment.experiment_id)
+            return None
+        return self.backend.hset(*item, ex=ASSIGNMENT_CACHE_TTL, nx=nx)
+
+    def set_many_assignments(self, assignments: List[Assignment]):
+        """Cache many assignments in one pipelined round-trip."""
+        if not assignments:
+            return None
+
+        if self.assignment_layout == ASSIGNMENT_LAYOUT_HASH:
+            items, _ = self._bucket_items(assignments, self._many_variant_names({a.experiment_id for a in assignments}))
+            self.backend.hset_many(items, ex=ASSIGNMENT_CACHE_TTL)
+            return None
+
+        self.backend.set_many(self._key_items(assignments), ex=ASSIGNMENT_CACHE_TTL)
+        return None
+
+    # --- Negative Assignment Caching ---
+
+    def get_many_unassigned(self, pairs: List[tuple[int, str]]) -> set[tuple[int, str]]:
+        """Pairs recently found without an assignment in the database."""
+        if not pairs or not self._unassigned_ttl():
+            return set()
+        keys = [_unassigned_key(experiment_id, user_id) for experiment_id, user_id in pairs]
+        return {pair for pair, value in zip(pairs, self.backend.get_many(keys)) if value}
+
+    def set_many_unassigned(self, pairs: List[tuple[int, str]]):
+        """Remember pairs the database has no assignment for, see _unassigned_ttl."""
+        ttl = self._unassigned_ttl()
+        if not pairs or not ttl:
+            return None
+        self.backend.set_many([(_unassigned_key(experiment_id, user_id), "1") for experiment_id, user_id in pairs], ex=ttl)
+        return None
+
+    # --- Results Caching ---
+
+    def get_results(self, key: str) -> dict | None:
+        """Cached results entry: {"etag", "computed_at" (epoch seconds), "body" (JSON string)}."""
+        json_str = self.backend.get(key)
+        if json_str:
+            return json.loads(json_str)
+
+        return None
+
+    def set_results(self, key: str, entry: dict, ex: int):
+        self.backend.set(key, json.dumps(entry), ex=ex)
+        logger.debug("Results %s cached, etag: %s", key, entry["etag"])
+
+    def acquire_results_refresh(self, key: str) -> str | None:
+        """
+        Single-flight lock of a results key, only the holder recomputes a stale entry.
+        Returns the holder's token for release_results_refresh, None when the lock is taken.
+        """
+        token = _lock_token()
+        return token if self.backend.set(f"{key}:refresh", token, ex=RESULTS_REFRESH_LOCK_TTL, nx=True) else None
+
+    def release_results_refresh(self, key: str, token: str):
+        # A refresh outliving RESULTS_REFRESH_LOCK_TTL leaves the next holder's lock alone
+        self.backend.delete_if_equal(f"{key}:refresh", token)
+
+@timing.timed_methods("cache")
+class AsyncCacheClient(_CacheClientBase):
+    """
+    Async version of CacheClient for the async request path, same keys and values
+    so both paths share the cache. Experiments get the same per-process L1.
+    """
+    _flights_class = _AsyncSingleFlight
+
+    # --- Experiment Caching ---
+
+    async def _sync_l1_generation(self):
+        if self._generation_check_due():
+            self._apply_generation(await self.backend.get(EXPERIMENT_GENERATION_KEY))
+
+    async def get_experiment(self, experiment_id: int) -> CachedExperiment | None:
+        key = _experiment_key(experiment_id)
+        await self._sync_l1_generation()
+        experiment = self._experiment_l1.get(key)
+        if experiment is not None:
+            return experiment
+
+        return self._decode_experiment(key, await self.backend.get(key))
+
+    async def get_many_experiments(self, experiment_ids: List[int]) -> dict[int, CachedExperiment]:
+        """See CacheClient.get_many_experiments."""
+        await self._sync_l1_generation()
+        found, missing = self._l1_experiments(experiment_ids)
+        keys = [_experiment_key(experiment_id) for experiment_id in missing]
+        for experiment_id, key, json_str in zip(missing, keys, await self.backend.get_many(keys)):
+            experiment = self._decode_experiment(key, json_str)
+            if experiment is not None:
+                found[experiment_id] = experiment
+        return found
+
+    async def get_or_load_experiment(self, experiment_id: int, loader):
+        """See CacheClient.get_or_load_experiment, loader is a coroutine function."""
+        key = _experiment_key(experiment_id)
+        await self._sync_l1_generation()
+        experiment = self._experiment_l1.get(key)
+        if experiment is not None:
+            return experiment
+
+        json_str, ttl = await self.backend.get_with_ttl(key)
+        experiment = decode_experiment(json_str) if json_str else None
+        if experiment is not None:
+            token = await self._acquire_experiment_load(key) if self._should_refresh_early(key, ttl) else None
+            if token is not None:
+                try:
+                    await self._experiment_flights.do(key, lambda: self._load_experiment(key, loader, token=token))
+                except Exception as e:
+                    logger.warning("early refresh of experiment %d failed: %s", experiment_id, e)
+            else:
+                self._experiment_l1.set(key, experiment)
+            return experiment
+
+        (loaded, cached), shared = await self._experiment_flights.do(key, lambda: self._load_experiment(key, loader))
+        return cached if shared else loaded
+
+    async def _load_experiment(self, key: str, loader, token: str | None = None):
+        if token is None and config.experiment_cache_lock:
+            token = await self._acquire_experiment_load(key)
+            if token is None:
+                experiment = await self._wait_for_experiment(key)
+                if experiment is not None:
+                    return experiment, experiment
+
+        try:
+            started = time.monotonic()
+            experiment = await loader()
+            self._record_experiment_load(time.monotonic() - started)
+            if experiment is None:
+                return None, None
+            json_str, cached = self._encode_loaded(key, experiment)
+            await self.backend.set(key, json_str, ex=EXPERIMENT_CACHE_TTL)
+            return experiment, cached
+        finally:
+            if token is not None:
+                await self.backend.delete_if_equal(f"{key}:load", token)
+
+    async def _acquire_experiment_load(self, key: str) -> str | None:
+        token = _lock_token()
+        return token if await self.backend.set(f"{key}:load", token, ex=EXPERIMENT_LOAD_LOCK_TTL, nx=True) is not False else None
+
+    async def _wait_for_experiment(self, key: str) -> CachedExperiment | None:
+        deadline = time.monotonic() + config.experiment_cache_lock_wait_ms / 1000
+        while time.monotonic() < deadline:
+            await asyncio.sleep(EXPERIMENT_LOCK_POLL_INTERVAL)
+            experiment = self._decode_experiment(key, await self.backend.get(key))
+            if experiment is not None:
+                return experiment
+        return None
+
+    async def set_experiment(self, experiment: Experiment):
+        json_str = encode_experiment(experiment)
+        if json_str:
+            await self.backend.set(_experiment_key(experiment.id), json_str, ex=EXPERIMENT_CACHE_TTL)
+
+    async def invalidate_experiment(self, experiment_id: int):
+        key = _experiment_key(experiment_id)
+        await self.backend.delete(key)
+        self._invalidated(key, await self.backend.incr(EXPERIMENT_GENERATION_KEY))
+
+    # --- Assignment Caching ---
+
+    async def get_assignment(self, experiment_id: int, user_id: str) -> CachedAssignment | None:
+        if self.assignment_layout == ASSIGNMENT_LAYOUT_HASH:
+            return (await self.get_many_assignments([(experiment_id, user_id)])).get((experiment_id, user_id))
+
+        json_str = await self.backend.get(_assignment_key(experiment_id, user_id))
+        if json_str:
+            return decode_assignment(json_str)
+
+        return None
+
+    async def get_many_assignments(self, pairs: List[tuple[int, str]]) -> dict[tuple[int, str], CachedAssignment]:
+        """See CacheClient.get_many_assignments."""
+        if self.assignment_layout == ASSIGNMENT_LAYOUT_HASH:
+            variant_names = await self._many_variant_names({experiment_id for experiment_id, _ in pairs})
+            requests = _bucket_requests(pairs, variant_names, self.assignment_buckets)
+            return _unpack_buckets(requests, await self.backend.hmget_many(requests), variant_names)
+
+        keys = [_assignment_key(experiment_id, user_id) for experiment_id, user_id in pairs]
+        return _decode_assignments(pairs, await self.backend.get_many(keys))
+
+    async def set_assignment(self, assignment: Assignment):
+        if self.assignment_layout == ASSIGNMENT_LAYOUT_HASH:
+            await self._hset_assignment(assignment)
+            return None
+
+        key = _assignment_key(assignment.experiment_id, assignment.user_id)
+        await self.backend.set(key, encode_assignment(assignment), ex=ASSIGNMENT_CACHE_TTL)
+
+    async def add_assignment(self, assignment: Assignment) -> bool | None:
+        """SET NX, see CacheClient.add_assignment."""
+        if self.assignment_layout == ASSIGNMENT_LAYOUT_HASH:
+            return await self._hset_assignment(assignment, nx=True)
+
+        key = _assignment_key(assignment.experiment_id, assignment.user_id)
+        return await self.backend.set(key, encode_assignment(assignment), ex=ASSIGNMENT_CACHE_TTL, nx=True)
+
+    async def add_many_assignments(self, assignments: List[Assignment]) -> List[bool | None]:
+        """See CacheClient.add_many_assignments."""
+        if not assignments:
+            return []
+
+        if self.assignment_layout == ASSIGNMENT_LAYOUT_HASH:
+            items, positions = self._bucket_items(assignments, await self._many_variant_names({a.experiment_id for a in assignments}))
+            return self._claimed(len(assignments), positions, await self.backend.hset_many_nx(items, ex=ASSIGNMENT_CACHE_TTL))
+
+        stored = await self.backend.set_many_nx(self._key_items(assignments), ex=ASSIGNMENT_CACHE_TTL)
+        return self._claimed(len(assignments), range(len(assignments)), stored)
+
+    async def set_many_assignments(self, assignments: List[Assignment]):
+        """See CacheClient.set_many_assignments."""
+        if not assignments:
+            return None
+
+        if self.assignment_layout == ASSIGNMENT_LAYOUT_HASH:
+            items, _ = self._bucket_items(assignments, await self._many_variant_names({a.experiment_id for a in assignments}))
+            await self.backend.hset_many(items, ex=ASSIGNMENT_CACHE_TTL)
+            return None
+
+        await self.backend.set_many(self._key_items(assignments), ex=ASSIGNMENT_CACHE_TTL)
+        return None
+
+    async def _many_variant_names(self, experiment_ids) -> dict[int, tuple[str, ...]]:
+        return {
+            experiment_id: variant_names_of(experiment)
+            for experiment_id, experiment in (await self.get_many_experiments(list(experiment_ids))).items()
+        }
+
+    async def _variant_names(self, experiment_id: int) -> tuple[str, ...] | None:
+        experiment = await self.get_experiment(experiment_id)
+        return variant_names_of(experiment) if experiment is not None else None
+
+    async def _hset_assignment(self, assignment: Assignment, nx: bool = False) -> bool | None:
+        item = self._bucket_item(assignment, await self._variant_names(assignment.experiment_id))
+        if item is None:
+            return None
+        return await self.backend.hset(*item, ex=ASSIGNMENT_CACHE_TTL, nx=nx)
+
+    # --- Negative Assignment Caching ---
+
+    async def get_many_unassigned(self, pairs: List[tuple[int, str]]) -> set[tuple[int, str]]:
+        """See CacheClient.get_many_unassigned."""
+        if not pairs or not self._unassigned_ttl():
+            return set()
+        keys = [_unassigned_key(experiment_id, user_id) for experiment_id, user_id in pairs]
+        return {pair for pair, value in zip(pairs, await self.backend.get_many(keys)) if value}
+
+    async def set_many_unassigned(self, pairs: List[tuple[int, str]]):
+        """See CacheClient.set_many_unassigned."""
+        ttl = self._unassigned_ttl()
+        if not pairs or not ttl:
+            return None
+        await self.backend.set_many([(_unassigned_key(experiment_id, user_id), "1") for experiment_id, user_id in pairs], ex=ttl)
+        return None
+
+    # --- Results Caching ---
+
+    async def get_results(self, key: str) -> dict | None:
+        json_str = await self.backend.get(key)
+        if json_str:
+            return json.loads(json_str)
+
+        return None
+
+    async def set_results(self, key: str, entry: dict, ex: int):
+        await self.backend.set(key, json.dumps(entry), ex=ex)
+
+    async def acquire_results_refresh(self, key: str) -> str | None:
+        token = _lock_token()
+        return token if await self.backend.set(f"{key}:refresh", token, ex=RESULTS_REFRESH_LOCK_TTL, nx=True) else None
+
+    async def release_results_refresh(self, key: str, token: str):
+        await self.backend.delete_if_equal(f"{key}:refresh", token)
+
 # --- Initialize Backend and Default Client ---
 valkey_host = config.valkey_host
 valkey_port = config.valkey_port
@@ -144,4 +1415,24 @@ def get_cache_client():
     return _DEFAULT_CACHE_CLIENT
 
 def get_mock_cache_client():
-    return CacheClient(backend=_MockValkeyBackend())
\ No newline at end of file
+    return CacheClient(backend=_MockValkeyBackend())
+
+# The async client is created on first use, only the async request path needs it
+_DEFAULT_ASYNC_CACHE_CLIENT = None
+
+def get_async_cache_client():
+    global _DEFAULT_ASYNC_CACHE_CLIENT
+    if _DEFAULT_ASYNC_CACHE_CLIENT is None:
+        if isinstance(VALKEY_BACKEND, _MockValkeyBackend):
+            # Share the mock's data with the sync client, like a real Valkey would
+            backend = _AsyncMockValkeyBackend(VALKEY_BACKEND)
+        else:
+            backend = AsyncValkeyBackend(host=valkey_host, port=valkey_port, max_connections=config.valkey_max_connections)
+        _DEFAULT_ASYNC_CACHE_CLIENT = AsyncCacheClient(backend=backend)
+    return _DEFAULT_ASYNC_CACHE_CLIENT
+
+async def close_async_cache_client():
+    global _DEFAULT_ASYNC_CACHE_CLIENT
+    if _DEFAULT_ASYNC_CACHE_CLIENT is not None and hasattr(_DEFAULT_ASYNC_CACHE_CLIENT.backend, "close"):
+        await _DEFAULT_ASYNC_CACHE_CLIENT.backend.close()
+    _DEFAULT_ASYNC_CACHE_CLIENT = None
@@ -0,0 +1,403 @@
+import asyncio
+import threading
+import time
+import unittest
+from datetime import datetime, timezone
+from unittest.mock import MagicMock, call, patch
+from data.database import Assignment, Experiment, Variant
+from services import cache as cache_module
+from services.cache import AsyncCacheClient, CacheClient, _AsyncMockValkeyBackend, _MockValkeyBackend, _LocalTTLCache
+
+
+def make_experiment(experiment_id=1, name="Button Color Test"):
+    experiment = Experiment(id=experiment_id, name=name, description=None, is_active=True)
+    experiment.variants = [
+        Variant(id=1, experiment_id=experiment_id, name="red_button", allocation_percent=50.0),
+        Variant(id=2, experiment_id=experiment_id, name="blue_button", allocation_percent=50.0),
+    ]
+    return experiment
+
+
+class TestLocalTTLCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        l1 = _LocalTTLCache(max_size=2, ttl=60)
+        l1.set("a", 1)
+        l1.set("b", 2)
+        l1.get("a")      # "b" is now the least recently used
+        l1.set("c", 3)
+
+        self.assertEqual(l1.get("a"), 1)
+        self.assertIsNone(l1.get("b"))
+        self.assertEqual(l1.get("c"), 3)
+
+    @patch("services.cache.time.monotonic")
+    def test_ttl_expiry(self, mock_monotonic):
+        mock_monotonic.return_value = 100.0
+        l1 = _LocalTTLCache(max_size=10, ttl=5)
+        l1.set("a", 1)
+
+        mock_monotonic.return_value = 104.0
+        self.assertEqual(l1.get("a"), 1)
+        mock_monotonic.return_value = 105.0
+        self.assertIsNone(l1.get("a"))
+
+
+class TestCacheClientExperimentL1(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = _MockValkeyBackend()
+
+    def test_l1_hit_skips_backend(self):
+        client = CacheClient(backend=self.backend)
+        client.set_experiment(make_experiment())
+        first = client.get_experiment(1)
+
+        self.backend.get = MagicMock(side_effect=AssertionError("backend should not be called"))
+        second = client.get_experiment(1)
+
+        self.assertIs(first, second)
+        self.assertEqual([v.name for v in second.variants], ["red_button", "blue_button"])
+
+    @patch.object(cache_module, "L1_GENERATION_CHECK_INTERVAL", 0)
+    def test_invalidation_reaches_other_workers(self):
+        worker_a = CacheClient(backend=self.backend)
+        worker_b = CacheClient(backend=self.backend)
+        worker_a.set_experiment(make_experiment(name="old name"))
+        self.assertEqual(worker_b.get_experiment(1).name, "old name")
+
+        # worker A changes the experiment and invalidates it
+        worker_a.invalidate_experiment(1)
+        worker_a.set_experiment(make_experiment(name="new name"))
+
+        self.assertEqual(worker_b.get_experiment(1).name, "new name")
+        self.assertEqual(worker_a.get_experiment(1).name, "new name")
+
+    def test_l1_disabled(self):
+        client = CacheClient(backend=self.backend, l1_max_size=0)
+        client.set_experiment(make_experiment())
+
+        self.assertIsNot(client.get_experiment(1), client.get_experiment(1))
+
+
+class TestExperimentStampedeProtection(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = _MockValkeyBackend()
+        self.client = CacheClient(backend=self.backend)
+        self.loads = 0
+
+    def slow_loader(self, delay=0.1):
+        def load():
+            self.loads += 1
+            time.sleep(delay)
+            return make_experiment()
+        return load
+
+    def test_concurrent_misses_share_one_load(self):
+        results = []
+        loader = self.slow_loader()
+        threads = [threading.Thread(target=lambda: results.append(self.client.get_or_load_experiment(1, loader))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.loads, 1)
+        self.assertEqual({experiment.name for experiment in results}, {"Button Color Test"})
+        self.assertIsNotNone(self.backend.get("exp:1"))
+
+    def test_missing_experiment_is_not_cached(self):
+        self.assertIsNone(self.client.get_or_load_experiment(1, lambda: None))
+        self.assertIsNone(self.backend.get("exp:1"))
+
+    @patch.object(cache_module.config, "experiment_cache_lock", True)
+    def test_lock_loser_waits_for_the_other_worker(self):
+        # Another worker holds the lock and caches the experiment shortly after
+        self.backend.set("exp:1:load", "1", ex=5, nx=True)
+        other_worker = CacheClient(backend=self.backend)
+        threading.Timer(0.05, other_worker.set_experiment, args=(make_experiment(),)).start()
+
+        experiment = self.client.get_or_load_experiment(1, self.slow_loader(0))
+
+        self.assertEqual(self.loads, 0)
+        self.assertEqual(experiment.name, "Button Color Test")
+
+    @patch.object(cache_module.config, "experiment_cache_lock", True)
+    @patch.object(cache_module.config, "experiment_cache_lock_wait_ms", 30)
+    def test_lock_loser_loads_after_waiting_too_long(self):
+        self.backend.set("exp:1:load", "1", ex=5, nx=True)
+
+        self.assertEqual(self.client.get_or_load_experiment(1, self.slow_loader(0)).name, "Button Color Test")
+        self.assertEqual(self.loads, 1)
+
+    @patch.object(cache_module.config, "experiment_cache_lock", True)
+    def test_lock_is_released_after_load(self):
+        self.client.get_or_load_experiment(1, self.slow_loader(0))
+        self.assertIsNone(self.backend.get("exp:1:load"))
+
+    @patch.object(cache_module.config, "experiment_cache_lock", True)
+    def test_expired_lock_of_another_worker_is_kept(self):
+        def load_outliving_the_lock():
+            # Our lock expired during the load and another worker took it
+            self.backend.delete("exp:1:load")
+            self.backend.set("exp:1:load", "other worker", ex=5, nx=True)
+            return make_experiment()
+
+        self.client.get_or_load_experiment(1, load_outliving_the_lock)
+        self.assertEqual(self.backend.get("exp:1:load"), "other worker")
+
+    @patch("services.cache._refresh_early", return_value=True)
+    def test_early_refresh_reloads_once(self, _):
+        self.client.set_experiment(make_experiment(name="old"))
+
+        experiment = self.client.get_or_load_experiment(1, lambda: make_experiment(name="new"))
+
+        self.assertEqual(experiment.name, "old")
+        self.assertEqual(self.client.get_experiment(1).name, "new")
+
+    @patch("services.cache._refresh_early", return_value=True)
+    def test_early_refresh_skipped_while_another_worker_refreshes(self, _):
+        self.client.set_experiment(make_experiment(name="old"))
+        self.backend.set("exp:1:load", "1", ex=5, nx=True)
+
+        self.assertEqual(self.client.get_or_load_experiment(1, self.slow_loader(0)).name, "old")
+        self.assertEqual(self.loads, 0)
+
+    @patch("services.cache._refresh_early", return_value=True)
+    def test_failed_early_refresh_returns_current_value(self, _):
+        self.client.set_experiment(make_experiment(name="old"))
+
+        def broken_loader():
+            raise ConnectionError("database is down")
+
+        self.assertEqual(self.client.get_or_load_experiment(1, broken_loader).name, "old")
+        self.assertIsNone(self.backend.get("exp:1:load"))
+
+    def test_refresh_probability_rises_near_expiry(self):
+        with patch.object(cache_module.config, "experiment_early_refresh_beta", 1.0):
+            self.assertFalse(any(cache_module._refresh_early(3600, 0.05) for _ in range(1000)))
+            self.assertGreater(sum(cache_module._refresh_early(0.01, 0.05) for _ in range(1000)), 500)
+            self.assertFalse(cache_module._refresh_early(None, 0.05))
+        with patch.object(cache_module.config, "experiment_early_refresh_beta", 0):
+            self.assertFalse(cache_module._refresh_early(0.0, 0.05))
+
+    def test_async_concurrent_misses_share_one_load(self):
+        client = AsyncCacheClient(backend=_AsyncMockValkeyBackend(self.backend))
+
+        async def load():
+            self.loads += 1
+            await asyncio.sleep(0.05)
+            return make_experiment()
+
+        async def run():
+            return await asyncio.gather(*(client.get_or_load_experiment(1, load) for _ in range(8)))
+
+        results = asyncio.run(run())
+        self.assertEqual(self.loads, 1)
+        self.assertEqual({experiment.name for experiment in results}, {"Button Color Test"})
+
+
+class TestAsyncCacheClient(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = _MockValkeyBackend()
+        self.sync_client = CacheClient(backend=self.backend)
+        self.async_client = AsyncCacheClient(backend=_AsyncMockValkeyBackend(self.backend))
+
+    def test_shares_values_with_sync_client(self):
+        self.sync_client.set_experiment(make_experiment(name="shared"))
+
+        experiment = asyncio.run(self.async_client.get_experiment(1))
+
+        self.assertEqual(experiment.name, "shared")
+        self.assertEqual([v.name for v in experiment.variants], ["red_button", "blue_button"])
+
+    def test_add_assignment_is_set_nx(self):
+        async def claim(variant_name):
+            return await self.async_client.add_assignment(Assignment(
+                experiment_id=1, user_id="u1", variant_name=variant_name, assigned_at=datetime.now(timezone.utc)
+            ))
+
+        self.assertTrue(asyncio.run(claim("red_button")))
+        self.assertFalse(asyncio.run(claim("blue_button")))
+        self.assertEqual(self.sync_client.get_assignment(1, "u1").variant_name, "red_button")
+
+    def test_invalidation_reaches_sync_workers(self):
+        self.sync_client.set_experiment(make_experiment(name="old name"))
+        self.assertEqual(self.sync_client.get_experiment(1).name, "old name")
+
+        asyncio.run(self.async_client.invalidate_experiment(1))
+        self.sync_client._l1_generation_checked_at = float("-inf")
+
+        self.assertIsNone(self.sync_client.get_experiment(1))
+
+    def test_bulk_assignments_in_both_layouts(self):
+        self.sync_client.set_experiment(make_experiment())
+        for layout in ("key", "hash"):
+            client = AsyncCacheClient(backend=_AsyncMockValkeyBackend(self.backend), assignment_layout=layout)
+            assignments = [
+                Assignment(id=i, experiment_id=1, user_id=f"{layout}_{i}", variant_name="red_button",
+                           assigned_at=datetime.now(timezone.utc))
+                for i in range(3)
+            ]
+
+            async def run():
+                await client.set_many_assignments(assignments[:1])
+                claimed = await client.add_many_assignments(assignments)
+                found = await client.get_many_assignments([(1, a.user_id) for a in assignments] + [(1, "nobody")])
+                return claimed, found
+
+            claimed, found = asyncio.run(run())
+            self.assertEqual(claimed, [False, True, True])
+            self.assertEqual(sorted(user_id for _, user_id in found), [a.user_id for a in assignments])
+
+    def test_unassigned_shared_with_sync_client(self):
+        pairs = [(1, "visitor"), (1, "other")]
+        asyncio.run(self.async_client.set_many_unassigned(pairs[:1]))
+
+        self.assertEqual(self.sync_client.get_many_unassigned(pairs), {(1, "visitor")})
+        self.assertEqual(asyncio.run(self.async_client.get_many_unassigned(pairs)), {(1, "visitor")})
+
+
+class TestHashAssignmentLayout(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = _MockValkeyBackend()
+        self.client = CacheClient(backend=self.backend, assignment_layout="hash")
+        self.client.set_experiment(make_experiment())
+
+    def make_assignment(self, user_id, variant_name="blue_button", experiment_id=1):
+        return Assignment(id=42, experiment_id=experiment_id, user_id=user_id, variant_name=variant_name,
+                          assigned_at=datetime(2025, 1, 2, 3, 4, 5, 678000, tzinfo=timezone.utc))
+
+    def test_round_trip_stores_packed_value_in_bucket(self):
+        self.client.set_assignment(self.make_assignment("u1"))
+
+        cached = self.client.get_assignment(1, "u1")
+        self.assertEqual((cached.id, cached.variant_name), (42, "blue_button"))
+        self.assertEqual(cached.assigned_at, datetime(2025, 1, 2, 3, 4, 5, 678000, tzinfo=timezone.utc))
+
+        buckets = {key: value for key, value in self.backend._cache.items() if key.startswith("asnh:1:")}
+        self.assertEqual(len(buckets), 1)
+        # variant index 1 (ordered by variant id), assignment id, assigned_at in ms
+        self.assertEqual(list(buckets.values())[0], {"u1": "1,42,1735787045678"})
+
+    def test_get_many_spans_buckets(self):
+        user_ids = [f"user_{i}" for i in range(50)]
+        for user_id in user_ids:
+            self.client.set_assignment(self.make_assignment(user_id, variant_name="red_button"))
+
+        found = self.client.get_many_assignments([(1, user_id) for user_id in user_ids + ["unknown"]])
+
+        self.assertEqual(len(found), 50)
+        self.assertEqual({a.variant_name for a in found.values()}, {"red_button"})
+
+    def test_add_assignment_is_hset_nx(self):
+        self.assertTrue(self.client.add_assignment(self.make_assignment("u1", variant_name="red_button")))
+        self.assertFalse(self.client.add_assignment(self.make_assignment("u1", variant_name="blue_button")))
+        self.assertEqual(self.client.get_assignment(1, "u1").variant_name, "red_button")
+
+    def test_uncached_experiment_is_a_miss(self):
+        self.assertIsNone(self.client.add_assignment(self.make_assignment("u1", experiment_id=2)))
+        self.assertIsNone(self.client.get_assignment(2, "u1"))
+
+        self.client.prime_experiments([make_experiment(experiment_id=2)])
+        self.client.set_assignment(self.make_assignment("u1", experiment_id=2))
+        self.assertEqual(self.client.get_assignment(2, "u1").variant_name, "blue_button")
+
+
+class TestBulkOperations(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = MagicMock(wraps=_MockValkeyBackend())
+        self.client = CacheClient(backend=self.backend)
+
+    def make_assignment(self, user_id, experiment_id=1):
+        return Assignment(id=1, experiment_id=experiment_id, user_id=user_id, variant_name="red_button",
+                          assigned_at=datetime(2025, 1, 1, tzinfo=timezone.utc))
+
+    def test_many_experiments_cost_one_round_trip_each_way(self):
+        self.client.set_many_experiments([make_experiment(experiment_id=i, name=f"exp {i}") for i in range(1, 6)])
+        self.assertEqual(self.backend.set_many.call_count, 1)
+        self.backend.set.assert_not_called()
+
+        self.client.get_experiment(1)   # now in L1
+        self.backend.get_many.reset_mock()
+        found = self.client.get_many_experiments([1, 2, 3, 4, 5, 6])
+
+        self.assertEqual(sorted(found), [1, 2, 3, 4, 5])
+        self.assertEqual(found[3].name, "exp 3")
+        # experiment 1 came from the L1, the rest in one MGET
+        self.backend.get_many.assert_called_once_with(["exp:2", "exp:3", "exp:4", "exp:5", "exp:6"])
+
+    def test_set_many_assignments_is_one_pipeline(self):
+        self.client.set_many_assignments([self.make_assignment(f"u{i}") for i in range(10)])
+
+        self.assertEqual(self.backend.set_many.call_count, 1)
+        self.backend.set.assert_not_called()
+        self.assertEqual(len(self.client.get_many_assignments([(1, f"u{i}") for i in range(10)])), 10)
+
+    def test_set_many_assignments_hash_layout(self):
+        client = CacheClient(backend=self.backend, assignment_layout="hash")
+        client.set_experiment(make_experiment())
+        client.set_many_assignments([self.make_assignment(f"u{i}") for i in range(10)] + [self.make_assignment("u", experiment_id=9)])
+
+        self.assertEqual(self.backend.hset_many.call_count, 1)
+        # experiment 9 isn't cached, its assignment is skipped
+        self.assertEqual(len(self.backend.hset_many.call_args.args[0]), 10)
+        self.assertEqual(len(client.get_many_assignments([(1, f"u{i}") for i in range(10)])), 10)
+
+    def test_add_many_assignments_is_one_pipeline(self):
+        self.client.add_assignment(self.make_assignment("u0"))
+
+        claimed = self.client.add_many_assignments([self.make_assignment(f"u{i}") for i in range(3)])
+
+        self.assertEqual(claimed, [False, True, True])
+        self.assertEqual(self.backend.set_many_nx.call_count, 1)
+        self.assertEqual(self.backend.set.call_count, 1)
+
+    def test_add_many_assignments_hash_layout(self):
+        client = CacheClient(backend=self.backend, assignment_layout="hash")
+        client.set_experiment(make_experiment())
+        client.add_assignment(self.make_assignment("u0"))
+
+        claimed = client.add_many_assignments([self.make_assignment("u0"), self.make_assignment("u1"), self.make_assignment("u", experiment_id=9)])
+
+        # experiment 9 isn't cached, its claim is treated as a cache outage
+        self.assertEqual(claimed, [False, True, None])
+        self.assertEqual(self.backend.hset_many_nx.call_count, 1)
+
+
+class TestRealBackendErrors(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = cache_module.RealValkeyBackend.__new__(cache_module.RealValkeyBackend)
+        self.backend.client = MagicMock()
+        self.backend.client.mget.side_effect = ConnectionError("valkey is down")
+        self.backend.client.pipeline.return_value.execute.side_effect = ConnectionError("valkey is down")
+
+    def test_errors_are_misses(self):
+        self.assertEqual(self.backend.get_many(["a", "b"]), [None, None])
+        self.assertEqual(self.backend.hmget_many([("h", ["a", "b"])]), [[None, None]])
+        self.assertIsNone(self.backend.set_many([("a", "1")], ex=10))
+        self.assertIsNone(self.backend.hset_many([("h", "a", "1")], ex=10))
+
+    def test_hash_buckets_expire_after_creation_not_last_write(self):
+        self.backend.client.pipeline.return_value.execute.side_effect = None
+        self.backend.client.pipeline.return_value.execute.return_value = [1, True]
+
+        self.backend.hset("h", "a", "1", ex=10)
+        self.backend.hset_many([("h", "b", "2")], ex=10)
+
+        pipeline = self.backend.client.pipeline.return_value
+        pipeline.expire.assert_has_calls([call("h", 10, nx=True), call("h", 10, nx=True)])
+
+    def test_set_many_pipelines_set_with_expiry(self):
+        self.backend.client.pipeline.return_value.execute.side_effect = None
+
+        self.assertTrue(self.backend.set_many([("a", "1"), ("b", "2")], ex=10))
+
+        pipeline = self.backend.client.pipeline.return_value
+        pipeline.set.assert_has_calls([call("a", "1", ex=10), call("b", "2", ex=10)])
+        pipeline.execute.assert_called_once()
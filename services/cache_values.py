@@ -0,0 +1,152 @@
+from datetime import datetime, timezone
+from typing import NamedTuple
+from services.allocation import AllocationTable
+import json
+import logging
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Compact cache representation of experiments and assignments.
+# Values are stored as positional JSON arrays (no field names, no relationship walk) and
+# decoded into immutable named tuples: no ORM instrumentation, one small allocation per field.
+# The first element is the format version, values of another version or malformed ones
+# (e.g. truncated) decode as a miss and are re-read from the database.
+CACHE_VALUE_VERSION = 1
+EXPERIMENT_FIELDS = 7
+ASSIGNMENT_FIELDS = 6
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, separators=(",", ":"))
+
+def _fields(value: str, count: int) -> list | None:
+    """ Positional fields of a cached value, None unless it is a well-formed value of this version """
+    try:
+        fields = json.loads(value)
+    except ValueError:
+        return None
+    if not isinstance(fields, list) or len(fields) != count or fields[0] != CACHE_VALUE_VERSION:
+        return None
+    return fields
+
+
+class CachedVariant(NamedTuple):
+    id: int | None
+    experiment_id: int | None
+    name: str
+    allocation_percent: float
+
+
+class CachedExperiment(NamedTuple):
+    id: int
+    name: str
+    description: str | None
+    is_active: bool
+    created_at: datetime | None
+    variants: tuple[CachedVariant, ...]
+    # Compiled once when the value is decoded, see services.allocation.get_allocation_table
+    allocation: AllocationTable
+
+
+class CachedAssignment(NamedTuple):
+    id: int | None
+    experiment_id: int
+    user_id: str
+    variant_name: str
+    assigned_at: datetime | None
+
+
+def _iso(value: datetime | None) -> str | None:
+    return value.isoformat() if value is not None else None
+
+def _from_iso(value: str | None) -> datetime | None:
+    return datetime.fromisoformat(value) if value is not None else None
+
+
+def encode_experiment(experiment) -> str:
+    """ Encode an Experiment (ORM or CachedExperiment) with its variants """
+    return _dumps([
+        CACHE_VALUE_VERSION,
+        experiment.id,
+        experiment.name,
+        experiment.description,
+        experiment.is_active,
+        _iso(experiment.created_at),
+        [[v.id, v.name, v.allocation_percent] for v in experiment.variants],
+    ])
+
+def decode_experiment(value: str) -> CachedExperiment | None:
+    fields = _fields(value, EXPERIMENT_FIELDS)
+    if fields is None:
+        return None
+    _, experiment_id, name, description, is_active, created_at, variants = fields
+    variants = tuple(
+        CachedVariant(variant_id, experiment_id, variant_name, allocation_percent)
+        for variant_id, variant_name, allocation_percent in variants
+    )
+    return CachedExperiment(
+        experiment_id, name, description, is_active, _from_iso(created_at), variants,
+        AllocationTable(experiment_id, ((v.name, v.allocation_percent) for v in variants))
+    )
+
+
+def encode_assignment(assignment) -> str:
+    """ Encode an Assignment (ORM or CachedAssignment), the experiment is cached on its own """
+    return _dumps([
+        CACHE_VALUE_VERSION,
+        assignment.id,
+        assignment.experiment_id,
+        assignment.user_id,
+        assignment.variant_name,
+        _iso(assignment.assigned_at),
+    ])
+
+def decode_assignment(value: str) -> CachedAssignment | None:
+    fields = _fields(value, ASSIGNMENT_FIELDS)
+    if fields is None:
+        return None
+    _, assignment_id, experiment_id, user_id, variant_name, assigned_at = fields
+    return CachedAssignment(assignment_id, experiment_id, user_id, variant_name, _from_iso(assigned_at))
+
+
+# --- Hash bucket layout of assignments (config.assignment_cache_layout == "hash") ---
+# Users of an experiment are sharded into config.assignment_cache_buckets hashes,
+# the field is the user id and the value packs "variant index,assignment id,assigned_at ms".
+# Variant indexes follow the variant ids of the experiment, which never change once created.
+
+def assignment_bucket_key(experiment_id: int, user_id: str, buckets: int) -> str:
+    return f"asnh:{experiment_id}:{zlib.crc32(user_id.encode()) % buckets}"
+
+
+def variant_names_of(experiment) -> tuple[str, ...]:
+    """ Variant names in variant id order, the index space of packed assignments """
+    variants = sorted(experiment.variants, key=lambda v: (v.id is None, v.id or 0))
+    return tuple(v.name for v in variants)
+
+
+def pack_assignment(assignment, variant_names: tuple[str, ...]) -> str | None:
+    try:
+        index = variant_names.index(assignment.variant_name)
+    except ValueError:
+        return None
+    assigned_at = assignment.assigned_at
+    if assigned_at is not None and assigned_at.tzinfo is None:
+        assigned_at = assigned_at.replace(tzinfo=timezone.utc)     # stored timestamps are UTC
+    assigned_at_ms = round(assigned_at.timestamp() * 1000) if assigned_at is not None else ""
+    assignment_id = assignment.id if assignment.id is not None else ""
+    return f"{index},{assignment_id},{assigned_at_ms}"
+
+
+def unpack_assignment(value: str, experiment_id: int, user_id: str, variant_names: tuple[str, ...]) -> CachedAssignment | None:
+    index, assignment_id, assigned_at_ms = value.split(",")
+    index = int(index)
+    if index >= len(variant_names):
+        return None
+    return CachedAssignment(
+        int(assignment_id) if assignment_id else None,
+        experiment_id,
+        user_id,
+        variant_names[index],
+        datetime.fromtimestamp(int(assigned_at_ms) / 1000, tz=timezone.utc) if assigned_at_ms else None
+    )
@@ -0,0 +1,56 @@
+import json
+import unittest
+from datetime import datetime, timezone
+from data.database import Assignment, Experiment, Variant
+from services.allocation import get_allocation_table
+from services.cache_values import (
+    CachedAssignment, CachedExperiment, decode_assignment, decode_experiment, encode_assignment, encode_experiment
+)
+
+
+def make_experiment():
+    experiment = Experiment(id=7, name="Button Color Test", description=None, is_active=True, created_at=datetime(2025, 1, 1))
+    experiment.variants = [
+        Variant(id=1, experiment_id=7, name="red_button", allocation_percent=30.0),
+        Variant(id=2, experiment_id=7, name="blue_button", allocation_percent=70.0),
+    ]
+    return experiment
+
+
+class TestCacheValues(unittest.TestCase):
+
+    def test_experiment_round_trip(self):
+        cached = decode_experiment(encode_experiment(make_experiment()))
+
+        self.assertIsInstance(cached, CachedExperiment)
+        self.assertEqual((cached.id, cached.name, cached.is_active), (7, "Button Color Test", True))
+        self.assertEqual(cached.created_at, datetime(2025, 1, 1))
+        self.assertEqual([(v.name, v.allocation_percent) for v in cached.variants], [("red_button", 30.0), ("blue_button", 70.0)])
+        # A cached value re-encodes to the same bytes
+        self.assertEqual(encode_experiment(cached), encode_experiment(make_experiment()))
+
+    def test_decoded_experiment_carries_allocation_table(self):
+        cached = decode_experiment(encode_experiment(make_experiment()))
+
+        self.assertIs(get_allocation_table(cached), cached.allocation)
+        self.assertEqual(cached.allocation.cum_weights, (30.0, 100.0))
+
+    def test_assignment_round_trip(self):
+        assigned_at = datetime(2025, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+        assignment = Assignment(id=3, experiment_id=7, user_id="u1", variant_name="red_button", assigned_at=assigned_at)
+
+        cached = decode_assignment(encode_assignment(assignment))
+
+        self.assertEqual(cached, CachedAssignment(3, 7, "u1", "red_button", assigned_at))
+
+    def test_other_formats_decode_as_miss(self):
+        # e.g. values written by a previous release
+        self.assertIsNone(decode_assignment(json.dumps({"id": 3, "user_id": "u1"})))
+        self.assertIsNone(decode_experiment(json.dumps([0, 7, "old version"])))
+
+    def test_malformed_values_decode_as_miss(self):
+        value = encode_experiment(Experiment(id=7, name="exp", description=None, is_active=True, created_at=None, variants=[]))
+        for malformed in ("[]", "[1, 7]", value[:-3], ""):
+            self.assertIsNone(decode_experiment(malformed))
+        self.assertIsNone(decode_assignment("[]"))
+        self.assertIsNone(decode_assignment("[1, 3"))
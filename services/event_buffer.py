@@ -0,0 +1,164 @@
+from celery_tasks.event_tasks import insert_events_to_db
+from services.backpressure import get_ingestion_admission
+from typing import Any, Callable
+from config import config
+import os
+import queue
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class EventPublishBuffer:
+    """
+    Per-process buffer of event task payloads in front of the broker.
+
+    POST /events only appends to an in-memory queue, a flusher thread publishes
+    the queued events every max_wait_ms (or as soon as max_events are queued) as
+    insert_events_to_db messages of at most max_events events. A failed publish keeps
+    its events and is retried on the next interval, new events are refused once
+    max_pending are waiting so a broker outage cannot exhaust the worker's memory.
+    """
+
+    def __init__(
+        self,
+        publish: Callable[[list[dict[str, Any]]], Any] | None = None,
+        max_events: int = 500,
+        max_wait_ms: float = 50,
+        max_pending: int = 100000
+    ):
+        self.publish = publish or _publish_events
+        self.max_events = max_events
+        self.max_wait = max_wait_ms / 1000
+        self.max_pending = max_pending
+        self._queue: queue.Queue[dict[str, Any]] = queue.Queue()
+        self._retry: list[dict[str, Any]] = []
+        # Events accepted and not published yet: queued, waiting for a retry or being published
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._flusher: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+
+        # Stats
+        self.published_total = 0
+        self.messages_total = 0
+        self.refused_total = 0
+        self.failed_flushes = 0
+        self.last_flush_at: float | None = None
+
+    def add(self, payload: dict[str, Any]) -> bool:
+        """Queue an event for publishing, never blocks. False when the buffer is full."""
+        with self._pending_lock:
+            if self._pending >= self.max_pending:
+                self.refused_total += 1
+                return False
+            self._pending += 1
+        self._ensure_flusher()
+        self._queue.put(payload)
+        if self._queue.qsize() >= self.max_events:
+            self._wakeup.set()
+        return True
+
+    def _ensure_flusher(self):
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._start_lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._stop.clear()
+                self._flusher = threading.Thread(target=self._run, name="event-publish-buffer", daemon=True)
+                self._flusher.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.max_wait)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Event buffer failed to publish, %d events pending.", self.depth)
+
+    def flush(self) -> int:
+        """Publish everything queued so far, returns the number of events published."""
+        with self._flush_lock:
+            pending, self._retry = self._retry, []
+            while True:
+                try:
+                    pending.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not pending:
+                return 0
+
+            published = 0
+            try:
+                for start in range(0, len(pending), self.max_events):
+                    chunk = pending[start:start + self.max_events]
+                    self.publish(chunk)
+                    published += len(chunk)
+                    with self._pending_lock:
+                        self._pending -= len(chunk)
+                    self.messages_total += 1
+            except Exception:
+                self.failed_flushes += 1
+                self._retry = pending[published:]
+                raise
+            finally:
+                self.published_total += published
+                if published:
+                    self.last_flush_at = time.monotonic()
+
+            logger.debug("Event buffer published %d events.", published)
+            return published
+
+    @property
+    def depth(self) -> int:
+        """Events accepted and not published yet, those of a publish in progress included."""
+        return self._pending
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "depth": self.depth,
+            "published_total": self.published_total,
+            "messages_total": self.messages_total,
+            "refused_total": self.refused_total,
+            "failed_flushes": self.failed_flushes,
+            "seconds_since_last_flush": round(time.monotonic() - self.last_flush_at, 3) if self.last_flush_at else None,
+        }
+
+    def close(self, timeout: float = 5.0):
+        """Stop the flusher and publish what is left, called on shutdown."""
+        self._stop.set()
+        if self._flusher is not None:
+            self._wakeup.set()
+            self._flusher.join(timeout)
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Event buffer could not publish %d events on shutdown.", self.depth)
+
+
+def _publish_events(payloads: list[dict[str, Any]]):
+    insert_events_to_db.delay(payloads)
+
+
+_buffer: EventPublishBuffer | None = None
+_buffer_pid: int | None = None
+
+def get_event_buffer() -> EventPublishBuffer:
+    """Per-process buffer, recreated after a fork so every worker owns its flusher thread."""
+    global _buffer, _buffer_pid
+    if _buffer is None or _buffer_pid != os.getpid():
+        _buffer = EventPublishBuffer(
+            # Buffered publishes count in the publish latency of the admission control
+            publish=lambda payloads: get_ingestion_admission().timed(_publish_events, payloads),
+            max_events=config.event_buffer_max_events,
+            max_wait_ms=config.event_buffer_max_wait_ms,
+            max_pending=config.event_buffer_max_pending
+        )
+        _buffer_pid = os.getpid()
+    return _buffer
@@ -0,0 +1,228 @@
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.orm import Session
+from data.database import SessionLocal
+from celery_tasks.batch_writer import EventBatchWriter
+from services.events import event_row
+from typing import Any, Callable
+from config import config
+import json
+import os
+import socket
+import threading
+import time
+import redis
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Supported values for config.event_transport
+EVENT_TRANSPORT_CELERY = "celery"   # one celery task per event (or per batch chunk)
+EVENT_TRANSPORT_STREAM = "stream"   # XADD to a Valkey stream, drained by stream_worker.py
+
+EVENT_STREAM_GROUP = "event-writers"   # consumer group shared by every stream worker
+EVENT_STREAM_FIELD = "e"               # stream entries hold the task payload as JSON in one field
+
+STREAM_RETRY_DELAY = 1.0       # seconds to wait after Valkey or the database failed
+STREAM_CLAIM_INTERVAL = 30.0   # seconds between scans for entries stuck at dead consumers
+
+
+class EventStreamProducer:
+    """API side of the stream transport: appends task payloads to the events stream."""
+
+    def __init__(self, client: redis.Redis, stream: str, maxlen: int):
+        self.client = client
+        self.stream = stream
+        self.maxlen = maxlen
+
+        # Stats
+        self.published_total = 0
+        self.failed_publishes = 0
+
+    def publish(self, payloads: list[dict[str, Any]]) -> list[str]:
+        """
+        Append the payloads in one pipelined round-trip, returns the entry ids.
+        Trimming is approximate (MAXLEN ~) so Valkey only drops whole macro nodes.
+        """
+        pipeline = self.client.pipeline(transaction=False)
+        for payload in payloads:
+            pipeline.xadd(self.stream, {EVENT_STREAM_FIELD: json.dumps(payload)}, maxlen=self.maxlen, approximate=True)
+        try:
+            entry_ids = pipeline.execute()
+        except Exception:
+            self.failed_publishes += 1
+            raise
+        self.published_total += len(entry_ids)
+        return entry_ids
+
+    def stats(self) -> dict[str, Any]:
+        content: dict[str, Any] = {
+            "published_total": self.published_total,
+            "failed_publishes": self.failed_publishes,
+        }
+        try:
+            content["length"] = self.client.xlen(self.stream)
+            content["pending"] = self.client.xpending(self.stream, EVENT_STREAM_GROUP)["pending"]
+        except redis.RedisError:
+            # Stream or group not created yet, or Valkey unreachable
+            pass
+        return content
+
+
+class EventStreamConsumer:
+    """
+    Worker side of the stream transport, one per stream_worker.py process.
+
+    Reads up to count entries per XREADGROUP, bulk inserts them in one transaction and
+    acknowledges them after the commit, so delivery is at least once: a worker dying
+    between the two re-inserts that block. Malformed payloads and rows the database
+    rejects are logged and acknowledged, they would fail again on every redelivery.
+    On start, and after a failed write, the consumer first re-reads its own pending
+    entries. Entries pending at another consumer for claim_idle_ms are taken over
+    with XAUTOCLAIM.
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        stream: str,
+        group: str = EVENT_STREAM_GROUP,
+        consumer: str | None = None,
+        session_factory: Callable[[], Session] = SessionLocal,
+        count: int = 500,
+        block_ms: int = 1000,
+        claim_idle_ms: int = 60000,
+        after_write: Callable[[], None] | None = None
+    ):
+        self.client = client
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.count = count
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.after_write = after_write
+        self.writer = EventBatchWriter(session_factory=session_factory)
+        self._read_id = "0"            # "0": own pending entries, ">": new entries
+        self._claim_cursor = "0-0"
+        self._last_claim = 0.0
+
+        # Stats
+        self.written_total = 0
+        self.rejected_total = 0
+        self.claimed_total = 0
+        self.failed_writes = 0
+
+    def ensure_group(self):
+        """Create the stream and the consumer group, reading from the start of the stream."""
+        try:
+            self.client.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except redis.ResponseError as exc:
+            if "BUSYGROUP" not in str(exc):
+                raise
+
+    def read(self) -> list[tuple[str, dict[str, str] | None]]:
+        """Next block of entries: own pending ones first, then reclaimed, then new ones."""
+        if self._read_id == "0":
+            entries = self._xreadgroup("0")
+            if entries:
+                return entries
+            self._read_id = ">"
+
+        if time.monotonic() - self._last_claim >= STREAM_CLAIM_INTERVAL:
+            entries = self.reclaim()
+            if entries:
+                return entries
+
+        return self._xreadgroup(">", block=self.block_ms)
+
+    def _xreadgroup(self, read_id: str, block: int | None = None) -> list[tuple[str, dict[str, str] | None]]:
+        response = self.client.xreadgroup(self.group, self.consumer, {self.stream: read_id}, count=self.count, block=block)
+        return response[0][1] if response else []
+
+    def reclaim(self) -> list[tuple[str, dict[str, str] | None]]:
+        """Take over entries idle for claim_idle_ms at other consumers (crashed workers)."""
+        self._last_claim = time.monotonic()
+        self._claim_cursor, entries, *_ = self.client.xautoclaim(
+            self.stream, self.group, self.consumer, self.claim_idle_ms, start_id=self._claim_cursor, count=self.count
+        )
+        if entries:
+            self.claimed_total += len(entries)
+            logger.warning("Reclaimed %d idle event stream entries.", len(entries))
+        return entries
+
+    def process(self, entries: list[tuple[str, dict[str, str] | None]]) -> int:
+        """Insert the entries in one transaction and acknowledge them, returns the rows written."""
+        entry_ids = []
+        rows = []
+        rejected = 0
+        for entry_id, fields in entries:
+            entry_ids.append(entry_id)
+            try:
+                # fields is None for entries trimmed while they were pending
+                rows.append(event_row(json.loads(fields[EVENT_STREAM_FIELD])))
+            except (KeyError, TypeError, ValueError) as exc:
+                logger.error("Rejected malformed stream entry %s: %s", entry_id, exc)
+                rejected += 1
+
+        if rows:
+            # Connection errors propagate: nothing is acknowledged and the block is read again
+            rejected += len(self.writer.write(rows))
+        self.client.xack(self.stream, self.group, *entry_ids)
+
+        written = len(entries) - rejected
+        self.written_total += written
+        self.rejected_total += rejected
+        logger.info("Event stream consumer committed %d events, %d rejected.", written, rejected)
+        return written
+
+    def poll(self) -> int:
+        """Read and write one block, returns the number of entries handled."""
+        entries = self.read()
+        if not entries:
+            return 0
+        self.process(entries)
+        if self.after_write:
+            self.after_write()
+        return len(entries)
+
+    def run(self, stop: threading.Event | None = None):
+        """Consume until stop is set, retrying every STREAM_RETRY_DELAY while Valkey or the database is down."""
+        stop = stop or threading.Event()
+        self.ensure_group()
+        logger.info("Event stream consumer %s reading %s as %s.", self.consumer, self.stream, self.group)
+        while not stop.is_set():
+            try:
+                self.poll()
+            except (OperationalError, InterfaceError, redis.ConnectionError, redis.TimeoutError) as exc:
+                self.failed_writes += 1
+                logger.error("Event stream consumer failed, retrying its pending entries: %s", exc)
+                self._read_id = "0"
+                stop.wait(STREAM_RETRY_DELAY)
+            except redis.ResponseError as exc:
+                if "NOGROUP" not in str(exc):
+                    raise
+                # The stream was deleted (e.g. FLUSHDB), start over on a new one
+                logger.warning("Event stream %s lost its consumer group, recreating it.", self.stream)
+                self.ensure_group()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "consumer": self.consumer,
+            "written_total": self.written_total,
+            "rejected_total": self.rejected_total,
+            "claimed_total": self.claimed_total,
+            "failed_writes": self.failed_writes,
+        }
+
+
+def get_stream_client() -> redis.Redis:
+    return redis.Redis.from_url(config.event_stream_url, decode_responses=True)
+
+
+_producer: EventStreamProducer | None = None
+
+def get_event_stream() -> EventStreamProducer:
+    global _producer
+    if _producer is None:
+        _producer = EventStreamProducer(get_stream_client(), config.event_stream_name, config.event_stream_maxlen)
+    return _producer
@@ -0,0 +1,188 @@
+from typing import Any, AsyncIterator
+from datetime import datetime
+from pydantic import ValidationError
+from models.events import EventCreate
+import codecs
+import json
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration Constants ---
+MAX_EVENTS_PER_BATCH = 10000    # per POST /events/batch request
+EVENT_TASK_BATCH_SIZE = 500     # events per Celery message
+MAX_EVENT_SIZE = 64 * 1024      # characters buffered for one batch element or NDJSON line
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+_decoder = json.JSONDecoder()
+TRUNCATED_TAIL_SIZE = 16        # longest cut token a decode error may point at, e.g. "-Infinit"
+_LITERALS = ("true", "false", "null", "NaN", "Infinity", "-Infinity")
+_NUMBER_TAIL = re.compile(r"[-+.eE0-9]*")
+
+
+class EventBatchFormatError(ValueError):
+    """The request body is not a JSON array or NDJSON stream."""
+
+
+class EventBatchTooLarge(ValueError):
+    """The request body holds more than MAX_EVENTS_PER_BATCH events, or an event above MAX_EVENT_SIZE."""
+
+
+def build_task_payload(event_data: EventCreate) -> dict[str, Any]:
+    """ Convert an event into the JSON serializable payload consumed by the event tasks """
+
+    # Convert Pydantic properties dict to JSON string for SQLite storage
+    properties_json = json.dumps(event_data.properties) if event_data.properties else None
+
+    return {
+        'user_id': event_data.user_id,
+        'type': event_data.type,
+        # Celery requires simple serializable types (like string for datetime)
+        'timestamp': event_data.timestamp.isoformat() if isinstance(event_data.timestamp, datetime) else event_data.timestamp,
+        'properties_json': properties_json
+    }
+
+
+def event_row(event_data_dict: dict[str, Any]) -> dict[str, Any]:
+    """ Convert a task payload into the column values of the events table """
+    return {
+        'user_id': event_data_dict['user_id'],
+        'type': event_data_dict['type'],
+        'timestamp': datetime.fromisoformat(event_data_dict['timestamp']),
+        'properties_json': event_data_dict['properties_json']
+    }
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """
+    Yield one decoded item per non empty line as the body streams in.
+    A line that is not valid JSON yields the JSONDecodeError so it can be rejected on its own.
+    Raises EventBatchTooLarge when a line grows above MAX_EVENT_SIZE.
+    """
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield _loads_line(line)
+        if len(buffer) > MAX_EVENT_SIZE:
+            raise EventBatchTooLarge(f"An event holds at most {MAX_EVENT_SIZE} characters.")
+
+    if buffer.strip():
+        yield _loads_line(buffer)
+
+
+def _loads_line(line: bytes) -> Any:
+    if len(line) > MAX_EVENT_SIZE:
+        raise EventBatchTooLarge(f"An event holds at most {MAX_EVENT_SIZE} characters.")
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return e
+
+
+async def iter_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """
+    Yield the elements of a top level JSON array as soon as each one is complete,
+    without buffering the whole body. Raises EventBatchFormatError on a malformed array
+    and EventBatchTooLarge when an element grows above MAX_EVENT_SIZE.
+    """
+    chunks = chunks.__aiter__()
+    # Incremental decoder: a multi byte character may be split across chunks
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    pos = 0
+    exhausted = False
+
+    async def read_more() -> bool:
+        nonlocal buffer, pos, exhausted
+        if exhausted:
+            return False
+        try:
+            chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            exhausted = True
+            return False
+        # Drop what has already been consumed so the buffer stays small
+        buffer = buffer[pos:] + utf8.decode(chunk)
+        pos = 0
+        return True
+
+    async def next_token() -> str | None:
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if not await read_more():
+                return None
+
+    if await next_token() != "[":
+        raise EventBatchFormatError("Expected a JSON array of events.")
+    pos += 1
+
+    if await next_token() == "]":
+        return
+
+    while True:
+        if await next_token() is None:
+            raise EventBatchFormatError("Unexpected end of JSON array.")
+        while True:
+            try:
+                start = pos
+                item, pos = _decoder.raw_decode(buffer, pos)
+                break
+            except ValueError as e:
+                # The element may just be cut at the chunk boundary
+                if not _maybe_truncated(buffer, e):
+                    raise EventBatchFormatError(f"Invalid JSON array element: {e}")
+                # Decode again once the element's text doubled, linear in its size
+                attempted = len(buffer) - pos
+                grew = False
+                while len(buffer) - pos < 2 * attempted and await read_more():
+                    grew = True
+                    if len(buffer) - pos > MAX_EVENT_SIZE:
+                        raise EventBatchTooLarge(f"An event holds at most {MAX_EVENT_SIZE} characters.")
+                if not grew:
+                    raise EventBatchFormatError(f"Invalid JSON array element: {e}")
+        if pos - start > MAX_EVENT_SIZE:
+            raise EventBatchTooLarge(f"An event holds at most {MAX_EVENT_SIZE} characters.")
+        yield item
+
+        token = await next_token()
+        if token == ",":
+            pos += 1
+        elif token == "]":
+            return
+        else:
+            raise EventBatchFormatError("Expected ',' or ']' between array elements.")
+
+
+def _maybe_truncated(buffer: str, error: ValueError) -> bool:
+    """
+    Whether a decode error may only come from the end of the buffer: an unterminated string,
+    or a failure within the last characters (a cut literal or number such as "tru" or "1.").
+    """
+    if not isinstance(error, json.JSONDecodeError):
+        return False
+    if error.msg.startswith("Unterminated string"):
+        return True
+    tail = buffer[error.pos:]
+    if len(tail) > TRUNCATED_TAIL_SIZE:
+        return False
+    return bool(_NUMBER_TAIL.fullmatch(tail)) or any(literal.startswith(tail) for literal in _LITERALS)
+
+
+def validate_event(item: Any) -> tuple[EventCreate | None, list[dict[str, Any]] | None]:
+    """ Validate one batch item, returns (event, None) or (None, errors) """
+    if isinstance(item, ValueError):
+        return None, [{"loc": [], "msg": f"Invalid JSON: {item}"}]
+
+    try:
+        return EventCreate.model_validate(item), None
+    except ValidationError as e:
+        return None, [{"loc": list(err["loc"]), "msg": err["msg"]} for err in e.errors()]
@@ -1,10 +1,14 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func, select, literal
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy import func, select
 from datetime import datetime
-from fastapi import HTTPException
+from fastapi import BackgroundTasks, HTTPException
 from models.results import ExperimentResultsSummary, VariantResult
-from data.database import Assignment, Event, Experiment
+from data.database import Assignment, EventAttribution, Experiment
+from services import rollups
+from config import config
+import hashlib
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -12,53 +16,80 @@ def calculate_summary(
     db: Session, 
     experiment_id: int, 
     event_type: str, 
-    start_datetime: datetime | None
+    start_datetime: datetime | None,
+    use_rollups: bool | None = None
 ) -> ExperimentResultsSummary:
     """
     Calculates experiment performance summary with the required time-filter logic.
+    By default (config.results_use_rollups) the counts come from the results_rollups table,
+    which lags ingestion by one refresh and filters start_datetime at hour granularity.
+    use_rollups=False aggregates the assignments and event attributions directly.
     """
-    
     # 1. Check if experiment exists
     experiment = db.query(Experiment).filter(Experiment.id == experiment_id).first()
     if not experiment:
         raise HTTPException(status_code=404, detail="Experiment not found.")
 
+    conversion_statement, assignment_statement = summary_statements(experiment_id, event_type, start_datetime, use_rollups)
+    conversion_results = db.execute(conversion_statement).all()
+    assignment_counts = db.execute(assignment_statement).all()
+
+    return build_summary(experiment, conversion_results, assignment_counts)
+
+
+def summary_statements(experiment_id: int, event_type: str, start_datetime: datetime | None, use_rollups: bool | None = None):
+    """ Conversion and assignment count queries of calculate_summary, shared with the async path """
+    if use_rollups is None:
+        use_rollups = config.results_use_rollups
+
+    if use_rollups:
+        return (
+            rollups.rollup_conversion_counts_statement(experiment_id, event_type, start_datetime),
+            rollups.rollup_assignment_counts_statement(experiment_id)
+        )
+
     # 2. Build the Core Query for Conversions
-    
-    # We join Assignments (A) and Events (E) to ensure we link the conversion back to the variant.
-    conversion_query = db.query(
-        Assignment.variant_name,
-        func.count(Event.id).label('conversion_count')
-    ).join(
-        Event, Assignment.user_id == Event.user_id
-    ).filter(
-        Assignment.experiment_id == experiment_id,
-        Event.type == event_type,
-        # CRUCIAL REQUIREMENT: Only count events that happened AFTER assignment
-        Event.timestamp > Assignment.assigned_at
+
+    # Events are attributed to the user's variant at ingestion (services.attribution), which
+    # already keeps only events that happened AFTER assignment, so this is a single-table aggregation.
+    conversion_statement = select(
+        EventAttribution.variant_name,
+        func.count(EventAttribution.event_id).label('conversion_count')
+    ).where(
+        EventAttribution.experiment_id == experiment_id,
+        EventAttribution.event_type == event_type
     )
     
     # Apply optional date filtering
     if start_datetime:
         logger.debug("calculate summary from start_datetime %s", start_datetime)
-        conversion_query = conversion_query.filter(Event.timestamp >= start_datetime)
+        conversion_statement = conversion_statement.where(EventAttribution.timestamp >= start_datetime)
     
-    conversion_results = conversion_query.group_by(Assignment.variant_name).all()
+    conversion_statement = conversion_statement.group_by(EventAttribution.variant_name)
     
-    print(f"conversion_results: {conversion_results}")
     # 3. Get Total Assignments (Denominator)
     # We must count all assignments, regardless of conversion, to get the total traffic.
-    assignment_counts = db.query(
+    assignment_statement = select(
         Assignment.variant_name,
         func.count(Assignment.id).label('total_assignments')
-    ).filter(
+    ).where(
         Assignment.experiment_id == experiment_id
-    ).group_by(Assignment.variant_name).all()
+    ).group_by(Assignment.variant_name)
+
+    return conversion_statement, assignment_statement
+
+
+def build_summary(experiment: Experiment, conversion_results, assignment_counts) -> ExperimentResultsSummary:
+    """ Aggregate the (variant_name, count) rows of summary_statements """
 
     # 4. Aggregate Results
-    results_map: dict[str, VariantResult] = {}
-    
-    # Initialize all variants (even those with zero conversions)
+    # Initialize all variants (even those with zero assignments or conversions): attributions
+    # can be ahead of the counted assignments, e.g. credited against a write-behind assignment
+    # still in the cache or folded before its assignment batch
+    results_map: dict[str, VariantResult] = {
+        variant.name: VariantResult(total_assignments=0, conversion_count=0, conversion_rate=0.0)
+        for variant in experiment.variants
+    }
     for name, total_count in assignment_counts:
         results_map[name] = VariantResult(
             total_assignments=total_count,
@@ -68,16 +99,105 @@ def calculate_summary(
         
     # Populate conversion counts and calculate rates
     for variant_name, count in conversion_results:
-        total = results_map[variant_name].total_assignments
+        variant = results_map.setdefault(variant_name, VariantResult(total_assignments=0, conversion_count=0, conversion_rate=0.0))
+        total = variant.total_assignments
         rate = (count / total) * 100 if total > 0 else 0.0
         
-        results_map[variant_name].conversion_count = count
-        results_map[variant_name].conversion_rate = round(rate, 2)
+        variant.conversion_count = count
+        variant.conversion_rate = round(rate, 2)
         
     
     return ExperimentResultsSummary(
-        experiment_id=experiment_id,
+        experiment_id=experiment.id,
         experiment_name=experiment.name,
         report_generated_at=datetime.utcnow(),
         variant_data=results_map
-    )
\ No newline at end of file
+    )
+
+
+# --- Cached Results ---
+
+def results_cache_key(experiment_id: int, event_type: str, start_datetime: datetime | None) -> str:
+    # The rollups are hourly, so every start inside one hour shares an entry (e.g. last_day polls)
+    start = rollups.bucket_start(start_datetime).isoformat() if start_datetime else "all"
+    return f"res:{experiment_id}:{event_type}:{start}"
+
+
+def summary_etag(summary: ExperimentResultsSummary) -> str:
+    """ Strong ETag of the numbers, report_generated_at is left out so unchanged results keep their tag """
+    digest = hashlib.blake2b(summary.model_dump_json(exclude={"report_generated_at"}).encode(), digest_size=16)
+    return f'"{digest.hexdigest()}"'
+
+
+def compute_results_entry(
+    db: Session,
+    experiment_id: int,
+    event_type: str,
+    start_datetime: datetime | None,
+    use_rollups: bool | None = None,
+    previous: dict | None = None
+) -> dict:
+    """
+    Run calculate_summary and wrap it as a results cache entry.
+    When the numbers did not change the previous body is kept, as its ETag promises the same bytes.
+    """
+    summary = calculate_summary(db, experiment_id, event_type, start_datetime, use_rollups=use_rollups)
+    return results_entry(summary, previous)
+
+
+def results_entry(summary: ExperimentResultsSummary, previous: dict | None = None) -> dict:
+    etag = summary_etag(summary)
+    body = previous["body"] if previous and previous["etag"] == etag else summary.model_dump_json()
+    return {"etag": etag, "computed_at": time.time(), "body": body}
+
+
+def refresh_cached_summary(session_factory, cache, key: str, token: str, experiment_id: int, event_type: str, start_datetime: datetime | None, previous: dict | None):
+    """ Background recomputation of a stale entry, runs only while holding the key's refresh lock (token) """
+    db = session_factory()
+    try:
+        entry = compute_results_entry(db, experiment_id, event_type, start_datetime, previous=previous)
+        cache.set_results(key, entry, ex=config.results_cache_stale_ttl)
+    except Exception as e:
+        # Pollers keep getting the stale entry until it expires
+        logger.error("Failed to refresh results %s: %s", key, e)
+    finally:
+        db.close()
+        cache.release_results_refresh(key, token)
+
+
+def get_cached_summary(
+    db: Session,
+    cache,
+    background_tasks: BackgroundTasks,
+    experiment_id: int,
+    event_type: str,
+    start_datetime: datetime | None
+) -> dict:
+    """
+    Results cache entry of the rollup summary, with stale-while-revalidate:
+    - fresh entry (younger than config.results_cache_ttl): returned as is
+    - stale entry: returned as is, and the first poller to take the refresh lock schedules
+      one background recomputation that every other poller then shares
+    - no entry: computed inline and cached
+    Only rollup summaries are cached, their start is already bucketed like the cache key.
+    """
+    if config.results_cache_ttl <= 0 or not config.results_use_rollups:
+        return compute_results_entry(db, experiment_id, event_type, start_datetime)
+
+    key = results_cache_key(experiment_id, event_type, start_datetime)
+    entry = cache.get_results(key)
+    if entry:
+        age = time.time() - entry["computed_at"]
+        token = cache.acquire_results_refresh(key) if age > config.results_cache_ttl else None
+        if token:
+            logger.debug("results %s stale by %.1fs, refreshing in background", key, age)
+            # The request session is closed before background tasks run, use a new one on the same engine
+            session_factory = sessionmaker(autocommit=False, autoflush=False, bind=db.get_bind())
+            background_tasks.add_task(
+                refresh_cached_summary, session_factory, cache, key, token, experiment_id, event_type, start_datetime, entry
+            )
+        return entry
+
+    entry = compute_results_entry(db, experiment_id, event_type, start_datetime)
+    cache.set_results(key, entry, ex=config.results_cache_stale_ttl)
+    return entry
@@ -0,0 +1,247 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import Select, and_, func, insert, not_, or_, select, update
+from collections import Counter
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
+from data.database import Assignment, Event, EventAttribution, ResultsRollup, RollupGap, RollupWatermark, dialect_insert
+from config import config
+import logging
+
+logger = logging.getLogger(__name__)
+
+# event_type of the rollup rows holding assignment counts
+ASSIGNMENT_ROLLUP_TYPE = ""
+
+# Source rows folded per refresh, bounds the work (and the join) of one refresh
+ROLLUP_BATCH_SIZE = 10000
+
+WATERMARK_EVENTS = "events"
+WATERMARK_ASSIGNMENTS = "assignments"
+WATERMARK_ATTRIBUTION = "attribution"
+
+
+def bucket_start(timestamp: datetime) -> datetime:
+    """ Hourly bucket of a timestamp """
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+class IdCursor:
+    """
+    Commit-safe position of an incremental stage in a source table.
+
+    Ids are allocated at insert but become visible at commit, so with concurrent writers a
+    lower id can commit after a higher one was processed. Besides the watermark (last_id)
+    the cursor keeps the gaps below it, id ranges not visible when the stage passed them,
+    and processes their rows once they commit.
+    """
+
+    def __init__(self, source: str, last_id: int, gaps: list[tuple[int, int, datetime]]):
+        self.source = source
+        self.last_id = last_id
+        self.gaps = gaps    # (low_id, high_id, first_seen)
+
+    def pending(self, id_column, upper_id: int | None = None):
+        """ Filter of the source rows not processed yet, up to upper_id """
+        clause = or_(id_column > self.last_id, *(id_column.between(low, high) for low, high, _ in self.gaps))
+        if upper_id is not None:
+            clause = and_(clause, id_column <= upper_id)
+        return clause
+
+    def overlaps(self, low: int, high: int) -> bool:
+        return any(gap_low <= high and low <= gap_high for gap_low, gap_high, _ in self.gaps)
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def lock_cursors(db: Session, sources: list[str]) -> dict[str, IdCursor]:
+    """
+    Create the watermark rows if needed and lock them for the transaction.
+    The UPDATE comes first so it takes the row lock on Postgres and the write lock on
+    SQLite before anything is read, concurrent refreshers then run one after the other.
+    """
+    db.execute(
+        dialect_insert(db.get_bind(), RollupWatermark).on_conflict_do_nothing(index_elements=["source"]),
+        [{"source": source, "last_id": 0} for source in sources]
+    )
+    db.execute(
+        update(RollupWatermark).where(RollupWatermark.source.in_(sources)).values(updated_at=datetime.now(timezone.utc))
+    )
+    return read_cursors(db, sources)
+
+
+def read_cursors(db: Session, sources: list[str]) -> dict[str, IdCursor]:
+    """ Cursors of sources without locking them, e.g. to follow a stage run by someone else """
+    cursors = {source: IdCursor(source, 0, []) for source in sources}
+    # Watermarks before gaps: a stage committing in between only removes gaps at or below the
+    # watermark read, so the rows the cursor covers are processed in any case
+    for source, last_id in db.query(RollupWatermark.source, RollupWatermark.last_id).filter(RollupWatermark.source.in_(sources)):
+        cursors[source].last_id = last_id or 0
+    gaps = db.query(RollupGap.source, RollupGap.low_id, RollupGap.high_id, RollupGap.first_seen).filter(
+        RollupGap.source.in_(sources)
+    ).order_by(RollupGap.low_id)
+    for source, low, high, first_seen in gaps:
+        cursors[source].gaps.append((low, high, first_seen))
+    return cursors
+
+
+def _remaining_gaps(gaps: list[tuple[int, int, datetime]], ids: list[int]) -> list[tuple[int, int, datetime]]:
+    """ Parts of the gaps not covered by the sorted ids """
+    remaining = []
+    for low, high, first_seen in gaps:
+        start = low
+        for id_ in ids[bisect_left(ids, low):bisect_right(ids, high)]:
+            if id_ > start:
+                remaining.append((start, id_ - 1, first_seen))
+            start = id_ + 1
+        if start <= high:
+            remaining.append((start, high, first_seen))
+    return remaining
+
+
+def advance_cursor(db: Session, cursor: IdCursor, ids: list[int], hold: IdCursor | None = None):
+    """
+    Record a processed batch (sorted ids): the watermark moves to its last id and the ids it
+    skipped become gaps. Gaps older than config.rollup_gap_timeout are dropped, unless they
+    overlap a gap of hold, the upstream stage the batch was restricted to.
+    """
+    now = _utcnow()
+    last_id = max(cursor.last_id, ids[-1])
+    gaps = cursor.gaps + ([(cursor.last_id + 1, last_id, now)] if last_id > cursor.last_id else [])
+    expired = now - timedelta(seconds=config.rollup_gap_timeout)
+    gaps = [
+        (low, high, first_seen) for low, high, first_seen in _remaining_gaps(gaps, ids)
+        if first_seen >= expired or (hold is not None and hold.overlaps(low, high))
+    ]
+
+    db.query(RollupWatermark).filter(RollupWatermark.source == cursor.source).update({"last_id": last_id})
+    if gaps != cursor.gaps:
+        db.query(RollupGap).filter(RollupGap.source == cursor.source).delete()
+        if gaps:
+            db.execute(insert(RollupGap), [
+                {"source": cursor.source, "low_id": low, "high_id": high, "first_seen": first_seen}
+                for low, high, first_seen in gaps
+            ])
+    cursor.last_id, cursor.gaps = last_id, gaps
+
+
+def _increment(db: Session, counts: Counter, count_column: str):
+    if not counts:
+        return
+    statement = dialect_insert(db.get_bind(), ResultsRollup)
+    statement = statement.on_conflict_do_update(
+        index_elements=["experiment_id", "event_type", "variant_name", "bucket_start"],
+        set_={count_column: getattr(ResultsRollup, count_column) + getattr(statement.excluded, count_column)}
+    )
+    db.execute(statement, [
+        {
+            "experiment_id": experiment_id,
+            "variant_name": variant_name,
+            "event_type": event_type,
+            "bucket_start": bucket,
+            "conversion_count": count if count_column == "conversion_count" else 0,
+            "assignment_count": count if count_column == "assignment_count" else 0,
+        }
+        for (experiment_id, variant_name, event_type, bucket), count in counts.items()
+    ])
+
+
+def refresh_rollups(db: Session, batch_size: int = ROLLUP_BATCH_SIZE) -> dict[str, int]:
+    """
+    Fold the assignments and events inserted since the last refresh into results_rollups,
+    in one transaction together with the new watermarks.
+
+    Cursors follow insertion order (row ids, see IdCursor), not event time, so late events
+    with old timestamps are still counted into their own (old) bucket. Events are folded only once
+    the enrichment stage attributed them (services.attribution.attribute_new_events).
+    Returns the number of source rows folded per source.
+    """
+    try:
+        cursors = lock_cursors(db, [WATERMARK_EVENTS, WATERMARK_ASSIGNMENTS])
+        attributed = read_cursors(db, [WATERMARK_ATTRIBUTION])[WATERMARK_ATTRIBUTION]
+        folded = {WATERMARK_ASSIGNMENTS: 0, WATERMARK_EVENTS: 0}
+
+        # 1. Assignment counts (first, so events of users assigned in the same window match)
+        cursor = cursors[WATERMARK_ASSIGNMENTS]
+        rows = db.query(Assignment.id, Assignment.experiment_id, Assignment.variant_name, Assignment.assigned_at).filter(
+            cursor.pending(Assignment.id)
+        ).order_by(Assignment.id).limit(batch_size).all()
+        if rows:
+            counts = Counter(
+                (experiment_id, variant_name, ASSIGNMENT_ROLLUP_TYPE, bucket_start(assigned_at))
+                for _, experiment_id, variant_name, assigned_at in rows
+            )
+            _increment(db, counts, "assignment_count")
+            advance_cursor(db, cursor, [row[0] for row in rows])
+            folded[WATERMARK_ASSIGNMENTS] = len(rows)
+
+        # 2. Conversions, from the attributions of the new events already enriched. Events the
+        # enrichment stage has not processed yet (its own gaps) become gaps here until it has.
+        cursor = cursors[WATERMARK_EVENTS]
+        event_ids = [
+            event_id for event_id, in db.query(Event.id).filter(
+                cursor.pending(Event.id), not_(attributed.pending(Event.id))
+            ).order_by(Event.id).limit(batch_size)
+        ]
+        if event_ids:
+            # The enrichment cursor was read first: whatever it covers was committed before the
+            # batch query, and is part of the batch when in its range
+            rows = db.query(
+                EventAttribution.experiment_id,
+                EventAttribution.variant_name,
+                EventAttribution.event_type,
+                EventAttribution.timestamp
+            ).filter(
+                cursor.pending(EventAttribution.event_id, event_ids[-1]),
+                not_(attributed.pending(EventAttribution.event_id))
+            ).all()
+            counts = Counter(
+                (experiment_id, variant_name, event_type, bucket_start(timestamp))
+                for experiment_id, variant_name, event_type, timestamp in rows
+            )
+            _increment(db, counts, "conversion_count")
+            advance_cursor(db, cursor, event_ids, hold=attributed)
+            folded[WATERMARK_EVENTS] = len(event_ids)
+
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    logger.debug("refresh_rollups folded %s", folded)
+    return folded
+
+
+def refresh_rollups_until_current(db: Session, batch_size: int = ROLLUP_BATCH_SIZE) -> int:
+    """ Run refresh_rollups until every source row is folded, returns the number of batches """
+    batches = 0
+    while any(refresh_rollups(db, batch_size).values()):
+        batches += 1
+    return batches
+
+
+def rollup_assignment_counts_statement(experiment_id: int) -> Select:
+    """ (variant_name, total assignments) of an experiment """
+    return select(
+        ResultsRollup.variant_name,
+        func.sum(ResultsRollup.assignment_count)
+    ).where(
+        ResultsRollup.experiment_id == experiment_id,
+        ResultsRollup.event_type == ASSIGNMENT_ROLLUP_TYPE
+    ).group_by(ResultsRollup.variant_name)
+
+
+def rollup_conversion_counts_statement(experiment_id: int, event_type: str, start_datetime: datetime | None) -> Select:
+    """ (variant_name, conversions) of an experiment, since the bucket of start_datetime """
+    statement = select(
+        ResultsRollup.variant_name,
+        func.sum(ResultsRollup.conversion_count)
+    ).where(
+        ResultsRollup.experiment_id == experiment_id,
+        ResultsRollup.event_type == event_type
+    )
+    if start_datetime:
+        # Buckets are hourly, the start is rounded down to its bucket
+        statement = statement.where(ResultsRollup.bucket_start >= bucket_start(start_datetime))
+    return statement.group_by(ResultsRollup.variant_name)
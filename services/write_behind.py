@@ -0,0 +1,209 @@
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.orm import Session
+from data.database import Assignment, SessionLocal, dialect_insert
+from typing import Any, Callable
+from config import config
+import os
+import queue
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Supported values for config.assignment_write_mode
+ASSIGNMENT_WRITE_MODE_SYNC = "sync"                  # commit before responding
+ASSIGNMENT_WRITE_MODE_WRITE_BEHIND = "write_behind"  # respond from the cache, persist in background
+
+# Maximum rows kept while the database is unavailable, the oldest rows are dropped after that
+MAX_PENDING_ROWS = 100000
+
+
+class AssignmentWriteBehind:
+    """
+    Background persistence of new assignments.
+
+    Assignments are queued in memory and a flusher thread writes them every
+    flush_interval_ms (or as soon as max_rows are queued) with one bulk
+    INSERT ... ON CONFLICT (experiment_id, user_id) DO NOTHING.
+    A flush failed by a connection error keeps its rows and is retried on the next interval.
+    A chunk failed by bad data (e.g. the experiment was deleted) is written again row by
+    row, the rows that still fail are logged and dropped instead of blocking the queue.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal, flush_interval_ms: float = 200, max_rows: int = 1000):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_rows = max_rows
+        self._queue: queue.Queue[tuple[float, dict[str, Any]]] = queue.Queue()
+        self._retry: list[tuple[float, dict[str, Any]]] = []
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._flusher: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+
+        # Stats
+        self.flushed_total = 0
+        self.dropped_total = 0
+        self.rejected_total = 0
+        self.failed_flushes = 0
+        self.last_flush_at: float | None = None
+        self.last_flush_lag: float = 0.0
+
+    def enqueue(self, assignment: Assignment):
+        """Queue a new assignment for persistence, never blocks on the database."""
+        self.enqueue_many([assignment])
+
+    def enqueue_many(self, assignments: list[Assignment]):
+        """Queue many new assignments at once, see enqueue."""
+        if not assignments:
+            return
+        self._ensure_flusher()
+        queued_at = time.monotonic()
+        for assignment in assignments:
+            self._queue.put((queued_at, {
+                "experiment_id": assignment.experiment_id,
+                "user_id": assignment.user_id,
+                "variant_name": assignment.variant_name,
+                "assigned_at": assignment.assigned_at,
+            }))
+        if self._queue.qsize() >= self.max_rows:
+            self._wakeup.set()
+
+    def _ensure_flusher(self):
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._start_lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._stop.clear()
+                self._flusher = threading.Thread(target=self._run, name="assignment-write-behind", daemon=True)
+                self._flusher.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Assignment write-behind flush failed, %d rows pending.", self.depth)
+
+    def flush(self) -> int:
+        """Persist everything queued so far, returns the number of rows written."""
+        with self._flush_lock:
+            pending, self._retry = self._retry, []
+            while True:
+                try:
+                    pending.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not pending:
+                return 0
+
+            written = 0
+            try:
+                for start in range(0, len(pending), self.max_rows):
+                    chunk = pending[start:start + self.max_rows]
+                    self._write([row for _, row in chunk])
+                    written += len(chunk)
+            except Exception:
+                self.failed_flushes += 1
+                self._retry = pending[written:]
+                if len(self._retry) > MAX_PENDING_ROWS:
+                    dropped = len(self._retry) - MAX_PENDING_ROWS
+                    self._retry = self._retry[dropped:]
+                    self.dropped_total += dropped
+                    logger.error("Assignment write-behind dropped %d rows, database unavailable.", dropped)
+                raise
+            finally:
+                self.flushed_total += written
+                if written:
+                    now = time.monotonic()
+                    self.last_flush_at = now
+                    self.last_flush_lag = now - pending[0][0]
+
+            logger.debug("Assignment write-behind flushed %d rows, lag %.3fs.", written, self.last_flush_lag)
+            return written
+
+    def _write(self, rows: list[dict[str, Any]]):
+        db = self.session_factory()
+        try:
+            statement = dialect_insert(db.get_bind(), Assignment).on_conflict_do_nothing(
+                index_elements=["experiment_id", "user_id"]
+            )
+            try:
+                db.execute(statement, rows)
+                db.commit()
+                return
+            except (OperationalError, InterfaceError):
+                db.rollback()
+                raise
+            except Exception as exc:
+                db.rollback()
+                logger.warning("Assignment write-behind insert of %d rows failed (%s), retrying row by row.", len(rows), exc)
+
+            for row in rows:
+                try:
+                    with db.begin_nested():
+                        db.execute(statement, [row])
+                except (OperationalError, InterfaceError):
+                    raise
+                except Exception as exc:
+                    logger.error("Assignment write-behind rejected %s: %s", row, exc)
+                    self.rejected_total += 1
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() + len(self._retry)
+
+    def stats(self) -> dict[str, Any]:
+        oldest_age = 0.0
+        if self._retry:
+            oldest_age = time.monotonic() - self._retry[0][0]
+        elif self._queue.qsize():
+            with self._queue.mutex:
+                if self._queue.queue:
+                    oldest_age = time.monotonic() - self._queue.queue[0][0]
+        return {
+            "queue_depth": self.depth,
+            "oldest_pending_seconds": round(oldest_age, 3),
+            "last_flush_lag_seconds": round(self.last_flush_lag, 3),
+            "seconds_since_last_flush": round(time.monotonic() - self.last_flush_at, 3) if self.last_flush_at else None,
+            "flushed_total": self.flushed_total,
+            "dropped_total": self.dropped_total,
+            "rejected_total": self.rejected_total,
+            "failed_flushes": self.failed_flushes,
+        }
+
+    def close(self, timeout: float = 5.0):
+        """Stop the flusher and drain what is left, called on shutdown."""
+        self._stop.set()
+        if self._flusher is not None:
+            self._wakeup.set()
+            self._flusher.join(timeout)
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Assignment write-behind could not drain %d rows on shutdown.", self.depth)
+
+
+_writer: AssignmentWriteBehind | None = None
+_writer_pid: int | None = None
+
+def get_assignment_writer() -> AssignmentWriteBehind:
+    """Per-process writer, recreated after a fork so every worker owns its flusher thread."""
+    global _writer, _writer_pid
+    if _writer is None or _writer_pid != os.getpid():
+        _writer = AssignmentWriteBehind(
+            flush_interval_ms=config.assignment_flush_interval_ms,
+            max_rows=config.assignment_flush_max_rows
+        )
+        _writer_pid = os.getpid()
+    return _writer
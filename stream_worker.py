@@ -0,0 +1,56 @@
+"""
+Event stream worker for EVENT_TRANSPORT=stream: drains the Valkey events stream into
+the events table in blocks, then attributes the new events and refreshes the rollups.
+
+    uv run python stream_worker.py
+    uv run python stream_worker.py --count 1000 --consumer worker-1
+
+Run as many as needed, they share the EVENT_STREAM_NAME stream through one consumer
+group. Give each a stable --consumer name so a restarted worker finds its own
+pending entries, entries of a worker that never comes back are reclaimed by the
+others after EVENT_STREAM_CLAIM_IDLE_MS.
+"""
+import argparse
+import logging
+import signal
+import threading
+
+from config import config
+from celery_tasks.event_tasks import maybe_refresh_rollups
+from services.event_stream import EVENT_STREAM_GROUP, EventStreamConsumer, get_stream_client
+
+logger = logging.getLogger(__name__)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Insert the events of the Valkey events stream into the database.")
+    parser.add_argument("--stream", default=config.event_stream_name, help="Defaults to EVENT_STREAM_NAME.")
+    parser.add_argument("--group", default=EVENT_STREAM_GROUP, help="Consumer group (default: %(default)s).")
+    parser.add_argument("--consumer", help="Consumer name, defaults to hostname-pid.")
+    parser.add_argument("--count", type=int, default=config.event_stream_read_count, help="Entries per read and insert (default: %(default)s).")
+    parser.add_argument("--block-ms", type=int, default=config.event_stream_block_ms, help="Longest wait for new entries (default: %(default)s).")
+    parser.add_argument("--claim-idle-ms", type=int, default=config.event_stream_claim_idle_ms, help="Reclaim entries pending this long at other consumers (default: %(default)s).")
+    args = parser.parse_args(argv)
+
+    consumer = EventStreamConsumer(
+        get_stream_client(),
+        args.stream,
+        group=args.group,
+        consumer=args.consumer,
+        count=args.count,
+        block_ms=args.block_ms,
+        claim_idle_ms=args.claim_idle_ms,
+        after_write=maybe_refresh_rollups
+    )
+
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+
+    # A block being inserted when the signal arrives is finished and acknowledged first
+    consumer.run(stop)
+    logger.info("Event stream worker stopped: %s", consumer.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+from datetime import datetime
+from sqlalchemy import event
+
+from data.database import Assignment
+from services.assignment import insert_assignments
+from tests.conftest import engine
+
+
+class StatementCounter:
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement.split()[0].upper())
+
+
+def test_new_users_cost_one_statement(db_session):
+    counter = StatementCounter()
+    event.listen(engine, "before_cursor_execute", counter)
+    try:
+        stored = insert_assignments(db_session, [
+            Assignment(experiment_id=616161, user_id=f"ins_user_{i}", variant_name="A") for i in range(3)
+        ])
+    finally:
+        event.remove(engine, "before_cursor_execute", counter)
+
+    assert counter.statements == ["INSERT"]
+    assert sorted(stored) == [(616161, f"ins_user_{i}") for i in range(3)]
+    assert all(a.id and a.assigned_at for a in stored.values())
+
+
+def test_concurrently_assigned_users_keep_their_variant(db_session):
+    db_session.add(Assignment(experiment_id=626262, user_id="ins_winner", variant_name="B", assigned_at=datetime(2025, 1, 1)))
+    db_session.commit()
+
+    stored = insert_assignments(db_session, [
+        Assignment(experiment_id=626262, user_id="ins_winner", variant_name="A"),
+        Assignment(experiment_id=626262, user_id="ins_other", variant_name="A"),
+    ])
+
+    assert stored[(626262, "ins_winner")].variant_name == "B"
+    assert stored[(626262, "ins_other")].variant_name == "A"
+    assert db_session.query(Assignment).filter(Assignment.experiment_id == 626262).count() == 2
@@ -0,0 +1,78 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from config import config
+from data import async_database
+from data.async_database import async_database_url
+from services.attribution import lookup_assignments
+from services.bloom import BLOOM_VALKEY, AssignmentBloom
+from services.cache import _MockValkeyBackend, get_mock_cache_client
+
+
+def test_async_database_url():
+    assert async_database_url("postgresql://user:pw@host:5432/db") == "postgresql+asyncpg://user:pw@host:5432/db"
+    assert async_database_url("sqlite:///./test.db") == "sqlite+aiosqlite:///./test.db"
+    assert async_database_url("postgresql+asyncpg://host/db") == "postgresql+asyncpg://host/db"
+
+
+@pytest.fixture
+def async_client(monkeypatch):
+    # The async path needs the asyncio extra of SQLAlchemy and aiosqlite
+    pytest.importorskip("greenlet")
+    pytest.importorskip("aiosqlite")
+    from api.async_routes import async_experiment_router, async_events_router
+    from tests.conftest import SQLALCHEMY_DATABASE_URL
+
+    monkeypatch.setattr(config, "async_database_url", async_database_url(SQLALCHEMY_DATABASE_URL))
+    app = FastAPI()
+    app.include_router(async_experiment_router)
+    app.include_router(async_events_router)
+    with TestClient(app) as client:
+        yield client
+    asyncio.run(async_database.dispose_async_engine())
+
+
+def test_async_experiment_assignment_and_results(async_client):
+    headers = {"Authorization": "Bearer fake-client-token"}
+    payload = {"name": "async_flow", "variants": [{"name": "A", "allocation_percent": 100}]}
+    response = async_client.post("/experiments", json=payload, headers=headers)
+    assert response.status_code == 201
+    experiment_id = response.json()["id"]
+
+    first = async_client.get(f"/experiments/{experiment_id}/assignment/async_user", headers=headers)
+    assert first.status_code == 200
+    assert first.json()["variant_name"] == "A"
+    again = async_client.get(f"/experiments/{experiment_id}/assignment/async_user", headers=headers)
+    assert again.json()["variant_name"] == "A"
+
+    results = async_client.get(f"/experiments/{experiment_id}/results?raw=true", headers=headers)
+    assert results.status_code == 200
+    assert results.json()["variant_data"]["A"]["total_assignments"] == 1
+
+    missing = async_client.get("/experiments/999999/assignment/async_user", headers=headers)
+    assert missing.status_code == 404
+
+
+@patch("services.bloom.BLOOM_BUILD_DELAY", 0)
+def test_async_assignment_is_added_to_the_shared_bloom_filter(async_client, db_session):
+    headers = {"Authorization": "Bearer fake-client-token"}
+    payload = {"name": "async_bloom", "variants": [{"name": "A", "allocation_percent": 100}]}
+    experiment_id = async_client.post("/experiments", json=payload, headers=headers).json()["id"]
+    bloom = AssignmentBloom(_MockValkeyBackend(), mode=BLOOM_VALKEY, capacity=1000, error_rate=0.001)
+    bloom.rebuild(db_session, experiment_id)
+
+    with patch("services.async_assignment.get_assignment_bloom", return_value=bloom), \
+            patch("services.assignment.get_assignment_bloom", return_value=bloom), \
+            patch("services.attribution.get_assignment_bloom", return_value=bloom):
+        response = async_client.get(f"/experiments/{experiment_id}/assignment/async_bloom_user", headers=headers)
+        assert response.status_code == 200
+
+        # Another worker's attribution: nothing cached, only the shared filter and the database
+        pairs = [(experiment_id, "async_bloom_user"), (experiment_id, "async_bloom_visitor")]
+        found = lookup_assignments(db_session, get_mock_cache_client(), pairs)
+
+    assert list(found) == [(experiment_id, "async_bloom_user")]
+    assert found[(experiment_id, "async_bloom_user")].variant_name == "A"
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta, timezone
+
+from data.database import Assignment, Event, EventAttribution, Experiment
+from services.attribution import attribute_new_events, attribute_new_events_until_current
+from services.cache import get_mock_cache_client
+
+
+def make_experiment(db, name, created_at=datetime(2024, 1, 1), is_active=True):
+    experiment = Experiment(name=name, created_at=created_at, is_active=is_active)
+    db.add(experiment)
+    db.commit()
+    return experiment
+
+
+def attributions(db, experiment_id):
+    return db.query(EventAttribution).filter(EventAttribution.experiment_id == experiment_id).order_by(EventAttribution.event_id).all()
+
+
+def test_events_are_attributed_after_assignment_within_window(db_session):
+    cache = get_mock_cache_client()
+    attribute_new_events_until_current(db_session, cache)
+
+    experiment = make_experiment(db_session, "attr_window", created_at=datetime(2025, 5, 1))
+    inactive = make_experiment(db_session, "attr_inactive", is_active=False)
+    assigned_at = datetime(2025, 5, 2, 12, 0)
+    db_session.add_all([
+        Assignment(experiment_id=experiment.id, user_id="attr_u1", variant_name="B", assigned_at=assigned_at),
+        Assignment(experiment_id=inactive.id, user_id="attr_u1", variant_name="A", assigned_at=assigned_at),
+    ])
+    after = Event(user_id="attr_u1", type="purchase", timestamp=assigned_at + timedelta(minutes=1))
+    before = Event(user_id="attr_u1", type="purchase", timestamp=assigned_at - timedelta(minutes=1))
+    unassigned = Event(user_id="attr_u2", type="purchase", timestamp=assigned_at + timedelta(minutes=1))
+    db_session.add_all([after, before, unassigned])
+    db_session.commit()
+
+    assert attribute_new_events(db_session, cache) == 3
+
+    rows = attributions(db_session, experiment.id)
+    assert [(r.event_id, r.variant_name, r.event_type) for r in rows] == [(after.id, "B", "purchase")]
+    assert attributions(db_session, inactive.id) == []
+
+    # Already processed: nothing is attributed twice
+    assert attribute_new_events(db_session, cache) == 0
+    assert len(attributions(db_session, experiment.id)) == 1
+
+
+def test_cached_assignment_not_yet_persisted_is_used(db_session):
+    cache = get_mock_cache_client()
+    attribute_new_events_until_current(db_session, cache)
+
+    experiment = make_experiment(db_session, "attr_cache")
+    # e.g. still queued by the write-behind flusher
+    cache.set_assignment(Assignment(
+        experiment_id=experiment.id, user_id="attr_cached", variant_name="A",
+        assigned_at=datetime(2025, 6, 1, tzinfo=timezone.utc)
+    ))
+    event = Event(user_id="attr_cached", type="click", timestamp=datetime(2025, 6, 2))
+    db_session.add(event)
+    db_session.commit()
+
+    attribute_new_events_until_current(db_session, cache)
+
+    rows = attributions(db_session, experiment.id)
+    assert [(r.event_id, r.variant_name) for r in rows] == [(event.id, "A")]
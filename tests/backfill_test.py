@@ -0,0 +1,41 @@
+import json
+from sqlalchemy import func
+
+import backfill
+from data.database import Assignment, Event
+from tests.conftest import SQLALCHEMY_DATABASE_URL
+
+
+def write_ndjson(path, rows):
+    path.write_text("".join(json.dumps(row) + "\n" if isinstance(row, dict) else row for row in rows))
+    return str(path)
+
+
+def test_backfill_events(tmp_path, db_session):
+    rows = [{"user_id": f"bf_user_{i}", "type": "purchase", "timestamp": "2024-01-01T00:00:00", "properties": {"i": i}} for i in range(25)]
+    rows.insert(3, "not json\n")
+    rows.insert(7, {"user_id": "bf_no_type"})
+    rows.insert(12, {"user_id": "bf_no_timestamp", "type": "purchase"})
+
+    stats = backfill.backfill("events", write_ndjson(tmp_path / "events.ndjson", rows), SQLALCHEMY_DATABASE_URL, chunk_size=10, workers=2)
+
+    assert stats["loaded"] == 25
+    assert stats["rejected"] == 3
+    assert db_session.query(func.count(Event.id)).filter(Event.user_id.like("bf_user_%")).scalar() == 25
+    stored = db_session.query(Event).filter(Event.user_id == "bf_user_4").one()
+    assert json.loads(stored.properties_json) == {"i": 4}
+
+
+def test_backfill_assignments_skips_duplicates(tmp_path, db_session):
+    rows = [{"experiment_id": 424242, "user_id": f"bf_asn_{i % 5}", "variant_name": "A", "assigned_at": "2024-01-01T00:00:00"} for i in range(10)]
+
+    stats = backfill.backfill("assignments", write_ndjson(tmp_path / "assignments.ndjson", rows), SQLALCHEMY_DATABASE_URL, chunk_size=4, workers=1)
+
+    assert stats["loaded"] == 5
+    assert db_session.query(func.count(Assignment.id)).filter(Assignment.experiment_id == 424242).scalar() == 5
+
+
+def test_to_csv_keeps_nulls_and_empty_strings():
+    buffer = backfill._to_csv([("u1", "", None)])
+
+    assert buffer.read() == '"u1","",\n'
@@ -0,0 +1,81 @@
+import anyio
+import pytest
+import time
+from fastapi import status
+from unittest.mock import patch
+
+from services.backpressure import IngestionAdmission, IngestionOverloaded
+
+headers = {"Authorization": "Bearer fake-client-token"}
+
+
+def test_sheds_above_queue_depth():
+    depth = {"value": 50}
+    admission = IngestionAdmission(max_queue_depth=100, retry_after=7, depth_reader=lambda: depth["value"])
+    admission.sample_queue_depth()
+    admission.check()
+
+    depth["value"] = 500
+    admission.sample_queue_depth()
+    with pytest.raises(IngestionOverloaded) as overloaded:
+        admission.check()
+    assert overloaded.value.reason == "queue_depth"
+    assert overloaded.value.retry_after == 7
+    assert admission.stats()["shed_total"] == {"queue_depth": 1}
+
+
+def test_unreadable_queue_depth_admits():
+    def broken_reader():
+        raise ConnectionError("broker is down")
+
+    admission = IngestionAdmission(max_queue_depth=100, depth_reader=broken_reader)
+    admission.sample_queue_depth()
+    admission.check()
+    assert admission.stats()["depth_read_failures"] >= 1
+
+
+def test_sheds_on_slow_publishes_until_they_expire():
+    admission = IngestionAdmission(max_publish_latency_ms=100, retry_after=5)
+    admission.publish_latency = 2.0
+    admission.last_publish_at = time.monotonic()
+    with pytest.raises(IngestionOverloaded) as overloaded:
+        admission.check()
+    assert overloaded.value.reason == "publish_latency"
+
+    # Nothing was published for retry_after seconds, let one through to probe the broker
+    admission.last_publish_at = time.monotonic() - 6
+    admission.check()
+
+
+def test_publishes_run_on_the_ingestion_limiter():
+    admission = IngestionAdmission(max_concurrency=1)
+
+    def publish():
+        # The only ingestion thread is busy: further events are shed instead of queued
+        with pytest.raises(IngestionOverloaded):
+            admission.check()
+        return "published"
+
+    assert anyio.run(admission.run, publish) == "published"
+    admission.check()
+    assert admission.stats()["publishes_in_flight"] == 0
+
+
+@patch("api.events_routes.insert_events_to_db.delay")
+@patch("api.events_routes.insert_event_to_db.delay")
+def test_record_event_overloaded(mock_delay, mock_batch_delay, client):
+    admission = IngestionAdmission(max_queue_depth=10, retry_after=7, depth_reader=lambda: 11)
+    admission.sample_queue_depth()
+    event = {"user_id": "user1", "type": "purchase"}
+
+    with patch("api.events_routes.get_ingestion_admission", return_value=admission):
+        response = client.post("/events", json=event, headers=headers)
+        assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+        assert response.headers["Retry-After"] == "7"
+
+        response = client.post("/events/batch", json=[event], headers=headers)
+        assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+        assert response.headers["Retry-After"] == "7"
+
+    mock_delay.assert_not_called()
+    mock_batch_delay.assert_not_called()
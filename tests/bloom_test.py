@@ -0,0 +1,130 @@
+import threading
+from datetime import datetime
+from unittest.mock import patch
+
+import backfill
+from data.database import Assignment, Experiment, Variant
+from services.assignment import get_or_create_assignment
+from services.attribution import lookup_assignments
+from services import bloom as bloom_module
+from services.bloom import BLOOM_LOCAL, BLOOM_VALKEY, AssignmentBloom
+from services.cache import _MockValkeyBackend, get_mock_cache_client
+from tests.conftest import SQLALCHEMY_DATABASE_URL
+
+
+def make_experiment(db, name):
+    experiment = Experiment(name=name, created_at=datetime(2024, 1, 1), is_active=True)
+    experiment.variants = [Variant(name="A", allocation_percent=50), Variant(name="B", allocation_percent=50)]
+    db.add(experiment)
+    db.commit()
+    return experiment
+
+
+def assign_directly(db, experiment_id, user_id, variant_name="B"):
+    # e.g. by another worker, invisible to this process' filter and cache
+    db.add(Assignment(experiment_id=experiment_id, user_id=user_id, variant_name=variant_name, assigned_at=datetime(2025, 1, 1)))
+    db.commit()
+
+
+def build_local(bloom, db, experiment_id):
+    # The first lookup starts the build in the background and reads the database
+    assert bloom.unassigned(db, [(experiment_id, "bloom_probe")]) == set()
+    bloom._builds[experiment_id].join(5)
+
+
+def test_local_filter_skips_the_read_of_new_users(db_session):
+    experiment = make_experiment(db_session, "bloom_local")
+    assign_directly(db_session, experiment.id, "bloom_old")
+    bloom = AssignmentBloom(_MockValkeyBackend(), mode=BLOOM_LOCAL, capacity=1000, error_rate=0.001)
+    build_local(bloom, db_session, experiment.id)
+
+    with patch("services.assignment.get_assignment_bloom", return_value=bloom):
+        new = get_or_create_assignment(db_session, get_mock_cache_client(), experiment.id, "bloom_new")
+        assert new.id is not None
+        assert bloom.skipped_reads == 1
+
+        existing = get_or_create_assignment(db_session, get_mock_cache_client(), experiment.id, "bloom_old")
+        assert existing.variant_name == "B"
+        assert bloom.skipped_reads == 1
+
+
+def test_assignment_missing_from_local_filter_is_caught_by_the_unique_constraint(db_session):
+    experiment = make_experiment(db_session, "bloom_race")
+    bloom = AssignmentBloom(_MockValkeyBackend(), mode=BLOOM_LOCAL, capacity=1000, error_rate=0.001)
+
+    with patch("services.assignment.get_assignment_bloom", return_value=bloom):
+        get_or_create_assignment(db_session, get_mock_cache_client(), experiment.id, "bloom_first")
+        bloom._builds[experiment.id].join(5)
+        assign_directly(db_session, experiment.id, "bloom_elsewhere", variant_name="A")
+
+        assignment = get_or_create_assignment(db_session, get_mock_cache_client(), experiment.id, "bloom_elsewhere")
+
+    assert (assignment.variant_name, assignment.assigned_at) == ("A", datetime(2025, 1, 1))
+    assert db_session.query(Assignment).filter(Assignment.user_id == "bloom_elsewhere").count() == 1
+
+
+def test_local_filter_is_built_off_the_request_thread(db_session):
+    experiment = make_experiment(db_session, "bloom_slow_build")
+    bloom = AssignmentBloom(_MockValkeyBackend(), mode=BLOOM_LOCAL, capacity=1000, error_rate=0.001)
+    scanning, release = threading.Event(), threading.Event()
+    assigned_user_ids = bloom_module._assigned_user_ids
+
+    def slow_scan(db, experiment_id):
+        scanning.set()
+        release.wait(5)
+        yield from assigned_user_ids(db, experiment_id)
+
+    with patch("services.bloom._assigned_user_ids", slow_scan):
+        pairs = [(experiment.id, "bloom_during_build")]
+        assert bloom.unassigned(db_session, pairs) == set()
+        assert scanning.wait(5)
+        # Lookups don't wait for the scan, they read the database until the filter is ready
+        assert bloom.unassigned(db_session, pairs) == set()
+        # Assignments made during the scan are kept
+        bloom.add([(experiment.id, "bloom_assigned_meanwhile")])
+        release.set()
+        bloom._builds[experiment.id].join(5)
+
+    pairs = [(experiment.id, "bloom_assigned_meanwhile"), (experiment.id, "bloom_during_build")]
+    assert bloom.unassigned(db_session, pairs) == {(experiment.id, "bloom_during_build")}
+
+
+def test_valkey_filter_on_the_mock_backend_is_not_shared():
+    assert AssignmentBloom(_MockValkeyBackend(), mode=BLOOM_VALKEY).shared
+    with patch.object(bloom_module, "_bloom", None), \
+            patch.object(bloom_module, "VALKEY_BACKEND", _MockValkeyBackend()), \
+            patch.object(bloom_module.config, "assignment_bloom", BLOOM_VALKEY):
+        bloom = bloom_module.get_assignment_bloom()
+        assert bloom.enabled and not bloom.shared
+
+
+@patch("services.bloom.BLOOM_BUILD_DELAY", 0)
+def test_rebuild_tool_adds_backfilled_users(db_session):
+    experiment = make_experiment(db_session, "bloom_rebuild")
+    backend = _MockValkeyBackend()
+    bloom = AssignmentBloom(backend, mode=BLOOM_VALKEY, capacity=1000, error_rate=0.001)
+    # Built in the background on first use, from the request's database
+    assert bloom.unassigned(db_session, [(experiment.id, "bloom_loaded")]) == set()
+    bloom._builds[experiment.id].join(5)
+    assert bloom.unassigned(db_session, [(experiment.id, "bloom_loaded")]) == {(experiment.id, "bloom_loaded")}
+
+    assign_directly(db_session, experiment.id, "bloom_loaded")
+    assert backfill.rebuild_bloom(SQLALCHEMY_DATABASE_URL, [experiment.id], bloom=bloom) == {experiment.id: 1}
+    assert backfill.rebuild_bloom(SQLALCHEMY_DATABASE_URL, [experiment.id], reset=True, bloom=bloom) == {experiment.id: 1}
+
+    other_worker = AssignmentBloom(backend, mode=BLOOM_VALKEY, capacity=1000, error_rate=0.001)
+    pairs = [(experiment.id, "bloom_loaded"), (experiment.id, "bloom_never")]
+    assert other_worker.unassigned(db_session, pairs) == {(experiment.id, "bloom_never")}
+
+
+def test_attribution_caches_unassigned_users(db_session):
+    experiment = make_experiment(db_session, "bloom_negative")
+    cache = get_mock_cache_client()
+    pairs = [(experiment.id, "bloom_visitor")]
+
+    assert lookup_assignments(db_session, cache, pairs) == {}
+    assert cache.get_many_unassigned(pairs) == set(pairs)
+
+    with patch("services.attribution.get_existing_assignments") as get_existing_assignments:
+        assert lookup_assignments(db_session, cache, pairs) == {}
+    get_existing_assignments.assert_not_called()
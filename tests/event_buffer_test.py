@@ -0,0 +1,94 @@
+import threading
+from fastapi import status
+from unittest.mock import patch
+
+from config import config
+from services.event_buffer import EventPublishBuffer
+
+headers = {"Authorization": "Bearer fake-client-token"}
+
+
+def payload(user_id):
+    return {"user_id": user_id, "type": "click", "timestamp": "2025-12-08T21:00:00+00:00", "properties_json": "{}"}
+
+
+def test_flush_publishes_batched_messages():
+    messages = []
+    buffer = EventPublishBuffer(publish=messages.append, max_events=2, max_wait_ms=60000)
+    for i in range(5):
+        assert buffer.add(payload(f"buffered_{i}"))
+
+    assert buffer.flush() == 5
+    assert [len(message) for message in messages] == [2, 2, 1]
+    assert [event["user_id"] for message in messages for event in message] == [f"buffered_{i}" for i in range(5)]
+    assert buffer.stats()["depth"] == 0
+    assert buffer.stats()["messages_total"] == 3
+    buffer.close()
+
+
+def test_failed_publish_keeps_events_and_full_buffer_refuses():
+    messages = []
+    def broken_publish(message):
+        raise ConnectionError("broker is down")
+
+    buffer = EventPublishBuffer(publish=broken_publish, max_events=10, max_wait_ms=60000, max_pending=2)
+    assert buffer.add(payload("buffered_retry_0"))
+    assert buffer.add(payload("buffered_retry_1"))
+    try:
+        buffer.flush()
+    except ConnectionError:
+        pass
+    assert buffer.stats()["failed_flushes"] == 1
+    # Still waiting for the broker, the buffer is full
+    assert not buffer.add(payload("buffered_retry_2"))
+    assert buffer.stats()["refused_total"] == 1
+
+    # Broker is back, drained on shutdown
+    buffer.publish = messages.append
+    buffer.close()
+    assert [event["user_id"] for event in messages[0]] == ["buffered_retry_0", "buffered_retry_1"]
+
+
+def test_events_being_published_count_against_max_pending():
+    publishing = threading.Event()
+    release = threading.Event()
+    def stuck_publish(message):
+        # A broker outage: the publish hangs in the retry policy, then fails
+        publishing.set()
+        release.wait(5)
+        raise ConnectionError("broker is down")
+
+    buffer = EventPublishBuffer(publish=stuck_publish, max_events=10, max_wait_ms=1, max_pending=100)
+    accepted = sum(buffer.add(payload(f"buffered_stuck_{i}")) for i in range(100))
+    assert publishing.wait(5)
+    # The flusher took the events out of the queue, they still fill the buffer
+    assert buffer.depth == 100
+    assert not any(buffer.add(payload(f"buffered_stuck_more_{i}")) for i in range(1000))
+    assert accepted == 100
+    assert buffer.stats()["refused_total"] == 1000
+
+    buffer.publish = lambda message: None
+    release.set()
+    buffer.close()
+    assert buffer.depth == 0
+    assert buffer.published_total == 100
+
+
+def test_record_event_buffered(client):
+    messages = []
+    buffer = EventPublishBuffer(publish=messages.append, max_events=100, max_wait_ms=60000)
+    event = {"user_id": "user1", "type": "purchase", "timestamp": "2025-12-08T21:00:00Z"}
+
+    with patch.object(config, "event_buffer", True), \
+         patch("api.events_routes.get_event_buffer", return_value=buffer), \
+         patch("api.events_routes.insert_event_to_db.delay") as mock_delay:
+        for _ in range(3):
+            response = client.post("/events", json=event, headers=headers)
+            assert response.status_code == status.HTTP_202_ACCEPTED
+            assert response.json() == {"status": "accepted"}
+
+    # Answered before anything reached the broker
+    mock_delay.assert_not_called()
+    assert messages == []
+    buffer.close()
+    assert len(messages) == 1 and len(messages[0]) == 3
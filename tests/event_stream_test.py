@@ -0,0 +1,194 @@
+import json
+import pytest
+import redis
+from fastapi import status
+from unittest.mock import patch
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+
+from config import config
+from data.database import Event
+from services.event_stream import EVENT_STREAM_FIELD, EventStreamConsumer, EventStreamProducer
+from tests.conftest import TestingSessionLocal
+
+headers = {"Authorization": "Bearer fake-client-token"}
+
+
+class FakeStreamClient:
+    """In-memory stand-in for the stream commands used, one stream and its consumer groups."""
+
+    def __init__(self):
+        self.entries: list[tuple[str, dict[str, str]]] = []
+        self.groups: dict[str, dict] = {}
+        self.sequence = 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def xadd(self, name, fields, maxlen=None, approximate=True):
+        self.sequence += 1
+        entry_id = f"{self.sequence}-0"
+        self.entries.append((entry_id, dict(fields)))
+        if maxlen and len(self.entries) > maxlen:
+            del self.entries[:len(self.entries) - maxlen]
+        return entry_id
+
+    def xgroup_create(self, name, groupname, id="0", mkstream=False):
+        if groupname in self.groups:
+            raise redis.ResponseError("BUSYGROUP Consumer Group name already exists")
+        self.groups[groupname] = {"last": 0, "pending": {}}
+
+    def xreadgroup(self, groupname, consumername, streams, count=None, block=None):
+        group = self.groups[groupname]
+        (name, read_id), = streams.items()
+        if read_id == ">":
+            entries = [entry for entry in self.entries if int(entry[0].split("-")[0]) > group["last"]][:count]
+            for entry_id, _ in entries:
+                group["pending"][entry_id] = consumername
+                group["last"] = int(entry_id.split("-")[0])
+        else:
+            entry_ids = [entry_id for entry_id, owner in group["pending"].items() if owner == consumername][:count]
+            entries = [(entry_id, self._fields(entry_id)) for entry_id in entry_ids]
+        return [[name, entries]] if entries else []
+
+    def xack(self, name, groupname, *ids):
+        pending = self.groups[groupname]["pending"]
+        return sum(pending.pop(entry_id, None) is not None for entry_id in ids)
+
+    def xautoclaim(self, name, groupname, consumername, min_idle_time, start_id="0-0", count=None):
+        # Idle times are not tracked: every entry pending at another consumer is claimable
+        pending = self.groups[groupname]["pending"]
+        entry_ids = [entry_id for entry_id, owner in pending.items() if owner != consumername][:count]
+        for entry_id in entry_ids:
+            pending[entry_id] = consumername
+        return ["0-0", [(entry_id, self._fields(entry_id)) for entry_id in entry_ids], []]
+
+    def xlen(self, name):
+        return len(self.entries)
+
+    def xpending(self, name, groupname):
+        if groupname not in self.groups:
+            raise redis.ResponseError("NOGROUP No such key or consumer group")
+        return {"pending": len(self.groups[groupname]["pending"])}
+
+    def _fields(self, entry_id):
+        return next((fields for candidate, fields in self.entries if candidate == entry_id), None)
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def xadd(self, *args, **kwargs):
+        self.commands.append((args, kwargs))
+
+    def execute(self):
+        return [self.client.xadd(*args, **kwargs) for args, kwargs in self.commands]
+
+
+def payload(user_id, event_type="purchase"):
+    return {"user_id": user_id, "type": event_type, "timestamp": "2025-12-08T21:00:00+00:00", "properties_json": "{}"}
+
+
+def broken_session():
+    raise OperationalError("SELECT 1", {}, Exception("database is down"))
+
+
+def count_events(db_session, prefix):
+    return db_session.query(func.count(Event.id)).filter(Event.user_id.like(f"{prefix}%")).scalar()
+
+
+@pytest.fixture
+def stream_client():
+    return FakeStreamClient()
+
+
+def make_consumer(client, consumer="w1", session_factory=TestingSessionLocal):
+    consumer = EventStreamConsumer(client, "events", consumer=consumer, session_factory=session_factory, count=500)
+    consumer.ensure_group()
+    return consumer
+
+
+def test_consumer_bulk_inserts_and_acknowledges(db_session, stream_client):
+    producer = EventStreamProducer(stream_client, "events", maxlen=1000)
+    consumer = make_consumer(stream_client)
+    # A second worker starting up finds the group already there
+    make_consumer(stream_client, consumer="w2")
+
+    producer.publish([payload(f"stream_user_{i}") for i in range(3)])
+    # Poison entries are acknowledged, retrying them would fail forever
+    stream_client.xadd("events", {EVENT_STREAM_FIELD: "{not json"})
+    stream_client.xadd("events", {EVENT_STREAM_FIELD: json.dumps({"user_id": "stream_user_x"})})
+
+    assert consumer.poll() == 5
+    assert count_events(db_session, "stream_user_") == 3
+    assert producer.stats()["pending"] == 0
+    assert consumer.stats()["written_total"] == 3
+    assert consumer.stats()["rejected_total"] == 2
+    assert consumer.poll() == 0
+
+
+def test_failed_write_keeps_entries_pending_for_restart(db_session, stream_client):
+    producer = EventStreamProducer(stream_client, "events", maxlen=1000)
+    producer.publish([payload(f"stream_retry_{i}") for i in range(2)])
+
+    consumer = make_consumer(stream_client, session_factory=broken_session)
+    with pytest.raises(OperationalError):
+        consumer.poll()
+    assert producer.stats()["pending"] == 2
+
+    # Restarted under the same name, the worker reads its own pending entries first
+    restarted = make_consumer(stream_client)
+    assert restarted.poll() == 2
+    assert count_events(db_session, "stream_retry_") == 2
+    assert producer.stats()["pending"] == 0
+
+
+def test_entries_of_a_dead_consumer_are_reclaimed(db_session, stream_client):
+    producer = EventStreamProducer(stream_client, "events", maxlen=1000)
+    producer.publish([payload("stream_claim_0")])
+    with pytest.raises(OperationalError):
+        make_consumer(stream_client, consumer="dead", session_factory=broken_session).poll()
+
+    other = make_consumer(stream_client, consumer="alive")
+    assert other.poll() == 1
+    assert other.stats()["claimed_total"] == 1
+    assert count_events(db_session, "stream_claim_") == 1
+
+
+def test_record_event_stream_transport(client, stream_client):
+    producer = EventStreamProducer(stream_client, "events", maxlen=1000)
+    event = {"user_id": "user1", "type": "purchase", "timestamp": "2025-12-08T21:00:00Z"}
+
+    with patch.object(config, "event_transport", "stream"), \
+         patch("api.events_routes.get_event_stream", return_value=producer), \
+         patch("api.events_routes.insert_event_to_db.delay") as mock_delay:
+        response = client.post("/events", json=event, headers=headers)
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response.json() == {"status": "accepted", "entry_id": "1-0"}
+
+        response = client.post("/events/batch", json=[event, {"user_id": "user2"}, event], headers=headers)
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response.json()["accepted"] == 2
+
+    mock_delay.assert_not_called()
+    assert len(stream_client.entries) == 3
+    assert json.loads(stream_client.entries[0][1][EVENT_STREAM_FIELD])["user_id"] == "user1"
+
+
+def test_record_event_stream_unavailable(client):
+    producer = EventStreamProducer(FakeStreamClient(), "events", maxlen=1000)
+    event = {"user_id": "user1", "type": "purchase"}
+
+    with patch.object(config, "event_transport", "stream"), \
+         patch("api.events_routes.get_event_stream", return_value=producer), \
+         patch.object(FakePipeline, "execute", side_effect=redis.ConnectionError("valkey is down")):
+        response = client.post("/events", json=event, headers=headers)
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+        response = client.post("/events/batch", json=[event], headers=headers)
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response.json()["accepted"] == 0
+
+    assert producer.stats()["failed_publishes"] == 2
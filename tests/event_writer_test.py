@@ -0,0 +1,77 @@
+import threading
+import pytest
+from datetime import datetime
+from sqlalchemy import event, func
+
+from data.database import Event
+from celery_tasks.batch_writer import EventBatchWriter
+from tests.conftest import engine, TestingSessionLocal
+
+
+def make_row(user_id, event_type="click", **extra):
+    return {"user_id": user_id, "type": event_type, "timestamp": datetime(2025, 12, 8, 21, 0), "properties_json": None, **extra}
+
+
+def count_events(db_session, user_prefix):
+    return db_session.query(func.count(Event.id)).filter(Event.user_id.like(f"{user_prefix}%")).scalar()
+
+
+def test_group_commit_across_messages(db_session):
+    writer = EventBatchWriter(session_factory=TestingSessionLocal, max_rows=100, max_wait_ms=200)
+    inserts = []
+    listener = lambda conn, cursor, statement, *args: inserts.append(statement) if statement.startswith("INSERT") else None
+    event.listen(engine, "before_cursor_execute", listener)
+
+    try:
+        # Ten concurrent "tasks", each submitting its own message
+        results = {}
+        threads = [
+            threading.Thread(target=lambda i=i: results.__setitem__(i, writer.submit([make_row(f"gc_{i}_a"), make_row(f"gc_{i}_b")])))
+            for i in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    assert results == {i: [] for i in range(10)}
+    assert count_events(db_session, "gc_") == 20
+    # Rows of several messages shared a multi-row INSERT
+    assert len(inserts) < 10
+
+
+def test_submit_times_out_and_withdraws_queued_rows(db_session):
+    writer = EventBatchWriter(session_factory=TestingSessionLocal, max_rows=100, max_wait_ms=0)
+    writing, stuck = threading.Event(), threading.Event()
+    write = writer.write
+    writer.write = lambda rows: (writing.set(), stuck.wait(5)) and write(rows)
+
+    first = threading.Thread(target=writer.submit, args=([make_row("timeout_taken")],))
+    first.start()
+    assert writing.wait(5)
+    # The flusher is stuck writing the first message, the second one is still queued
+    with pytest.raises(TimeoutError):
+        writer.submit([make_row("timeout_queued")], timeout=0.05)
+    stuck.set()
+    first.join()
+
+    assert count_events(db_session, "timeout_taken") == 1
+    assert writer.submit([make_row("timeout_next")], timeout=5) == []
+    # The withdrawn rows are left to the task retry
+    assert count_events(db_session, "timeout_queued") == 0
+
+
+def test_poison_row_is_isolated(db_session):
+    writer = EventBatchWriter(session_factory=TestingSessionLocal, max_rows=100, max_wait_ms=0)
+    assert writer.write([make_row("poison_seed")]) == []
+    existing_id = db_session.query(func.max(Event.id)).scalar()
+
+    # The duplicate primary key fails the multi-row INSERT, the other rows must still be written
+    poison = make_row("poison_dup", id=existing_id)
+    rejected = writer.submit([make_row("poison_ok_1"), poison, make_row("poison_ok_2")])
+
+    assert rejected == [poison]
+    assert count_events(db_session, "poison_ok") == 2
+    assert count_events(db_session, "poison_dup") == 0
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import pytest
+from fastapi import status
+from unittest.mock import patch, MagicMock
+from sqlalchemy import func
+from kombu.exceptions import OperationalError
+
+from data.database import Event
+from celery_tasks.event_tasks import insert_events_to_db
+from services import events
+
+headers = {"Authorization": "Bearer fake-client-token"}
+
+
+def fake_task(task_id="batch-task"):
+    result = MagicMock()
+    result.id = task_id
+    return result
+
+
+@patch("api.events_routes.insert_events_to_db.delay")
+def test_record_events_batch_json_array(mock_delay, client):
+    mock_delay.return_value = fake_task()
+    payload = [
+        {"user_id": "user1", "type": "purchase", "timestamp": "2025-12-08T21:00:00Z", "properties": {"amount": 10}},
+        {"user_id": "user2"},  # missing type
+        {"user_id": "user3", "type": "click", "timestamp": "2025-12-08T21:00:01Z"},
+    ]
+
+    response = client.post("/events/batch", json=payload, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data["status"] == "partial"
+    assert data["accepted"] == 2
+    assert data["task_ids"] == ["batch-task"]
+    assert [r["index"] for r in data["rejected"]] == [1]
+    assert data["rejected"][0]["errors"][0]["loc"] == ["type"]
+
+    # Both valid events go out in one task message
+    mock_delay.assert_called_once()
+    sent = mock_delay.call_args.args[0]
+    assert [e["user_id"] for e in sent] == ["user1", "user3"]
+    assert sent[0]["properties_json"] == json.dumps({"amount": 10})
+
+
+@patch("api.events_routes.insert_events_to_db.delay")
+@patch.object(events, "EVENT_TASK_BATCH_SIZE", 2)
+def test_record_events_batch_ndjson(mock_delay, client):
+    mock_delay.return_value = fake_task()
+    lines = [json.dumps({"user_id": f"user{i}", "type": "click"}) for i in range(5)]
+    lines.insert(2, "{not json")
+    body = "\n".join(lines) + "\n"
+
+    response = client.post(
+        "/events/batch",
+        content=body,
+        headers={**headers, "Content-Type": "application/x-ndjson"}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data["accepted"] == 5
+    assert [r["index"] for r in data["rejected"]] == [2]
+    # 5 events in messages of at most 2 events
+    assert [len(call.args[0]) for call in mock_delay.call_args_list] == [2, 2, 1]
+
+
+@patch("api.events_routes.insert_events_to_db.delay")
+@patch.object(events, "EVENT_TASK_BATCH_SIZE", 2)
+def test_record_events_batch_broker_unavailable(mock_delay, client):
+    mock_delay.side_effect = [fake_task("first-task"), OperationalError("connection refused")]
+    payload = [{"user_id": f"user{i}", "type": "click"} for i in range(5)]
+
+    response = client.post("/events/batch", json=payload, headers=headers)
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    data = response.json()
+    # The first message was enqueued before the broker went away
+    assert data["accepted"] == 2
+    assert data["task_ids"] == ["first-task"]
+
+
+@patch("api.events_routes.insert_event_to_db.delay")
+def test_record_event_broker_unavailable(mock_delay, client):
+    mock_delay.side_effect = OperationalError("connection refused")
+    response = client.post("/events", json={"user_id": "user1", "type": "click"}, headers=headers)
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+
+@patch("api.events_routes.insert_events_to_db.delay")
+def test_record_events_batch_malformed(mock_delay, client):
+    response = client.post("/events/batch", content='{"user_id": "u"}', headers={**headers, "Content-Type": "application/json"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    mock_delay.assert_not_called()
+
+
+def test_insert_events_to_db(db_session):
+    before = db_session.query(func.count(Event.id)).scalar()
+    payloads = [
+        {"user_id": "task_user", "type": "purchase", "timestamp": "2025-12-08T21:00:00+00:00", "properties_json": None},
+        {"user_id": "task_user", "type": "click", "timestamp": "2025-12-08T21:00:05+00:00", "properties_json": '{"a": 1}'},
+    ]
+
+    with patch("celery_tasks.event_tasks.get_db_session", return_value=db_session.__class__(bind=db_session.get_bind())):
+        insert_events_to_db.apply(args=[payloads])
+
+    assert db_session.query(func.count(Event.id)).scalar() == before + 2
+
+
+def test_iter_json_array_across_chunks():
+    body = json.dumps([{"user_id": "ü", "type": "click"}, {"user_id": "u2", "type": "purchase"}], ensure_ascii=False).encode()
+
+    async def chunks():
+        # One byte at a time splits every token and the multi byte character
+        for i in range(len(body)):
+            yield body[i:i + 1]
+
+    async def collect():
+        return [item async for item in events.iter_json_array(chunks())]
+
+    assert asyncio.run(collect()) == [{"user_id": "ü", "type": "click"}, {"user_id": "u2", "type": "purchase"}]
+
+
+def collect_array(chunks):
+    async def collect():
+        return [item async for item in events.iter_json_array(chunks)]
+    return asyncio.run(collect())
+
+
+def test_iter_json_array_fails_fast_on_invalid_element():
+    read = []
+
+    async def chunks():
+        yield b'[{"user_id": "u1"}, {"user_id": x'
+        for i in range(1000):
+            read.append(i)
+            yield b' ' * 1000
+
+    with pytest.raises(events.EventBatchFormatError):
+        collect_array(chunks())
+    # Not a cut element: the rest of the body is never buffered
+    assert read == []
+
+
+def test_iter_json_array_caps_element_size():
+    async def chunks():
+        yield b'[{"user_id": "'
+        for _ in range(100):
+            yield b"u" * 1024
+
+    with pytest.raises(events.EventBatchTooLarge):
+        collect_array(chunks())
+
+
+@patch("api.events_routes.insert_events_to_db.delay")
+def test_record_events_batch_oversized_event(mock_delay, client):
+    mock_delay.return_value = fake_task()
+    body = json.dumps([{"user_id": "u1", "type": "click"}] * 600 + [{"user_id": "u" * (events.MAX_EVENT_SIZE + 1), "type": "click"}])
+
+    chunks = (body[i:i + 4096].encode() for i in range(0, len(body), 4096))
+    response = client.post("/events/batch", content=chunks, headers={**headers, "Content-Type": "application/json"})
+    assert response.status_code == status.HTTP_413_CONTENT_TOO_LARGE
+    # The first chunk of events was enqueued before the oversized one arrived
+    assert response.json()["accepted"] == events.EVENT_TASK_BATCH_SIZE
+    assert response.json()["task_ids"] == ["batch-task"]
@@ -60,6 +60,57 @@ def test_get_assignment(client):
     assert "variant_name" in data
     assert data["variant_name"] in variants_name
 
+def test_get_batch_assignments(client):
+    exp_payload = {
+        "name": "Batch Test",
+        "variants": [
+            {"name": "Control", "allocation_percent": 50},
+            {"name": "Treatment", "allocation_percent": 50}
+        ]
+    }
+
+    headers = {"Authorization": "Bearer fake-client-token"}
+    exp_id = client.post("/experiments", json=exp_payload, headers=headers).json()["id"]
+
+    # Pre-assign one user through the single pair path
+    single = client.get(f"/experiments/{exp_id}/assignment/batch_user_1", headers=headers).json()
+
+    user_ids = ["batch_user_0", "batch_user_1", "batch_user_2", "batch_user_0"]
+    response = client.post(f"/experiments/{exp_id}/assignments", json={"user_ids": user_ids}, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert [a["user_id"] for a in data] == user_ids
+    assert data[1]["id"] == single["id"]
+    assert data[1]["variant_name"] == single["variant_name"]
+    assert data[0] == data[3]
+    assert all(a["experiment_id"] == exp_id and a["id"] for a in data)
+
+    # Assignments are idempotent across calls
+    again = client.post(f"/experiments/{exp_id}/assignments", json={"user_ids": user_ids}, headers=headers).json()
+    assert again == data
+
+    missing = client.post("/experiments/999999/assignments", json={"user_ids": ["u"]}, headers=headers)
+    assert missing.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_get_user_assignments(client):
+    headers = {"Authorization": "Bearer fake-client-token"}
+    exp_ids = []
+    for name in ("Page Test A", "Page Test B"):
+        payload = {"name": name, "variants": [{"name": "Control", "allocation_percent": 100}]}
+        exp_ids.append(client.post("/experiments", json=payload, headers=headers).json()["id"])
+
+    response = client.get("/users/page_user/assignments", headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    by_experiment = {a["experiment_id"]: a for a in data}
+    assert set(exp_ids) <= set(by_experiment)
+    assert all(by_experiment[exp_id]["variant_name"] == "Control" for exp_id in exp_ids)
+
+    single = client.get(f"/experiments/{exp_ids[0]}/assignment/page_user", headers=headers).json()
+    assert single["id"] == by_experiment[exp_ids[0]]["id"]
+
+
 @patch("api.events_routes.insert_event_to_db.delay")
 def test_record_event(mock_delay, client):
     payload = {
@@ -0,0 +1,83 @@
+import io
+import json
+import logging
+import threading
+
+import log
+from middleware import request_id_context
+
+
+def make_logger(name, handler):
+    logger = logging.getLogger(name)
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    return logger
+
+
+def test_queue_handler_keeps_request_id_and_traceback():
+    stream = io.StringIO()
+    output = logging.StreamHandler(stream)
+    output.setFormatter(log.JsonFormatter())
+    output.addFilter(log.ContextualFilter())
+    handler, listener = log.queue_handler([output])
+    handler.addFilter(log.ContextualFilter())
+    logger = make_logger("tests.logging.queue", handler)
+
+    token = request_id_context.set("req12345")
+    try:
+        logger.info("assigned %s", "user1")
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.exception("failed for %s", "user2")
+    finally:
+        request_id_context.reset(token)
+    # Written by the listener thread, outside the request context
+    listener.stop()
+
+    first, second = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert first["message"] == "assigned user1"
+    assert first["request_id"] == "req12345"
+    assert first["level"] == "INFO"
+    assert second["request_id"] == "req12345"
+    assert "ZeroDivisionError" in second["exc_info"]
+
+
+def test_sampling_filter_limits_info_only():
+    stream = io.StringIO()
+    logger = make_logger("tests.logging.sampled", logging.StreamHandler(stream))
+    sampler = log.SamplingFilter(max_per_second=5)
+    logger.addFilter(sampler)
+
+    for i in range(50):
+        logger.info("hot path %d", i)
+    logger.warning("always kept")
+
+    lines = stream.getvalue().splitlines()
+    # A new second may start during the loop, letting a few more through
+    assert 5 <= len(lines) - 1 <= 10
+    assert lines[-1] == "always kept"
+    assert sampler.dropped == 50 - (len(lines) - 1)
+
+    never = log.SamplingFilter(sample_rate=0)
+    assert not never.filter(logger.makeRecord(logger.name, logging.INFO, __file__, 1, "x", (), None))
+    assert never.filter(logger.makeRecord(logger.name, logging.ERROR, __file__, 1, "x", (), None))
+
+
+def test_sampling_filter_counts_every_thread():
+    logger = make_logger("tests.logging.threads", logging.NullHandler())
+    sampler = log.SamplingFilter(max_per_second=100)
+    record = logger.makeRecord(logger.name, logging.INFO, __file__, 1, "x", (), None)
+    kept = []
+
+    def emit():
+        kept.append(sum(sampler.filter(record) for _ in range(2000)))
+
+    threads = [threading.Thread(target=emit) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(kept) + sampler.dropped == 8 * 2000
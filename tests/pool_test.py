@@ -0,0 +1,58 @@
+import os
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from data.pool import InstrumentedQueuePool, dispose_after_fork, pool_stats
+from tests.conftest import SQLALCHEMY_DATABASE_URL
+
+
+def make_engine(**kwargs):
+    return create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        poolclass=InstrumentedQueuePool,
+        connect_args={"check_same_thread": False},
+        **kwargs
+    )
+
+
+def test_pool_stats_track_checkouts_and_timeouts():
+    engine = make_engine(pool_size=1, max_overflow=0, pool_timeout=0.05)
+    connection = engine.connect()
+    connection.execute(text("SELECT 1"))
+
+    stats = pool_stats(engine)
+    assert stats["pool"] == "InstrumentedQueuePool"
+    assert stats["checked_out"] == 1
+    assert stats["checkouts"] == 1
+
+    # Pool exhausted: the next checkout waits pool_timeout and fails
+    with pytest.raises(PoolTimeoutError):
+        engine.connect()
+    stats = pool_stats(engine)
+    assert stats["timeouts"] == 1
+    assert stats["wait_seconds_max"] >= 0.05
+
+    connection.close()
+    assert pool_stats(engine)["checked_in"] == 1
+    engine.dispose()
+
+
+def test_dispose_after_fork_drops_inherited_connections():
+    engine = make_engine(pool_size=2)
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+    assert pool_stats(engine)["checked_in"] == 1
+
+    dispose_after_fork(engine)
+
+    stats = pool_stats(engine)
+    assert stats["checked_in"] == 0
+    assert stats["pid"] == os.getpid()
+    engine.dispose()
+
+
+def test_stats_route_reports_db_pool(client):
+    response = client.get("/stats", headers={"Authorization": "Bearer fake-client-token"})
+    assert response.status_code == 200
+    assert "checked_out" in response.json()["db_pool"]
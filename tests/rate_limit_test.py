@@ -0,0 +1,87 @@
+import pytest
+from fastapi import status
+from unittest.mock import patch
+
+from auth.clients import ClientRegistry
+from auth.rate_limit import RATE_LIMIT_VALKEY, RateLimiter
+from config import _getenv_tokens, config
+
+headers = {"Authorization": "Bearer fake-client-token"}
+
+
+def test_registry_lookup_and_limits():
+    registry = ClientRegistry(
+        {"mobile": "token-a", "backend": "token-b"},
+        rate_limits={"backend": {"rate": 100, "burst": 300}},
+        rate=10
+    )
+    assert registry.authenticate("token-a") == ("mobile", 10.0, 10.0)
+    assert registry.authenticate("token-b") == ("backend", 100.0, 300.0)
+    # No substring matches
+    assert registry.authenticate("token") is None
+    assert registry.authenticate("token-a token-b") is None
+
+    listed = ClientRegistry(["token-a"])
+    assert listed.authenticate("token-a").name.startswith("client-")
+    assert listed.authenticate("token-a").rate == 0
+
+
+@pytest.mark.parametrize("value, expected", [
+    ('["token-a", "token-b"]', ["token-a", "token-b"]),
+    ('{"mobile": "token-a"}', {"mobile": "token-a"}),
+    ("token-a, token-b", ["token-a", "token-b"]),
+    # Valid JSON, but no list or object: still plain tokens
+    ("123456", ["123456"]),
+    ("123456,654321", ["123456", "654321"]),
+    ('"abc"', ['"abc"']),
+    ("[123456]", ["123456"]),
+    ("", []),
+])
+def test_valid_tokens_parsing(monkeypatch, value, expected):
+    monkeypatch.setenv("VALID_TOKENS", value)
+    assert _getenv_tokens("VALID_TOKENS") == expected
+
+
+def test_token_bucket_and_usage():
+    limiter = RateLimiter()
+    client = ClientRegistry({"mobile": "token-a"}, rate=0.01, burst=2).authenticate("token-a")
+
+    first, second, third = (limiter.check(client) for _ in range(3))
+    assert first.allowed and first.remaining == 1
+    assert second.allowed and second.remaining == 0
+    assert not third.allowed
+    assert third.retry_after > 0
+    assert limiter.stats()["clients"] == {"mobile": {"requests": 3, "limited": 1}}
+
+
+def test_shared_buckets_fall_back_to_local():
+    class BrokenValkey:
+        def register_script(self, script):
+            def run(keys, args):
+                raise ConnectionError("valkey is down")
+            return run
+
+    limiter = RateLimiter(RATE_LIMIT_VALKEY, BrokenValkey())
+    client = ClientRegistry({"mobile": "token-a"}, rate=0.01, burst=1).authenticate("token-a")
+    assert limiter.check(client).allowed
+    assert not limiter.check(client).allowed
+    assert limiter.stats()["shared_failures"] == 2
+
+
+def test_rate_limited_route(client):
+    with patch.object(config, "rate_limit_rate", 0.01), \
+         patch.object(config, "rate_limit_burst", 2), \
+         patch("auth.security.get_rate_limiter", return_value=RateLimiter()):
+        response = client.get("/stats", headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["X-RateLimit-Limit"] == "2"
+        assert response.headers["X-RateLimit-Remaining"] == "1"
+
+        assert client.get("/stats", headers=headers).status_code == status.HTTP_200_OK
+        response = client.get("/stats", headers=headers)
+        assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+        assert int(response.headers["Retry-After"]) >= 1
+
+    # Unknown tokens are still rejected first
+    response = client.get("/stats", headers={"Authorization": "Bearer fake"})
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
@@ -0,0 +1,112 @@
+from datetime import datetime
+
+from data.database import Assignment, Experiment, Variant
+from services import results
+from services.cache import get_cache_client
+from services.rollups import refresh_rollups_until_current
+
+headers = {"Authorization": "Bearer fake-client-token"}
+
+
+def make_experiment(db, name, users):
+    experiment = Experiment(name=name)
+    experiment.variants = [Variant(name="control", allocation_percent=100)]
+    db.add(experiment)
+    db.commit()
+    add_assignments(db, experiment, users)
+    return experiment
+
+
+def add_assignments(db, experiment, users):
+    db.add_all([
+        Assignment(experiment_id=experiment.id, user_id=user_id, variant_name="control", assigned_at=datetime(2025, 4, 1))
+        for user_id in users
+    ])
+    db.commit()
+    refresh_rollups_until_current(db)
+
+
+def make_stale(experiment_id):
+    cache = get_cache_client()
+    key = results.results_cache_key(experiment_id, "purchase", None)
+    entry = cache.get_results(key)
+    entry["computed_at"] -= 3600
+    cache.set_results(key, entry, ex=300)
+    return key
+
+
+def test_results_etag_and_not_modified(client, db_session):
+    experiment = make_experiment(db_session, "results_etag", ["etag_u1"])
+
+    response = client.get(f"/experiments/{experiment.id}/results", headers=headers)
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert etag.startswith('"') and etag.endswith('"')
+    assert response.json()["variant_data"]["control"]["total_assignments"] == 1
+
+    response = client.get(f"/experiments/{experiment.id}/results", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+
+    response = client.get(f"/experiments/{experiment.id}/results", headers={**headers, "If-None-Match": '"other", W/' + etag})
+    assert response.status_code == 304
+
+
+def test_stale_results_are_served_then_refreshed_in_background(client, db_session):
+    experiment = make_experiment(db_session, "results_swr", ["swr_u1"])
+    first = client.get(f"/experiments/{experiment.id}/results", headers=headers)
+
+    add_assignments(db_session, experiment, ["swr_u2"])
+    make_stale(experiment.id)
+
+    # The stale entry answers the poll, the refresh runs after the response
+    stale = client.get(f"/experiments/{experiment.id}/results", headers=headers)
+    assert stale.headers["etag"] == first.headers["etag"]
+    assert stale.json()["variant_data"]["control"]["total_assignments"] == 1
+
+    fresh = client.get(f"/experiments/{experiment.id}/results", headers=headers)
+    assert fresh.headers["etag"] != first.headers["etag"]
+    assert fresh.json()["variant_data"]["control"]["total_assignments"] == 2
+
+
+def test_stale_refresh_is_single_flight(client, db_session):
+    experiment = make_experiment(db_session, "results_single_flight", ["sf_u1"])
+    first = client.get(f"/experiments/{experiment.id}/results", headers=headers)
+
+    add_assignments(db_session, experiment, ["sf_u2"])
+    key = make_stale(experiment.id)
+    # Another worker is already recomputing this key
+    token = get_cache_client().acquire_results_refresh(key)
+    assert token
+
+    for _ in range(3):
+        response = client.get(f"/experiments/{experiment.id}/results", headers=headers)
+        assert response.headers["etag"] == first.headers["etag"]
+
+    get_cache_client().release_results_refresh(key, token)
+
+
+def test_expired_refresh_lock_is_not_released_by_its_old_holder():
+    cache = get_cache_client()
+    key = "results:refresh_lock_test"
+    stale_holder = cache.acquire_results_refresh(key)
+    # The lock expired during the refresh and another worker took it
+    cache.backend.delete(f"{key}:refresh")
+    current_holder = cache.acquire_results_refresh(key)
+
+    cache.release_results_refresh(key, stale_holder)
+    assert cache.acquire_results_refresh(key) is None
+
+    cache.release_results_refresh(key, current_holder)
+    next_holder = cache.acquire_results_refresh(key)
+    assert next_holder
+    cache.release_results_refresh(key, next_holder)
+
+
+def test_unchanged_results_keep_etag_and_body(db_session):
+    experiment = make_experiment(db_session, "results_same_body", ["same_u1"])
+    entry = results.compute_results_entry(db_session, experiment.id, "purchase", None)
+    again = results.compute_results_entry(db_session, experiment.id, "purchase", None, previous=entry)
+    assert again["etag"] == entry["etag"]
+    assert again["body"] == entry["body"]
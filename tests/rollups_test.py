@@ -0,0 +1,178 @@
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from sqlalchemy import func
+
+from config import config
+from data.database import Assignment, Event, Experiment, RollupGap, Variant
+from services import results
+from services.attribution import attribute_new_events_until_current
+from services.cache import get_mock_cache_client
+from services.rollups import bucket_start, refresh_rollups, refresh_rollups_until_current
+
+
+def make_experiment(db, name):
+    experiment = Experiment(name=name, created_at=datetime(2024, 1, 1))
+    experiment.variants = [Variant(name="control", allocation_percent=50), Variant(name="treatment", allocation_percent=50)]
+    db.add(experiment)
+    db.commit()
+    return experiment
+
+
+def refresh_results(db):
+    attribute_new_events_until_current(db, get_mock_cache_client())
+    refresh_rollups_until_current(db)
+
+
+def test_rollups_match_raw_results(db_session):
+    experiment = make_experiment(db_session, "rollup_match")
+    assigned_at = datetime(2025, 1, 1, 10, 30)
+    db_session.add_all([
+        Assignment(experiment_id=experiment.id, user_id="rollup_u1", variant_name="control", assigned_at=assigned_at),
+        Assignment(experiment_id=experiment.id, user_id="rollup_u2", variant_name="treatment", assigned_at=assigned_at),
+        Assignment(experiment_id=experiment.id, user_id="rollup_u3", variant_name="treatment", assigned_at=assigned_at),
+        # before assignment, never counted
+        Event(user_id="rollup_u1", type="purchase", timestamp=assigned_at - timedelta(minutes=5)),
+        Event(user_id="rollup_u1", type="purchase", timestamp=assigned_at + timedelta(minutes=5)),
+        Event(user_id="rollup_u2", type="purchase", timestamp=assigned_at + timedelta(hours=2)),
+        Event(user_id="rollup_u2", type="signup", timestamp=assigned_at + timedelta(hours=2)),
+    ])
+    db_session.commit()
+
+    refresh_results(db_session)
+
+    from_rollups = results.calculate_summary(db_session, experiment.id, "purchase", None, use_rollups=True)
+    raw = results.calculate_summary(db_session, experiment.id, "purchase", None, use_rollups=False)
+    assert from_rollups.variant_data == raw.variant_data
+    assert from_rollups.variant_data["control"].conversion_count == 1
+    assert from_rollups.variant_data["treatment"].total_assignments == 2
+    assert from_rollups.variant_data["treatment"].conversion_count == 1
+
+    # start filter works on hourly buckets
+    later = results.calculate_summary(db_session, experiment.id, "purchase", assigned_at + timedelta(hours=1), use_rollups=True)
+    assert later.variant_data["control"].conversion_count == 0
+    assert later.variant_data["treatment"].conversion_count == 1
+
+
+def test_refresh_is_incremental_and_counts_late_events(db_session):
+    experiment = make_experiment(db_session, "rollup_incremental")
+    assigned_at = datetime(2025, 2, 1, 8, 0)
+    db_session.add(Assignment(experiment_id=experiment.id, user_id="rollup_late", variant_name="control", assigned_at=assigned_at))
+    db_session.add(Event(user_id="rollup_late", type="purchase", timestamp=assigned_at + timedelta(days=1)))
+    db_session.commit()
+    refresh_results(db_session)
+
+    # Nothing new: a refresh folds nothing and does not double count
+    assert refresh_rollups(db_session) == {"assignments": 0, "events": 0}
+
+    # An event arriving late, with a timestamp in an older bucket
+    db_session.add(Event(user_id="rollup_late", type="purchase", timestamp=assigned_at + timedelta(minutes=10)))
+    db_session.commit()
+    attribute_new_events_until_current(db_session, get_mock_cache_client())
+    assert refresh_rollups(db_session) == {"assignments": 0, "events": 1}
+
+    summary = results.calculate_summary(db_session, experiment.id, "purchase", None, use_rollups=True)
+    assert summary.variant_data["control"].total_assignments == 1
+    assert summary.variant_data["control"].conversion_count == 2
+
+
+def test_bucket_start_is_hourly():
+    assert bucket_start(datetime(2025, 1, 1, 10, 59, 59, 999)) == datetime(2025, 1, 1, 10, 0)
+
+
+def test_results_route_raw_param(client, db_session):
+    experiment = make_experiment(db_session, "rollup_route")
+    db_session.add(Assignment(experiment_id=experiment.id, user_id="rollup_route_u", variant_name="control", assigned_at=datetime(2025, 3, 1)))
+    db_session.commit()
+    headers = {"Authorization": "Bearer fake-client-token"}
+
+    # Not folded yet, only the raw path sees the assignment
+    response = client.get(f"/experiments/{experiment.id}/results?raw=true", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["variant_data"]["control"]["total_assignments"] == 1
+
+    refresh_rollups_until_current(db_session)
+    response = client.get(f"/experiments/{experiment.id}/results", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["variant_data"]["control"]["total_assignments"] == 1
+
+
+def test_results_with_conversions_ahead_of_assignments(client, db_session):
+    headers = {"Authorization": "Bearer fake-client-token"}
+    cache = get_mock_cache_client()
+    refresh_results(db_session)
+
+    # Attributed against a write-behind assignment that is still only in the cache
+    cached = make_experiment(db_session, "rollup_cached_assignment")
+    cache.set_assignment(Assignment(experiment_id=cached.id, user_id="rollup_cached_u", variant_name="treatment", assigned_at=datetime(2025, 4, 1)))
+    db_session.add(Event(user_id="rollup_cached_u", type="purchase", timestamp=datetime(2025, 4, 2)))
+    db_session.commit()
+    attribute_new_events_until_current(db_session, cache)
+    refresh_rollups_until_current(db_session)
+
+    for query in ("", "?raw=true"):
+        response = client.get(f"/experiments/{cached.id}/results{query}", headers=headers)
+        assert response.status_code == 200
+        variant_data = response.json()["variant_data"]
+        assert variant_data["treatment"]["total_assignments"] == 0
+        assert variant_data["treatment"]["conversion_count"] == 1
+        assert variant_data["control"]["total_assignments"] == 0
+
+    # Conversions folded while the converting user's assignment waits for the next batch
+    lagging = make_experiment(db_session, "rollup_lagging_assignment")
+    assigned_at = datetime(2025, 4, 1)
+    db_session.add_all([
+        Assignment(experiment_id=lagging.id, user_id="rollup_lag_u1", variant_name="control", assigned_at=assigned_at),
+        Assignment(experiment_id=lagging.id, user_id="rollup_lag_u2", variant_name="control", assigned_at=assigned_at),
+    ])
+    db_session.commit()
+    db_session.add(Assignment(experiment_id=lagging.id, user_id="rollup_lag_u3", variant_name="treatment", assigned_at=assigned_at))
+    db_session.add(Event(user_id="rollup_lag_u3", type="purchase", timestamp=assigned_at + timedelta(hours=1)))
+    db_session.commit()
+    attribute_new_events_until_current(db_session, cache)
+    assert refresh_rollups(db_session, batch_size=2) == {"assignments": 2, "events": 1}
+
+    response = client.get(f"/experiments/{lagging.id}/results", headers=headers)
+    assert response.status_code == 200
+    variant_data = response.json()["variant_data"]
+    assert variant_data["control"]["total_assignments"] == 2
+    assert variant_data["treatment"] == {"total_assignments": 0, "conversion_count": 1, "conversion_rate": 0.0}
+
+
+def test_rows_committed_out_of_id_order_are_folded(db_session):
+    experiment = make_experiment(db_session, "rollup_out_of_order")
+    refresh_results(db_session)
+    assignment_id = (db_session.query(func.max(Assignment.id)).scalar() or 0) + 1
+    event_id = (db_session.query(func.max(Event.id)).scalar() or 0) + 1
+    assigned_at = datetime(2025, 5, 1)
+
+    # Ids allocated in order, the transaction holding the lower ones commits last
+    db_session.add_all([
+        Assignment(id=assignment_id + 1, experiment_id=experiment.id, user_id="rollup_order_u2", variant_name="treatment", assigned_at=assigned_at),
+        Event(id=event_id + 1, user_id="rollup_order_u2", type="purchase", timestamp=assigned_at + timedelta(hours=1)),
+    ])
+    db_session.commit()
+    refresh_results(db_session)
+    gaps = {(gap.source, gap.low_id, gap.high_id) for gap in db_session.query(RollupGap)}
+    assert {("assignments", assignment_id, assignment_id), ("attribution", event_id, event_id), ("events", event_id, event_id)} <= gaps
+
+    db_session.add_all([
+        Assignment(id=assignment_id, experiment_id=experiment.id, user_id="rollup_order_u1", variant_name="control", assigned_at=assigned_at),
+        Event(id=event_id, user_id="rollup_order_u1", type="purchase", timestamp=assigned_at + timedelta(hours=1)),
+    ])
+    db_session.commit()
+    refresh_results(db_session)
+
+    summary = results.calculate_summary(db_session, experiment.id, "purchase", None, use_rollups=True)
+    raw = results.calculate_summary(db_session, experiment.id, "purchase", None, use_rollups=False)
+    assert summary.variant_data == raw.variant_data
+    assert summary.variant_data["control"].total_assignments == 1
+    assert summary.variant_data["control"].conversion_count == 1
+    assert summary.variant_data["treatment"].conversion_count == 1
+    assert db_session.query(RollupGap).filter(RollupGap.low_id <= event_id, RollupGap.high_id >= event_id).count() == 0
+
+    # Ids that never commit (rolled back inserts) are dropped after the timeout
+    db_session.add(Assignment(id=assignment_id + 3, experiment_id=experiment.id, user_id="rollup_order_u3", variant_name="control", assigned_at=assigned_at))
+    db_session.commit()
+    with patch.object(config, "rollup_gap_timeout", -1):
+        assert refresh_rollups(db_session)["assignments"] == 1
+    assert db_session.query(RollupGap).filter(RollupGap.source == "assignments").count() == 0
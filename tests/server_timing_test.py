@@ -0,0 +1,61 @@
+import time
+from fastapi import FastAPI, status
+from fastapi.testclient import TestClient
+
+import timing
+from middleware import RequestIDMiddleware
+
+headers = {"Authorization": "Bearer fake-client-token"}
+
+
+def server_timing_metrics(response):
+    return {metric.split(";")[0]: float(metric.split("dur=")[1]) for metric in response.headers["Server-Timing"].split(", ")}
+
+
+def test_nested_measurements_count_once():
+    timings = timing.RequestTimings()
+    timings.enter("cache")
+    time.sleep(0.01)
+    timings.enter("db")
+    time.sleep(0.02)
+    timings.exit()
+    timings.exit()
+
+    # The database time is not counted as cache time too
+    assert timings.durations["db"] >= 0.02
+    assert 0.01 <= timings.durations["cache"] < timings.durations["db"]
+    assert timings.header(0.05).endswith("total;dur=50.000")
+
+
+def test_assignment_server_timing(client):
+    exp_payload = {
+        "name": "Server Timing Test",
+        "variants": [
+            {"name": "Control", "allocation_percent": 0.5},
+            {"name": "Treatment", "allocation_percent": 0.5}
+        ]
+    }
+    exp_id = client.post("/experiments", json=exp_payload, headers=headers).json()["id"]
+
+    response = client.get(f"/experiments/{exp_id}/assignment/timing_user", headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["X-Request-ID"]
+    metrics = server_timing_metrics(response)
+    assert {"auth", "cache", "db", "app", "serialize", "total"} <= set(metrics)
+    assert sum(duration for name, duration in metrics.items() if name != "total") <= metrics["total"]
+
+
+def test_request_id_contract():
+    app = FastAPI()
+    app.add_middleware(RequestIDMiddleware, server_timing=False)
+
+    @app.get("/request-id")
+    def request_id():
+        # What log.ContextualFilter reads for every record of the request
+        return {"request_id": RequestIDMiddleware.request_id_context().get()}
+
+    with TestClient(app) as test_client:
+        response = test_client.get("/request-id")
+    assert response.json()["request_id"] == response.headers["X-Request-ID"]
+    assert "Server-Timing" not in response.headers
+    assert RequestIDMiddleware.request_id_context().get() == "N/A"
@@ -0,0 +1,69 @@
+from datetime import datetime, timezone
+from sqlalchemy import func
+
+from data.database import Assignment
+from services.write_behind import AssignmentWriteBehind
+from tests.conftest import TestingSessionLocal
+
+
+def make_assignment(user_id, variant_name="A", experiment_id=515151):
+    return Assignment(experiment_id=experiment_id, user_id=user_id, variant_name=variant_name, assigned_at=datetime.now(timezone.utc))
+
+
+def test_flush_bulk_inserts_and_ignores_duplicates(db_session):
+    writer = AssignmentWriteBehind(session_factory=TestingSessionLocal, flush_interval_ms=60000, max_rows=2)
+    for i in range(5):
+        writer.enqueue(make_assignment(f"wb_user_{i}"))
+    # Already persisted by another worker
+    writer.enqueue(make_assignment("wb_user_0", variant_name="B"))
+    assert writer.stats()["queue_depth"] == 6
+
+    assert writer.flush() == 6
+
+    rows = db_session.query(Assignment).filter(Assignment.experiment_id == 515151).all()
+    assert sorted(r.user_id for r in rows) == [f"wb_user_{i}" for i in range(5)]
+    assert {r.variant_name for r in rows} == {"A"}
+    stats = writer.stats()
+    assert stats["queue_depth"] == 0
+    assert stats["flushed_total"] == 6
+    writer.close()
+
+
+def test_failed_flush_keeps_rows(db_session):
+    def broken_session():
+        raise ConnectionError("database is down")
+
+    writer = AssignmentWriteBehind(session_factory=broken_session, flush_interval_ms=60000)
+    writer.enqueue(make_assignment("wb_retry", experiment_id=525252))
+
+    try:
+        writer.flush()
+    except ConnectionError:
+        pass
+    assert writer.stats()["queue_depth"] == 1
+    assert writer.stats()["failed_flushes"] == 1
+
+    # Database is back
+    writer.session_factory = TestingSessionLocal
+    assert writer.flush() == 1
+    assert db_session.query(func.count(Assignment.id)).filter(Assignment.experiment_id == 525252).scalar() == 1
+    writer.close()
+
+
+def test_rejected_row_is_dropped_without_blocking_the_queue(db_session):
+    writer = AssignmentWriteBehind(session_factory=TestingSessionLocal, flush_interval_ms=60000, max_rows=10)
+    writer.enqueue(make_assignment("wb_good_1", experiment_id=535353))
+    poison = make_assignment("wb_poison", experiment_id=535353)
+    poison.assigned_at = "not a timestamp"
+    writer.enqueue(poison)
+    writer.enqueue(make_assignment("wb_good_2", experiment_id=535353))
+
+    assert writer.flush() == 3
+
+    rows = db_session.query(Assignment).filter(Assignment.experiment_id == 535353).all()
+    assert sorted(r.user_id for r in rows) == ["wb_good_1", "wb_good_2"]
+    stats = writer.stats()
+    assert stats["queue_depth"] == 0
+    assert stats["rejected_total"] == 1
+    assert stats["failed_flushes"] == 0
+    writer.close()
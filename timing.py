@@ -0,0 +1,96 @@
+from contextvars import ContextVar, Token
+from contextlib import contextmanager
+import functools
+import inspect
+import time
+
+# Order of the Server-Timing metrics, names measured elsewhere are appended after them
+SERVER_TIMING_ORDER = ("auth", "cache", "db", "app", "serialize")
+
+
+class RequestTimings:
+    """
+    Time spent per component in one request, each component only counting its own
+    time: a database load inside a cache call counts as db, not as cache.
+    The threadpool runs sync routes on a copy of the request context, the copy
+    holds this same object, so their measurements land in the request's timings.
+    """
+
+    def __init__(self):
+        self.durations: dict[str, float] = {}
+        self._stack: list[list] = []    # [name, started, time spent in nested measurements]
+
+    def enter(self, name: str):
+        self._stack.append([name, time.perf_counter(), 0.0])
+
+    def exit(self):
+        if not self._stack:
+            return
+        name, started, nested = self._stack.pop()
+        elapsed = time.perf_counter() - started
+        self.durations[name] = self.durations.get(name, 0.0) + elapsed - nested
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def header(self, total: float) -> str:
+        """Server-Timing header value, durations in milliseconds."""
+        names = [name for name in SERVER_TIMING_ORDER if name in self.durations]
+        names += [name for name in self.durations if name not in SERVER_TIMING_ORDER]
+        metrics = [f"{name};dur={self.durations[name] * 1000:.3f}" for name in names]
+        metrics.append(f"total;dur={total * 1000:.3f}")
+        return ", ".join(metrics)
+
+
+# Timings of the current request, set by the RequestIDMiddleware (None outside requests)
+request_timings_context: ContextVar[RequestTimings | None] = ContextVar("request_timings", default=None)
+
+
+def start() -> Token:
+    return request_timings_context.set(RequestTimings())
+
+def reset(token: Token):
+    request_timings_context.reset(token)
+
+def current() -> RequestTimings | None:
+    return request_timings_context.get()
+
+
+@contextmanager
+def measure(name: str):
+    timings = request_timings_context.get()
+    if timings is None:
+        yield
+        return
+    timings.enter(name)
+    try:
+        yield
+    finally:
+        timings.exit()
+
+
+def timed(name: str):
+    """Decorator measuring every call of a function or coroutine function as name."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with measure(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with measure(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def timed_methods(name: str):
+    """Class decorator measuring every public method as name."""
+    def decorator(cls):
+        for attr, value in list(vars(cls).items()):
+            if not attr.startswith("_") and inspect.isfunction(value):
+                setattr(cls, attr, timed(name)(value))
+        return cls
+    return decorator